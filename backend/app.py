@@ -6,7 +6,7 @@ from flask_cors import CORS
 from backend.config import Config
 from backend.routes import register_routes
 from flask_jwt_extended import JWTManager
-from backend.db import Base, engine
+from backend.db import Base, engine, add_missing_columns
 from backend.db import SessionLocal
 from backend.models import User
 from werkzeug.security import generate_password_hash
@@ -64,6 +64,30 @@ def _ensure_admin_from_env(logger):
         db.close()
 
 
+def _upgrade_schema(logger):
+    # create_all 不会修改已存在的表，这里为旧库补充新增的列
+    try:
+        added = add_missing_columns()
+        if added:
+            logger.info(f"🗄️ 已为数据库补充新列: {added}")
+    except Exception as e:
+        logger.error(f"❌ 数据库结构升级失败: {e}")
+
+
+def _migrate_image_blobs(logger):
+    # 旧版本把图片二进制存在 images 表中，启动时一次性迁移到 blob 存储
+    # 迁移失败时旧的 NOT NULL BLOB 列仍在，之后每次写入图片都会失败，直接终止启动
+    try:
+        from backend.services.image_storage import migrate_legacy_blobs
+        migrate_legacy_blobs()
+    except Exception as e:
+        logger.error(f"❌ 图片 BLOB 迁移失败: {e}")
+        raise RuntimeError(
+            f"图片 BLOB 迁移失败，服务未启动: {e}\n"
+            "解决方案：检查数据库连接和 blob 存储目录权限后重启（迁移可重复执行）"
+        ) from e
+
+
 def create_app():
     # 设置日志
     logger = setup_logging()
@@ -137,6 +161,8 @@ def create_app():
     })
 
     Base.metadata.create_all(engine)
+    _upgrade_schema(logger)
+    _migrate_image_blobs(logger)
     _ensure_admin_from_env(logger)
     # 注册所有 API 路由
     register_routes(app)
@@ -167,6 +193,7 @@ def create_app():
                     "health": "/api/health",
                     "outline": "POST /api/outline",
                     "generate": "POST /api/generate",
+                    "job_events": "GET /api/jobs/<job_id>/events",
                     "images": "GET /api/images/<filename>"
                 }
             }
@@ -223,12 +250,22 @@ def _start_background_tasks(app, logger):
                         res = service.cleanup_expired_records()
                         if res["deleted_count"] > 0:
                             logger.info(f"🧹 清理完成: 删除了 {res['deleted_count']} 条过期记录")
+                        if Config.get_prompt_cache_enabled():
+                            from backend.services import prompt_cache
+                            prompt_cache.evict()
                     except Exception as e:
                         logger.error(f"❌ 清理任务异常: {e}")
 
         thread = threading.Thread(target=cleanup_loop, daemon=True)
         thread.start()
 
+        # 启动图片生成任务队列，继续执行上次进程退出时中断的任务
+        try:
+            from backend.services.job_queue import get_job_queue
+            get_job_queue().ensure_started()
+        except Exception as e:
+            logger.error(f"❌ 图片生成任务队列启动失败: {e}")
+
 
 if __name__ == '__main__':
     app = create_app()
@@ -61,6 +61,263 @@ class Config:
         os.makedirs(history_dir, exist_ok=True)
         return history_dir
 
+    @classmethod
+    def get_blob_dir(cls):
+        """获取图片二进制存储目录（可通过环境变量 BLOB_STORE_DIR 覆盖）"""
+        import os
+        blob_dir = os.getenv('BLOB_STORE_DIR') or os.path.join(cls._get_data_dir(), "blobs")
+        os.makedirs(blob_dir, exist_ok=True)
+        return blob_dir
+
+    @classmethod
+    def get_image_send_mode(cls):
+        """
+        获取图片文件发送方式（环境变量 IMAGE_SEND_MODE）
+
+        - send_file: 由 Flask/Werkzeug 直接流式发送文件（默认）
+        - x-sendfile: 返回 X-Sendfile 头，由 Apache/lighttpd 等前置服务器发送
+        - x-accel-redirect: 返回 X-Accel-Redirect 头，由 Nginx internal location 发送
+        """
+        import os
+        return os.getenv('IMAGE_SEND_MODE', 'send_file').strip().lower()
+
+    @classmethod
+    def get_accel_redirect_prefix(cls):
+        """获取 X-Accel-Redirect 路径前缀（需在 Nginx 中映射到 blob 存储目录）"""
+        import os
+        return os.getenv('IMAGE_ACCEL_REDIRECT_PREFIX', '/_blobs/')
+
+    @classmethod
+    def get_image_rendition_widths(cls):
+        """
+        获取保存图片时生成的多尺寸版本宽度列表（环境变量 IMAGE_RENDITION_WIDTHS，逗号分隔）
+
+        默认 256,720,1440；设置为空字符串则不生成。
+        """
+        import os
+        value = os.getenv('IMAGE_RENDITION_WIDTHS', '256,720,1440')
+        widths = set()
+        for part in value.split(','):
+            part = part.strip()
+            if part.isdigit() and int(part) > 0:
+                widths.add(int(part))
+        return sorted(widths)
+
+    @classmethod
+    def get_image_rendition_formats(cls):
+        """
+        获取多尺寸版本的输出格式（环境变量 IMAGE_RENDITION_FORMATS，逗号分隔）
+
+        默认 jpeg,webp,avif；jpeg 作为兜底格式总会生成，Pillow 不支持的格式会被跳过。
+        """
+        import os
+        value = os.getenv('IMAGE_RENDITION_FORMATS', 'jpeg,webp,avif')
+        formats = ['jpeg']
+        for part in value.split(','):
+            part = part.strip().lower()
+            if part == 'jpg':
+                part = 'jpeg'
+            if part in ('webp', 'avif') and part not in formats:
+                formats.append(part)
+        return formats
+
+    @classmethod
+    def get_image_pool_mode(cls):
+        """
+        获取图片处理（解码/缩放/编码）的执行方式（环境变量 IMAGE_POOL_MODE）
+
+        - process: 进程池（默认），避免与请求处理线程争抢 GIL
+        - thread: 线程池（测试或不便创建子进程的环境）
+        - inline: 在调用线程中直接执行
+        """
+        import os
+        mode = os.getenv('IMAGE_POOL_MODE', 'process').strip().lower()
+        return mode if mode in ('process', 'thread', 'inline') else 'process'
+
+    @classmethod
+    def get_image_pool_workers(cls):
+        """获取图片处理池大小（环境变量 IMAGE_POOL_WORKERS，默认 CPU 核数，最多 4）"""
+        import os
+        value = os.getenv('IMAGE_POOL_WORKERS')
+        if value is not None and value.strip().lstrip('-').isdigit():
+            return int(value)
+        return min(4, os.cpu_count() or 1)
+
+    @classmethod
+    def get_job_workers(cls):
+        """获取图片生成后台任务的工作线程数（环境变量 JOB_WORKERS，默认 2）"""
+        import os
+        value = os.getenv('JOB_WORKERS', '2').strip()
+        return max(1, int(value)) if value.isdigit() else 2
+
+    @classmethod
+    def get_job_stale_seconds(cls):
+        """运行中任务的心跳超时时间（秒），超时视为进程已中断（环境变量 JOB_STALE_SECONDS，默认 120）"""
+        import os
+        value = os.getenv('JOB_STALE_SECONDS', '120').strip()
+        return max(10, int(value)) if value.isdigit() else 120
+
+    @classmethod
+    def get_job_max_attempts(cls):
+        """任务中断后最多执行次数（环境变量 JOB_MAX_ATTEMPTS，默认 3）"""
+        import os
+        value = os.getenv('JOB_MAX_ATTEMPTS', '3').strip()
+        return max(1, int(value)) if value.isdigit() else 3
+
+    @classmethod
+    def get_job_event_retention_hours(cls):
+        """已结束任务（及其进度事件）的保留时长（小时，环境变量 JOB_EVENT_RETENTION_HOURS，默认 24）"""
+        import os
+        value = os.getenv('JOB_EVENT_RETENTION_HOURS', '24').strip()
+        return max(1, int(value)) if value.isdigit() else 24
+
+    @classmethod
+    def get_schedule_default_weight(cls):
+        """普通用户的默认调度权重（环境变量 SCHEDULE_DEFAULT_WEIGHT，默认 1）"""
+        import os
+        value = os.getenv('SCHEDULE_DEFAULT_WEIGHT', '1').strip()
+        return max(1, int(value)) if value.isdigit() else 1
+
+    @classmethod
+    def get_schedule_admin_weight(cls):
+        """管理员的默认调度权重（环境变量 SCHEDULE_ADMIN_WEIGHT，默认 4）"""
+        import os
+        value = os.getenv('SCHEDULE_ADMIN_WEIGHT', '4').strip()
+        return max(1, int(value)) if value.isdigit() else 4
+
+    @classmethod
+    def get_circuit_failure_threshold(cls):
+        """服务商端点连续失败多少次后熔断（环境变量 CIRCUIT_FAILURE_THRESHOLD，默认 5）"""
+        import os
+        value = os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5').strip()
+        return max(1, int(value)) if value.isdigit() else 5
+
+    @classmethod
+    def get_circuit_reset_seconds(cls):
+        """熔断后多少秒进入半开状态发送探测请求（环境变量 CIRCUIT_RESET_SECONDS，默认 30）"""
+        import os
+        value = os.getenv('CIRCUIT_RESET_SECONDS', '30').strip()
+        return max(1, int(value)) if value.isdigit() else 30
+
+    @classmethod
+    def get_image_hedging(cls):
+        """是否开启图片生成请求对冲（环境变量 IMAGE_HEDGING，默认关闭）"""
+        import os
+        return os.getenv('IMAGE_HEDGING', 'false').strip().lower() in ('1', 'true', 'yes', 'on')
+
+    @classmethod
+    def get_image_hedge_percentile(cls):
+        """上游请求耗时超过服务商最近延迟的多少分位数时发出对冲请求（环境变量 IMAGE_HEDGE_PERCENTILE，默认 95）"""
+        import os
+        value = os.getenv('IMAGE_HEDGE_PERCENTILE', '95').strip()
+        return min(99, max(50, int(value))) if value.isdigit() else 95
+
+    @classmethod
+    def get_image_hedge_min_samples(cls):
+        """服务商至少有多少次成功请求的延迟样本后才对冲（环境变量 IMAGE_HEDGE_MIN_SAMPLES，默认 20）"""
+        import os
+        value = os.getenv('IMAGE_HEDGE_MIN_SAMPLES', '20').strip()
+        return max(1, int(value)) if value.isdigit() else 20
+
+    @classmethod
+    def get_image_hedge_target(cls):
+        """
+        对冲请求发给哪个服务商（环境变量 IMAGE_HEDGE_TARGET）
+
+        - next: 路由中的下一个服务商（默认，未配置 routing 时为同一服务商）
+        - same: 同一服务商
+        """
+        import os
+        target = os.getenv('IMAGE_HEDGE_TARGET', 'next').strip().lower()
+        return target if target in ('next', 'same') else 'next'
+
+    @classmethod
+    def get_outline_cache_ttl(cls):
+        """大纲生成结果缓存的有效期（秒，环境变量 OUTLINE_CACHE_TTL，默认 600，0 表示不缓存）"""
+        import os
+        value = os.getenv('OUTLINE_CACHE_TTL', '600').strip()
+        return int(value) if value.isdigit() else 600
+
+    @classmethod
+    def get_outline_cache_size(cls):
+        """大纲生成结果缓存的最大条目数（环境变量 OUTLINE_CACHE_SIZE，默认 256）"""
+        import os
+        value = os.getenv('OUTLINE_CACHE_SIZE', '256').strip()
+        return max(1, int(value)) if value.isdigit() else 256
+
+    @classmethod
+    def get_prompt_cache_enabled(cls):
+        """是否开启图片生成结果缓存（相同 prompt 和参数直接复用上次的图片，环境变量 IMAGE_PROMPT_CACHE，默认关闭）"""
+        import os
+        return os.getenv('IMAGE_PROMPT_CACHE', 'false').strip().lower() in ('1', 'true', 'yes', 'on')
+
+    @classmethod
+    def get_prompt_cache_ttl_hours(cls):
+        """图片生成缓存的有效期（小时，环境变量 IMAGE_PROMPT_CACHE_TTL_HOURS，默认 168）"""
+        import os
+        value = os.getenv('IMAGE_PROMPT_CACHE_TTL_HOURS', '168').strip()
+        return max(1, int(value)) if value.isdigit() else 168
+
+    @classmethod
+    def get_prompt_cache_max_mb(cls):
+        """图片生成缓存的总大小上限（MB，环境变量 IMAGE_PROMPT_CACHE_MAX_MB，默认 1024）"""
+        import os
+        value = os.getenv('IMAGE_PROMPT_CACHE_MAX_MB', '1024').strip()
+        return max(1, int(value)) if value.isdigit() else 1024
+
+    @classmethod
+    def get_task_state_backend(cls):
+        """
+        获取任务状态存储方式（环境变量 TASK_STATE_BACKEND）
+
+        - memory: 进程内 LRU（默认，单进程部署）
+        - sqlite: SQLite 文件（多 worker 进程部署时共享）
+        """
+        import os
+        backend = os.getenv('TASK_STATE_BACKEND', 'memory').strip().lower()
+        return backend if backend in ('memory', 'sqlite') else 'memory'
+
+    @classmethod
+    def get_task_state_max_entries(cls):
+        """任务状态最多保留的任务数（环境变量 TASK_STATE_MAX_ENTRIES，默认 128）"""
+        import os
+        value = os.getenv('TASK_STATE_MAX_ENTRIES', '128').strip()
+        return max(1, int(value)) if value.isdigit() else 128
+
+    @classmethod
+    def get_task_state_ttl_seconds(cls):
+        """任务状态在最后一次访问后的保留时长（秒，环境变量 TASK_STATE_TTL_SECONDS，默认 6 小时）"""
+        import os
+        value = os.getenv('TASK_STATE_TTL_SECONDS', '21600').strip()
+        return max(60, int(value)) if value.isdigit() else 21600
+
+    @classmethod
+    def get_task_state_sqlite_path(cls):
+        """SQLite 任务状态存储文件路径（环境变量 TASK_STATE_SQLITE_PATH）"""
+        import os
+        return os.getenv('TASK_STATE_SQLITE_PATH') or os.path.join(cls._get_data_dir(), "task_states.db")
+
+    @classmethod
+    def get_http_pool_maxsize(cls):
+        """
+        每个源站共享 HTTP 会话的连接池大小（环境变量 HTTP_POOL_MAXSIZE）
+
+        默认与图片生成最大并发数（ImageService.MAX_CONCURRENT）一致
+        """
+        import os
+        value = os.getenv('HTTP_POOL_MAXSIZE', '').strip()
+        if value.isdigit() and int(value) > 0:
+            return int(value)
+        from backend.services.image import ImageService
+        return ImageService.MAX_CONCURRENT
+
+    @classmethod
+    def get_http_max_retries(cls):
+        """共享 HTTP 会话的重试次数（连接失败、幂等请求的 502/503/504，环境变量 HTTP_MAX_RETRIES，默认 2）"""
+        import os
+        value = os.getenv('HTTP_MAX_RETRIES', '2').strip()
+        return int(value) if value.isdigit() else 2
+
     # 注意：OUTPUT_DIR和HISTORY_DIR已改为通过getter方法获取
     # 为了保持向后兼容性，我们通过类方法动态返回路径
     # 直接使用 Config.get_output_dir() 和 Config.get_history_dir() 替代 Config.OUTPUT_DIR 和 Config.HISTORY_DIR
@@ -183,6 +440,35 @@ class Config:
         logger.debug(f"当前激活的图片服务商: {active}")
         return active
 
+    @classmethod
+    def get_image_routing(cls):
+        """
+        获取多服务商路由配置（image_providers.yaml 中的 routing 段）
+
+            routing:
+              weights:          # 按权重把页面分配到这些服务商
+                gemini: 3
+                vertex: 1
+              fallback:         # 只在出错时依次尝试的备用服务商
+                - openai_image
+
+        Returns:
+            {"weights": {服务商: 权重}, "fallback": [服务商]}，未配置时两者为空
+        """
+        config = cls.load_image_providers_config()
+        routing = config.get('routing') or {}
+        weights = {}
+        for name, weight in (routing.get('weights') or {}).items():
+            try:
+                weight = float(weight)
+            except (TypeError, ValueError):
+                logger.warning(f"路由权重无效，已忽略: {name}={weight}")
+                continue
+            if weight > 0:
+                weights[str(name)] = weight
+        fallback = [str(name) for name in (routing.get('fallback') or []) if str(name) not in weights]
+        return {"weights": weights, "fallback": fallback}
+
     @classmethod
     def get_image_provider_config(cls, provider_name: str = None):
         config = cls.load_image_providers_config()
@@ -44,3 +44,32 @@ if _url.startswith("sqlite"):
 else:
     engine = create_engine(_url, pool_pre_ping=True, pool_recycle=3600)
 SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False))
+
+
+def add_missing_columns():
+    """
+    为已存在的表补充模型中新增的列
+
+    create_all 只会创建缺失的表，不会修改已有表结构。新增列均为可空列，
+    直接 ALTER TABLE ADD COLUMN 即可兼容旧库。
+
+    Returns:
+        新增的列列表，格式为 "表名.列名"
+    """
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+                added.append(f"{table.name}.{column.name}")
+    return added
@@ -1,6 +1,7 @@
 """图片生成器抽象基类"""
 from abc import ABC, abstractmethod
 from typing import Dict, Any, Optional
+from ..utils.circuit_breaker import CircuitBreaker, endpoint_name, get_circuit_breaker
 
 
 class ImageGeneratorBase(ABC):
@@ -17,6 +18,12 @@ class ImageGeneratorBase(ABC):
         self.api_key = config.get('api_key')
         self.base_url = config.get('base_url')
 
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        """所连接端点的熔断器（按生成器类型 + base_url + API Key 区分）"""
+        kind = self.config.get('type') or self.__class__.__name__
+        return get_circuit_breaker(endpoint_name(f"image:{kind}", self.base_url, self.api_key))
+
     @abstractmethod
     def generate_image(
         self,
@@ -3,7 +3,11 @@ import logging
 import time
 import random
 import base64
+import json
 import requests
+from ..utils.http_session import UpstreamHTTPError, get_http_session
+from ..utils.chat_stream import ChatStreamParser, READ_CHUNK_SIZE
+from ..utils.b64_stream import B64JsonImageReader
 from typing import Dict, Any, Optional, List, Union
 from .base import ImageGeneratorBase
 from ..utils.image_compressor import compress_image
@@ -170,12 +174,13 @@ class ImageApiGenerator(ImageGeneratorBase):
 
         api_url = f"{self.base_url}{self.endpoint_type}"
         logger.debug(f"  发送请求到: {api_url}")
-        response = requests.post(api_url, headers=headers, json=payload, timeout=300)
+        response = get_http_session(api_url).post(api_url, headers=headers, json=payload, timeout=300, stream=True)
 
         if response.status_code != 200:
             error_detail = response.text[:500]
             logger.error(f"Image API 请求失败: status={response.status_code}, error={error_detail}")
-            raise Exception(
+            raise UpstreamHTTPError(
+                response.status_code,
                 f"Image API 请求失败 (状态码: {response.status_code})\n"
                 f"错误详情: {error_detail}\n"
                 f"请求地址: {api_url}\n"
@@ -187,11 +192,12 @@ class ImageApiGenerator(ImageGeneratorBase):
                 "建议：检查API密钥和base_url配置"
             )
 
-        # 尝试解析 JSON 响应
+        # 流式解析 JSON 响应，b64_json 图片边接收边解码
+        reader = B64JsonImageReader()
         try:
-            result = response.json()
-        except Exception as json_err:
-            raw_text = response.text[:500] if response.text else "(空响应)"
+            reader.read_response(response)
+        except json.JSONDecodeError as json_err:
+            raw_text = reader.preview_text[:500] or "(空响应)"
             raise Exception(
                 f"❌ API 响应解析失败\n\n"
                 f"【错误类型】JSON 解析错误: {str(json_err)}\n\n"
@@ -201,18 +207,14 @@ class ImageApiGenerator(ImageGeneratorBase):
                 f"2. 网络连接超时或中断\n\n"
                 f"【解决方案】检查 API 服务是否正常"
             )
+        result = reader.result
         logger.debug(f"  API 响应: data 长度={len(result.get('data', []))}")
 
         if "data" in result and len(result["data"]) > 0:
             item = result["data"][0]
 
-            if "b64_json" in item:
-                b64_data_uri = item["b64_json"]
-                if b64_data_uri.startswith('data:'):
-                    b64_string = b64_data_uri.split(',', 1)[1]
-                else:
-                    b64_string = b64_data_uri
-                image_data = base64.b64decode(b64_string)
+            if "b64_json" in item and reader.image is not None:
+                image_data = reader.image
                 logger.info(f"✅ Image API 图片生成成功: {len(image_data)} bytes")
                 return image_data
 
@@ -287,7 +289,7 @@ class ImageApiGenerator(ImageGeneratorBase):
             payload = dict(base_payload)
             if stream_flag is not None:
                 payload["stream"] = stream_flag
-            return requests.post(api_url, headers=headers, json=payload, timeout=300, stream=True)
+            return get_http_session(api_url).post(api_url, headers=headers, json=payload, timeout=300, stream=True)
 
         response = try_request(True)
 
@@ -296,7 +298,8 @@ class ImageApiGenerator(ImageGeneratorBase):
             status_code = response.status_code
 
             if status_code == 401:
-                raise Exception(
+                raise UpstreamHTTPError(
+                    status_code,
                     "❌ API Key 认证失败\n\n"
                     "【可能原因】\n"
                     "1. API Key 无效或已过期\n"
@@ -305,77 +308,54 @@ class ImageApiGenerator(ImageGeneratorBase):
                     "在系统设置页面检查 API Key 是否正确"
                 )
             elif status_code == 429:
-                raise Exception(
+                raise UpstreamHTTPError(
+                    status_code,
                     "⏳ API 配额或速率限制\n\n"
                     "【解决方案】\n"
                     "1. 稍后再试\n"
                     "2. 检查 API 配额使用情况"
                 )
             else:
-                raise Exception(
+                raise UpstreamHTTPError(
+                    status_code,
                     f"❌ Chat API 请求失败 (状态码: {status_code})\n\n"
                     f"【错误详情】\n{error_detail[:300]}\n\n"
                     f"【请求地址】{api_url}\n"
                     f"【模型】{model}"
                 )
 
-        # 自动检测并解析响应（支持SSE流式与非流式JSON）
-        content_type = response.headers.get('Content-Type', '')
-        raw_content = b""
-        for chunk in response.iter_content(chunk_size=None):
-            if chunk:
-                raw_content += chunk
-        raw_text = raw_content.decode('utf-8', errors='ignore')
+        # 增量解析响应（支持SSE流式与非流式JSON），流式返回中出现完整图片后即停止读取
+        parser = ChatStreamParser(response.headers.get('Content-Type', ''), detect_image=True)
+        try:
+            for chunk in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+                if parser.feed(chunk):
+                    break
+        finally:
+            response.close()
 
-        is_streaming = 'text/event-stream' in content_type or raw_text.startswith('data:')
-        full_content = ""
+        is_streaming = bool(parser.streaming)
         found_image_bytes: List[bytes] = []
         found_image_urls: List[str] = []
 
-        if is_streaming:
-            for line in raw_text.split('\n'):
-                line = line.strip()
-                if not line or line.startswith(':') or line.startswith('event:'):
-                    continue
-                if line.startswith('data:'):
-                    data_str = line[5:].strip()
-                    if data_str == '[DONE]':
-                        continue
-                    try:
-                        chunk_data = json_module.loads(data_str)
-                        if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                            delta = chunk_data['choices'][0].get('delta', {})
-                            content_part = delta.get('content', '')
-                            if content_part:
-                                full_content += content_part
-                            # 解析工具调用或结构化输出里的图片
-                            tool_calls = delta.get('tool_calls') or []
-                            if tool_calls:
-                                imgs_b, imgs_u = self._extract_images_from_json(tool_calls)
-                                found_image_bytes.extend(imgs_b)
-                                found_image_urls.extend(imgs_u)
-                    except json_module.JSONDecodeError:
-                        continue
-        else:
-            try:
-                result = json_module.loads(raw_text)
-                # 优先从结构化JSON里提取图片
-                imgs_b, imgs_u = self._extract_images_from_json(result)
-                found_image_bytes.extend(imgs_b)
-                found_image_urls.extend(imgs_u)
-                if "choices" in result and len(result["choices"]) > 0:
-                    choice = result["choices"][0]
-                    if "message" in choice and "content" in choice["message"]:
-                        full_content = choice["message"]["content"]
-                    elif "delta" in choice and "content" in choice["delta"]:
-                        full_content = choice["delta"]["content"]
-            except json_module.JSONDecodeError:
-                raise Exception(f"❌ Chat API 响应不是有效的 JSON: {raw_text[:500]}")
+        try:
+            parser.finish()
+        except json_module.JSONDecodeError:
+            raise Exception(f"❌ Chat API 响应不是有效的 JSON: {parser.preview_text[:500]}")
+        full_content = parser.content
+
+        # 解析工具调用或结构化输出里的图片（非流式时优先从结构化JSON里提取）
+        structured = parser.tool_calls if is_streaming else parser.result
+        if structured:
+            imgs_b, imgs_u = self._extract_images_from_json(structured)
+            found_image_bytes.extend(imgs_b)
+            found_image_urls.extend(imgs_u)
+        if parser.image_complete and is_streaming:
+            logger.debug(f"流式响应中已得到完整图片，提前结束读取（已读取 {parser.bytes_read} 字节）")
         logger.info(f"响应完成，总内容长度: {len(full_content)} 字符")
         logger.debug(f"完整内容: {full_content[:500]}...")
 
         # 如果返回提示需要开启流式，则自动重试一次非流式或流式
-        hint_need_stream = 'enable streaming' in (full_content or '').lower() or 'enable streaming' in raw_text.lower()
+        hint_need_stream = 'enable streaming' in (full_content or '').lower() or 'enable streaming' in parser.preview_text.lower()
         if (not is_streaming and hint_need_stream) or (is_streaming and not (found_image_bytes or found_image_urls) and len(full_content) == 0):
             response2 = try_request(None)
             if response2.status_code == 200:
@@ -428,12 +408,12 @@ class ImageApiGenerator(ImageGeneratorBase):
         """下载图片并返回二进制数据"""
         logger.info(f"下载图片: {url[:100]}...")
         try:
-            response = requests.get(url, timeout=60)
+            response = get_http_session(url).get(url, timeout=60)
             if response.status_code == 200:
                 logger.info(f"✅ 图片下载成功: {len(response.content)} bytes")
                 return response.content
             else:
-                raise Exception(f"下载图片失败: HTTP {response.status_code}")
+                raise UpstreamHTTPError(response.status_code, f"下载图片失败: HTTP {response.status_code}")
         except requests.exceptions.Timeout:
             raise Exception("❌ 下载图片超时，请重试")
         except Exception as e:
@@ -6,6 +6,9 @@ import base64
 from functools import wraps
 from typing import Dict, Any
 import requests
+from ..utils.http_session import UpstreamHTTPError, get_http_session
+from ..utils.chat_stream import ChatStreamParser, READ_CHUNK_SIZE
+from ..utils.b64_stream import B64JsonImageReader
 from .base import ImageGeneratorBase
 
 logger = logging.getLogger(__name__)
@@ -153,12 +156,13 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         if quality and model.startswith('dall-e'):
             payload["quality"] = quality
 
-        response = requests.post(url, headers=headers, json=payload, timeout=180)
+        response = get_http_session(url).post(url, headers=headers, json=payload, timeout=180, stream=True)
 
         if response.status_code != 200:
             error_detail = response.text[:500]
             logger.error(f"OpenAI Images API 请求失败: status={response.status_code}, error={error_detail}")
-            raise Exception(
+            raise UpstreamHTTPError(
+                response.status_code,
                 f"OpenAI Images API 请求失败 (状态码: {response.status_code})\n"
                 f"错误详情: {error_detail}\n"
                 f"请求地址: {url}\n"
@@ -172,7 +176,9 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
                 "建议：检查API密钥、base_url和模型名称配置"
             )
 
-        result = response.json()
+        # 流式解析 JSON 响应，b64_json 图片边接收边解码
+        reader = B64JsonImageReader().read_response(response)
+        result = reader.result
         logger.debug(f"  API 响应: data 长度={len(result.get('data', []))}")
 
         if "data" not in result or len(result["data"]) == 0:
@@ -190,21 +196,21 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         image_data = result["data"][0]
 
         # 处理base64格式
-        if "b64_json" in image_data:
-            img_bytes = base64.b64decode(image_data["b64_json"])
+        if "b64_json" in image_data and reader.image is not None:
+            img_bytes = reader.image
             logger.info(f"✅ OpenAI Images API 图片生成成功: {len(img_bytes)} bytes")
             return img_bytes
 
         # 处理URL格式
         elif "url" in image_data:
             logger.debug(f"  下载图片 URL...")
-            img_response = requests.get(image_data["url"], timeout=60)
+            img_response = get_http_session(image_data["url"]).get(image_data["url"], timeout=60)
             if img_response.status_code == 200:
                 logger.info(f"✅ OpenAI Images API 图片生成成功: {len(img_response.content)} bytes")
                 return img_response.content
             else:
                 logger.error(f"下载图片失败: {img_response.status_code}")
-                raise Exception(f"下载图片失败: {img_response.status_code}")
+                raise UpstreamHTTPError(img_response.status_code, f"下载图片失败: {img_response.status_code}")
 
         else:
             logger.error(f"无法从响应中提取图片数据: {str(image_data)[:200]}")
@@ -256,7 +262,7 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         }
 
         # 使用 stream=True 以便能处理流式响应
-        response = requests.post(url, headers=headers, json=payload, timeout=180, stream=True)
+        response = get_http_session(url).post(url, headers=headers, json=payload, timeout=180, stream=True)
 
         if response.status_code != 200:
             error_detail = response.text[:500]
@@ -264,7 +270,8 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
 
             # 详细的错误信息
             if status_code == 401:
-                raise Exception(
+                raise UpstreamHTTPError(
+                    status_code,
                     "❌ API Key 认证失败\n\n"
                     "【可能原因】\n"
                     "1. API Key 无效或已过期\n"
@@ -273,70 +280,37 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
                     "在系统设置页面检查 API Key 是否正确"
                 )
             elif status_code == 429:
-                raise Exception(
+                raise UpstreamHTTPError(
+                    status_code,
                     "⏳ API 配额或速率限制\n\n"
                     "【解决方案】\n"
                     "1. 稍后再试\n"
                     "2. 检查 API 配额使用情况"
                 )
             else:
-                raise Exception(
+                raise UpstreamHTTPError(
+                    status_code,
                     f"❌ Chat API 请求失败 (状态码: {status_code})\n\n"
                     f"【错误详情】\n{error_detail[:300]}\n\n"
                     f"【请求地址】{url}\n"
                     f"【模型】{model}"
                 )
 
-        # 自动检测并解析响应（支持流式和非流式）
+        # 增量解析响应（支持流式和非流式），流式返回中出现完整图片后即停止读取
         import json as json_lib
-        
-        content_type = response.headers.get('Content-Type', '')
-        
-        # 读取原始内容
-        raw_content = b""
-        for chunk in response.iter_content(chunk_size=None):
-            if chunk:
-                raw_content += chunk
-        
-        raw_text = raw_content.decode('utf-8')
-        
-        # 判断是否是流式响应（SSE 格式）
-        is_streaming = 'text/event-stream' in content_type or raw_text.startswith('data:')
-        
-        full_content = ""
-        
-        if is_streaming:
-            # 流式响应解析
-            for line in raw_text.split('\n'):
-                line = line.strip()
-                if not line or not line.startswith('data:'):
-                    continue
-                
-                data_str = line[5:].strip()
-                if data_str == '[DONE]':
+
+        parser = ChatStreamParser(response.headers.get('Content-Type', ''), detect_image=True)
+        try:
+            for chunk in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+                if parser.feed(chunk):
                     break
-                
-                try:
-                    chunk_data = json_lib.loads(data_str)
-                    if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                        delta = chunk_data['choices'][0].get('delta', {})
-                        content_chunk = delta.get('content', '')
-                        if content_chunk:
-                            full_content += content_chunk
-                except json_lib.JSONDecodeError:
-                    continue
-        else:
-            # 非流式响应解析（标准 JSON）
-            try:
-                result = json_lib.loads(raw_text)
-                if "choices" in result and len(result["choices"]) > 0:
-                    choice = result["choices"][0]
-                    if "message" in choice and "content" in choice["message"]:
-                        full_content = choice["message"]["content"]
-                    elif "delta" in choice and "content" in choice["delta"]:
-                        full_content = choice["delta"]["content"]
-            except json_lib.JSONDecodeError:
-                raise Exception(f"❌ Chat API 响应不是有效的 JSON: {raw_text[:500]}")
+            parser.finish()
+        except json_lib.JSONDecodeError:
+            raise Exception(f"❌ Chat API 响应不是有效的 JSON: {parser.preview_text[:500]}")
+        finally:
+            response.close()
+
+        full_content = parser.content
 
         logger.debug(f"Chat API 完整响应 (长度={len(full_content)}): {full_content[:200]}...")
 
@@ -398,12 +372,12 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         """下载图片并返回二进制数据"""
         logger.info(f"下载图片: {url[:100]}...")
         try:
-            response = requests.get(url, timeout=60)
+            response = get_http_session(url).get(url, timeout=60)
             if response.status_code == 200:
                 logger.info(f"✅ 图片下载成功: {len(response.content)} bytes")
                 return response.content
             else:
-                raise Exception(f"下载图片失败: HTTP {response.status_code}")
+                raise UpstreamHTTPError(response.status_code, f"下载图片失败: HTTP {response.status_code}")
         except requests.exceptions.Timeout:
             raise Exception("❌ 下载图片超时，请重试")
         except Exception as e:
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, LargeBinary, ForeignKey, DateTime, UniqueConstraint, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, UniqueConstraint, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .db import Base
@@ -10,6 +10,8 @@ class User(Base):
     email = Column(String(128), unique=True, nullable=True)
     password_hash = Column(String(256), nullable=False)
     role = Column(String(16), nullable=False, default="user")
+    # 图片生成调度权重，为空时按角色使用默认值（见 Config.get_schedule_*_weight）
+    schedule_weight = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
 class ProviderConfig(Base):
@@ -49,9 +51,20 @@ class Image(Base):
     task_id = Column(String(64), nullable=False)
     index = Column(Integer, nullable=False)
     filename = Column(String(128), nullable=False)
-    image_data = Column(LargeBinary, nullable=False)
-    thumbnail_data = Column(LargeBinary, nullable=False)
+    # 图片二进制存放在 blob 存储中，这里只记录内容哈希、大小和类型
+    image_hash = Column(String(64), nullable=True)
+    image_size = Column(Integer, nullable=True)
+    mime_type = Column(String(32), nullable=True)
+    thumbnail_hash = Column(String(64), nullable=True)
+    thumbnail_size = Column(Integer, nullable=True)
+    thumbnail_mime_type = Column(String(32), nullable=True)
+    # 多尺寸版本（JSON）：{"720": {...}, "720.webp": {...}}，每项包含 hash/size/mime_type/width/height
+    # 不带后缀的键为 JPEG 版本
+    renditions = Column(Text, nullable=True)
+    # 生成该图片的服务商（多服务商路由时用于重绘沿用同一服务商）
+    provider = Column(String(64), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow)
     __table_args__ = (UniqueConstraint("user_id", "task_id", "filename", name="uq_image_key"),)
 
 class Copywriting(Base):
@@ -78,3 +91,46 @@ class History(Base):
     page_count = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow)
+
+class PromptCacheEntry(Base):
+    __tablename__ = "prompt_cache"
+    # 渲染后的 prompt、生成参数、参考图哈希的 SHA-256
+    key = Column(String(64), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    provider = Column(String(64), nullable=True)
+    # 生成结果在 blob 存储中的哈希
+    image_hash = Column(String(64), nullable=False, index=True)
+    image_size = Column(Integer, nullable=False, default=0)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class GenerationJob(Base):
+    __tablename__ = "generation_jobs"
+    id = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    task_id = Column(String(64), nullable=False, index=True)
+    # queued / running / done / failed
+    status = Column(String(16), nullable=False, default="queued", index=True)
+    # 生成参数（JSON）：pages / full_outline / user_topic / keyword / user_image_hashes
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    worker_id = Column(String(64), nullable=True)
+    error = Column(Text, nullable=True)
+    # 结果摘要（JSON）：与 finish 事件数据一致
+    result = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class JobEvent(Base):
+    __tablename__ = "job_events"
+    id = Column(Integer, primary_key=True)
+    job_id = Column(String(36), ForeignKey("generation_jobs.id"), nullable=False, index=True)
+    # 任务内单调递增的事件序号，即 SSE 的 id 字段
+    seq = Column(Integer, nullable=False)
+    event = Column(String(32), nullable=False)
+    data = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (UniqueConstraint("job_id", "seq", name="uq_job_event_seq"),)
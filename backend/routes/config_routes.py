@@ -109,7 +109,8 @@ def create_config_blueprint():
                         "providers": prepare_providers_for_response(
                             image_config.get('providers', {}),
                             hide_key=hide_key
-                        )
+                        ),
+                        "routing": image_config.get('routing') or {}
                     }
                 },
                 "is_admin": is_admin  # 前端可用于显示不同的UI
@@ -246,6 +247,13 @@ def _update_provider_config(config_path: Path, new_data: dict):
     if 'active_provider' in new_data:
         existing_config['active_provider'] = new_data['active_provider']
 
+    # 更新多服务商路由（仅图片配置使用）
+    if 'routing' in new_data:
+        if new_data['routing']:
+            existing_config['routing'] = new_data['routing']
+        else:
+            existing_config.pop('routing', None)
+
     # 更新 providers
     if 'providers' in new_data:
         existing_providers = existing_config.get('providers', {})
@@ -411,8 +419,8 @@ def _test_google_gemini(config: dict, test_prompt: str) -> dict:
 
 def _test_openai_compatible(config: dict, test_prompt: str) -> dict:
     """测试 OpenAI 兼容接口（自动支持流式和非流式响应）"""
-    import requests
     import json
+    from backend.utils.http_session import get_http_session
 
     base_url = config['base_url'].rstrip('/').rstrip('/v1') if config.get('base_url') else 'https://api.openai.com'
     url = f"{base_url}/v1/chat/completions"
@@ -424,7 +432,7 @@ def _test_openai_compatible(config: dict, test_prompt: str) -> dict:
         # 不强制设置 stream 参数，让 API 决定返回格式
     }
 
-    response = requests.post(
+    response = get_http_session(url).post(
         url,
         headers={
             'Authorization': f"Bearer {config['api_key']}",
@@ -494,12 +502,12 @@ def _test_openai_compatible(config: dict, test_prompt: str) -> dict:
 
 def _test_image_api(config: dict) -> dict:
     """测试图片 API 连接"""
-    import requests
+    from backend.utils.http_session import get_http_session
 
     base_url = config['base_url'].rstrip('/').rstrip('/v1') if config.get('base_url') else 'https://api.openai.com'
     url = f"{base_url}/v1/models"
 
-    response = requests.get(
+    response = get_http_session(url).get(
         url,
         headers={'Authorization': f"Bearer {config['api_key']}"},
         timeout=30
@@ -390,10 +390,10 @@ def download_history_zip_impl(record_id):
             }), 404
 
         from backend.db import SessionLocal
-        from backend.models import Image
+        from backend.services.image_storage import IMAGE_BLOB_COLUMNS
         db = SessionLocal()
         try:
-            imgs = db.query(Image).filter_by(task_id=task_id).all()
+            imgs = db.query(*IMAGE_BLOB_COLUMNS).filter_by(task_id=task_id).all()
             if not imgs:
                 return jsonify({"success": False, "error": "未找到图片"}), 404
             zip_buffer = _create_images_zip_from_db(imgs)
@@ -421,6 +421,7 @@ def download_history_zip_impl(record_id):
 
 
 def _create_images_zip_from_db(images: list) -> io.BytesIO:
+    from backend.services.image_storage import read_image_data
     memory_file = io.BytesIO()
     with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
         for img in images:
@@ -429,7 +430,10 @@ def _create_images_zip_from_db(images: list) -> io.BytesIO:
                 name = f"page_{idx + 1}.png"
             except Exception:
                 name = img.filename
-            zf.writestr(name, img.image_data)
+            data = read_image_data(img)
+            if data is None:
+                continue
+            zf.writestr(name, data)
     memory_file.seek(0)
     return memory_file
 
@@ -9,13 +9,22 @@
 - 获取任务状态
 """
 
+import io
 import os
 import json
+import uuid
 import base64
 import logging
-from flask import Blueprint, request, jsonify, Response, send_file, make_response
+from datetime import timezone
+from flask import Blueprint, request, jsonify, Response, send_file, make_response, current_app
+from werkzeug.utils import send_file as werkzeug_send_file
+from werkzeug.http import is_resource_modified, parse_range_header, parse_if_range_header
 from backend.services.image import get_image_service
 from backend.services.history import get_history_service
+from backend.services.job_queue import get_job_queue, JOB_KIND_RETRY
+from backend.config import Config
+from backend.utils.blob_store import get_blob_store
+from backend.services.image_storage import IMAGE_VERSION_LENGTH, select_rendition
 from .utils import log_request, log_error
 from flask_jwt_extended import jwt_required, get_jwt_identity, decode_token, verify_jwt_in_request
 from backend.db import SessionLocal
@@ -23,6 +32,11 @@ from backend.models import Image
 
 logger = logging.getLogger(__name__)
 
+# Range 请求最多处理的区间数，超过时返回完整内容（防止大量重叠区间放大响应）
+MAX_BYTE_RANGES = 16
+# Range 响应流式读取的块大小
+RANGE_CHUNK_SIZE = 64 * 1024
+
 
 def create_image_blueprint():
     """创建图片路由蓝图（工厂函数，支持多次调用）"""
@@ -34,7 +48,7 @@ def create_image_blueprint():
     @jwt_required()
     def generate_images():
         """
-        批量生成图片（SSE 流式返回）
+        提交批量生成图片任务（后台执行，立即返回）
 
         请求体：
         - pages: 页面列表（必填）
@@ -42,12 +56,11 @@ def create_image_blueprint():
         - full_outline: 完整大纲文本
         - user_topic: 用户原始输入主题
         - user_images: base64 编码的用户参考图片列表
+        - bypass_cache: 为 true 时不复用图片生成缓存（重新生成）
 
         返回：
-        SSE 事件流，包含以下事件类型：
-        - image: 单张图片生成完成
-        - error: 生成错误
-        - complete: 全部完成
+        - job_id: 后台任务 ID（该任务已有排队中或执行中的后台任务时返回该任务）
+        - events_url: 进度事件流地址（GET，SSE），可随时断开重连
         """
         try:
             data = request.get_json()
@@ -73,12 +86,15 @@ def create_image_blueprint():
                     "error": "参数错误：pages 不能为空。\n请提供要生成的页面列表数据。"
                 }), 400
 
-            logger.info(f"🖼️  开始图片生成任务: {task_id}, 共 {len(pages)} 页")
+            logger.info(f"🖼️  提交图片生成任务: {task_id}, 共 {len(pages)} 页")
             user_id = int(get_jwt_identity())
-            image_service = get_image_service(user_id)
 
-            image_service = get_image_service(user_id)
-            
+            # 同一任务已有未完成的生成任务时直接返回（重复提交不再排队）
+            active_job = get_job_queue().get_active_job_for_task(user_id, task_id) if task_id else None
+            if active_job:
+                logger.info(f"任务 {task_id} 已有未完成的后台任务 {active_job['id']}，直接返回")
+                return _job_accepted(active_job, task_id)
+
             # 获取关键词并启动过期计时
             keyword = ""
             try:
@@ -90,30 +106,20 @@ def create_image_blueprint():
             except Exception as e:
                 logger.warning(f"Failed to sync history info for task {task_id}: {e}")
 
-            def generate():
-                """SSE 事件生成器"""
-                for event in image_service.generate_images(
-                    pages, task_id, full_outline,
-                    user_images=user_images if user_images else None,
-                    user_topic=user_topic,
-                    keyword=keyword
-                ):
-                    event_type = event["event"]
-                    event_data = event["data"]
-
-                    # 格式化为 SSE 格式
-                    yield f"event: {event_type}\n"
-                    yield f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
-
-            return Response(
-                generate(),
-                mimetype='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    'X-Accel-Buffering': 'no',
-                }
+            if not task_id:
+                task_id = f"task_{uuid.uuid4().hex[:8]}"
+
+            job = get_job_queue().enqueue(
+                user_id, task_id, pages,
+                full_outline=full_outline,
+                user_topic=user_topic,
+                keyword=keyword,
+                user_images=user_images if user_images else None,
+                bypass_cache=bool(data.get('bypass_cache', False))
             )
 
+            return _job_accepted(job, task_id)
+
         except Exception as e:
             log_error('/generate', e)
             error_msg = str(e)
@@ -122,12 +128,80 @@ def create_image_blueprint():
                 "error": f"图片生成异常。\n错误详情: {error_msg}\n建议：检查图片生成服务配置和后端日志"
             }), 500
 
+    # ==================== 后台任务 ====================
+
+    @image_bp.route('/jobs/<job_id>', methods=['GET'])
+    @jwt_required()
+    def get_job(job_id):
+        """查询后台生成任务状态"""
+        user_id = int(get_jwt_identity())
+        job = get_job_queue().get_job(job_id, user_id=user_id)
+        if not job:
+            return jsonify({"success": False, "error": "任务不存在"}), 404
+        return jsonify({"success": True, "job": job})
+
+    @image_bp.route('/jobs/<job_id>/events', methods=['GET'])
+    @jwt_required()
+    def stream_job_events(job_id):
+        """
+        订阅后台生成任务的进度（SSE 流式返回）
+
+        可以在任务执行期间任意时刻连接、断开后重连。每个事件带有任务内递增的 id，
+        重连时通过 Last-Event-ID 请求头（或 last_event_id 查询参数）只回放之后的事件，
+        不带时从头回放。
+
+        返回：
+        SSE 事件流，事件类型与原 /generate、/retry-failed 一致：
+        - progress / retry_start: 生成进度
+        - complete: 单张图片生成完成
+        - error: 单张图片生成失败
+        - finish / retry_finish: 全部完成
+        """
+        user_id = int(get_jwt_identity())
+        queue = get_job_queue()
+        if not queue.get_job(job_id, user_id=user_id):
+            return jsonify({"success": False, "error": "任务不存在"}), 404
+
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id', '')
+        last_event_id = int(last_event_id) if last_event_id.strip().isdigit() else 0
+
+        def generate():
+            """SSE 事件生成器"""
+            for event in queue.stream_events(job_id, last_event_id=last_event_id):
+                if event is None:
+                    # 心跳注释行，防止代理断开空闲连接
+                    yield ": keepalive\n\n"
+                    continue
+
+                # 格式化为 SSE 格式；id 行放在 data 之后，兼容只读取前两行的客户端解析逻辑
+                yield f"event: {event['event']}\n"
+                yield f"data: {json.dumps(event['data'], ensure_ascii=False)}\n"
+                yield f"id: {event['id']}\n\n"
+
+        return Response(
+            generate(),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+            }
+        )
+
     # ==================== 图片获取 ====================
 
     @image_bp.route('/images/<task_id>/<filename>', methods=['GET'])
     def get_image(task_id, filename):
         """
         获取图片文件（支持 Header 或 Query Param 认证）
+
+        查询参数：
+        - thumbnail: true 返回缩略图（默认），false 返回原图
+        - w: 显示宽度（像素），返回不小于该宽度的最小尺寸版本，优先于 thumbnail；
+          格式按 Accept 头协商（AVIF / WebP / JPEG），响应带 Vary: Accept
+        - v: 内容版本号，与当前图片一致时允许长期缓存
+
+        支持 ETag / Last-Modified 协商缓存，以及 Range 请求（单段与多段），
+        便于移动端断点续传大图。
         """
         try:
             # logger.debug(f"获取图片: {task_id}/{filename}")
@@ -159,21 +233,53 @@ def create_image_blueprint():
                 return jsonify({"success": False, "error": f"未授权访问: {auth_error or '无有效认证'}"}), 401
 
             thumbnail = request.args.get('thumbnail', 'true').lower() == 'true'
+            width = request.args.get('w', type=int)
             db = SessionLocal()
             try:
-                img = db.query(Image).filter_by(user_id=user_id, task_id=task_id, filename=filename).first()
+                img = db.query(
+                    Image.image_hash, Image.mime_type, Image.thumbnail_hash, Image.thumbnail_mime_type,
+                    Image.renditions, Image.created_at, Image.updated_at
+                ).filter_by(user_id=user_id, task_id=task_id, filename=filename).first()
                 if not img:
                     return jsonify({"success": False, "error": f"图片不存在或无权访问"}), 404
-                data = img.thumbnail_data if thumbnail else img.image_data
-                resp = make_response(data)
-                resp.headers.set('Content-Type', 'image/png')
-                # 设置缓存控制，因为带了 token，url 是唯一的吗？不一定。
-                # 但图片内容是不变的。
-                resp.headers.set('Cache-Control', 'private, max-age=3600') 
-                return resp
+                if width and width > 0:
+                    # ?w= 指定显示宽度时选择最合适的尺寸版本，优先于 thumbnail 参数；
+                    # 格式按 Accept 头协商（AVIF > WebP > JPEG）
+                    blob_hash, mime_type = select_rendition(img, width, _accepted_image_types())
+                elif thumbnail:
+                    blob_hash, mime_type = img.thumbnail_hash, img.thumbnail_mime_type
+                else:
+                    blob_hash, mime_type = img.image_hash, img.mime_type
+                mime_type = mime_type or 'image/png'
+                last_modified = img.updated_at or img.created_at
+                versioned = _is_current_version(request.args.get('v'), img.image_hash)
             finally:
                 db.close()
 
+            # 内容哈希即强 ETag；协商缓存命中时直接返回 304，不读取 blob
+            cache_control = _image_cache_control(versioned)
+            negotiated = bool(width and width > 0)
+            if blob_hash and not is_resource_modified(request.environ, etag=blob_hash, last_modified=last_modified):
+                resp = make_response('', 304)
+                resp.set_etag(blob_hash)
+                resp.headers.set('Cache-Control', cache_control)
+                if negotiated:
+                    resp.vary.add('Accept')
+                return resp
+
+            allow_range = _if_range_matches(blob_hash, last_modified)
+            resp = _send_blob(blob_hash, mime_type, allow_range=allow_range)
+            if resp is None:
+                return jsonify({"success": False, "error": f"图片数据丢失"}), 404
+            resp.set_etag(blob_hash)
+            if last_modified:
+                resp.last_modified = last_modified
+            resp.headers.set('Cache-Control', cache_control)
+            if negotiated:
+                # 同一 URL 根据 Accept 返回不同格式，缓存需按 Accept 区分
+                resp.vary.add('Accept')
+            return resp
+
         except Exception as e:
             log_error('/images', e)
             error_msg = str(e)
@@ -241,14 +347,15 @@ def create_image_blueprint():
     @jwt_required()
     def retry_failed_images():
         """
-        批量重试失败的图片（SSE 流式返回）
+        提交批量重试失败图片的任务（后台执行，立即返回）
 
         请求体：
         - task_id: 任务 ID（必填）
         - pages: 要重试的页面列表（必填）
 
         返回：
-        SSE 事件流
+        - job_id: 后台任务 ID（该任务已有排队中或执行中的后台任务时返回该任务）
+        - events_url: 进度事件流地址（GET，SSE），事件为 retry_start / complete / error / retry_finish
         """
         try:
             data = request.get_json()
@@ -267,27 +374,15 @@ def create_image_blueprint():
                     "error": "参数错误：task_id 和 pages 不能为空。\n请提供任务ID和要重试的页面列表。"
                 }), 400
 
-            logger.info(f"🔄 批量重试失败图片: task={task_id}, 共 {len(pages)} 页")
+            logger.info(f"🔄 提交批量重试任务: task={task_id}, 共 {len(pages)} 页")
             user_id = int(get_jwt_identity())
-            image_service = get_image_service(user_id)
+            active_job = get_job_queue().get_active_job_for_task(user_id, task_id)
+            if active_job:
+                logger.info(f"任务 {task_id} 已有未完成的后台任务 {active_job['id']}，直接返回")
+                return _job_accepted(active_job, task_id)
+            job = get_job_queue().enqueue(user_id, task_id, pages, kind=JOB_KIND_RETRY)
 
-            def generate():
-                """SSE 事件生成器"""
-                for event in image_service.retry_failed_images(task_id, pages):
-                    event_type = event["event"]
-                    event_data = event["data"]
-
-                    yield f"event: {event_type}\n"
-                    yield f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
-
-            return Response(
-                generate(),
-                mimetype='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    'X-Accel-Buffering': 'no',
-                }
-            )
+            return _job_accepted(job, task_id)
 
         except Exception as e:
             log_error('/retry-failed', e)
@@ -438,6 +533,227 @@ def create_image_blueprint():
 
 # ==================== 辅助函数 ====================
 
+def _send_blob(blob_hash: str, mime_type: str, allow_range: bool = True):
+    """
+    发送 blob 存储中的图片文件
+
+    根据 Config.IMAGE_SEND_MODE 选择由 Werkzeug 直接流式发送文件，
+    或只返回 X-Sendfile / X-Accel-Redirect 头交给前置服务器发送，
+    Python 进程不再把图片内容读入内存。
+
+    由本进程发送内容时处理 Range 请求；交给前置服务器时由其自行处理 Range。
+
+    Args:
+        blob_hash: blob 哈希
+        mime_type: 图片 MIME 类型
+        allow_range: 是否处理 Range 头（If-Range 不匹配时为 False，返回完整内容）
+
+    Returns:
+        Response，数据不存在时返回 None
+    """
+    if not blob_hash:
+        return None
+
+    store = get_blob_store()
+    path = store.path(blob_hash)
+    if path is None:
+        # 非本地存储，只能读入内存后返回
+        try:
+            data = store.read(blob_hash)
+        except FileNotFoundError:
+            return None
+        if allow_range and request.headers.get('Range'):
+            resp = _make_range_response(lambda: io.BytesIO(data), len(data), mime_type)
+            if resp is not None:
+                return resp
+        resp = make_response(data)
+        resp.headers.set('Content-Type', mime_type)
+        resp.accept_ranges = 'bytes'
+        return resp
+
+    if not os.path.exists(path):
+        logger.warning(f"图片数据缺失: hash={blob_hash}")
+        return None
+
+    mode = Config.get_image_send_mode()
+    if mode == 'send_file' and allow_range and request.headers.get('Range'):
+        resp = _make_range_response(lambda: open(path, 'rb'), os.path.getsize(path), mime_type)
+        if resp is not None:
+            return resp
+
+    if mode == 'x-accel-redirect':
+        rel_path = os.path.relpath(path, Config.get_blob_dir()).replace(os.sep, '/')
+        resp = make_response('')
+        resp.headers.set('Content-Type', mime_type)
+        resp.headers.set('X-Accel-Redirect', Config.get_accel_redirect_prefix().rstrip('/') + '/' + rel_path)
+        return resp
+
+    resp = werkzeug_send_file(
+        path,
+        request.environ,
+        mimetype=mime_type,
+        etag=False,
+        conditional=False,
+        use_x_sendfile=(mode == 'x-sendfile'),
+        response_class=current_app.response_class
+    )
+    if mode == 'send_file':
+        resp.accept_ranges = 'bytes'
+    return resp
+
+
+def _if_range_matches(blob_hash: str, last_modified) -> bool:
+    """
+    检查 If-Range 条件（RFC 7233）
+
+    客户端续传时带上之前拿到的 ETag 或 Last-Modified，图片已被重新生成时
+    条件不成立，应返回完整的新内容而不是拼接旧文件的片段。
+    """
+    if_range = parse_if_range_header(request.headers.get('If-Range'))
+    if if_range.etag is not None:
+        return bool(blob_hash) and if_range.etag == blob_hash
+    if if_range.date is not None:
+        return last_modified is not None and last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= if_range.date
+    return True
+
+
+def _parse_byte_ranges(total: int):
+    """
+    解析 Range 头，返回 [(start, stop), ...]（stop 不含）
+
+    Returns:
+        - None: 无 Range 头、格式错误或段数过多，按普通请求返回完整内容
+        - []: 所有区间都无法满足，应返回 416
+    """
+    parsed = parse_range_header(request.headers.get('Range'))
+    if parsed is None or parsed.units != 'bytes' or len(parsed.ranges) > MAX_BYTE_RANGES:
+        return None
+
+    ranges = []
+    for start, stop in parsed.ranges:
+        if start < 0:
+            # 后缀区间 bytes=-N
+            start = max(total + start, 0)
+            stop = total
+        else:
+            stop = total if stop is None else min(stop, total)
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+
+def _make_range_response(open_blob, total: int, mime_type: str):
+    """
+    构建 206 Partial Content 响应
+
+    单段返回对应字节，多段按 multipart/byteranges 返回；内容分块流式读取。
+
+    Args:
+        open_blob: 打开数据的函数，返回支持 seek/read 的文件对象
+        total: 数据总长度
+        mime_type: 图片 MIME 类型
+
+    Returns:
+        Response；Range 头无效时返回 None，由调用方返回完整内容
+    """
+    ranges = _parse_byte_ranges(total)
+    if ranges is None:
+        return None
+    if not ranges:
+        resp = make_response('', 416)
+        resp.headers.set('Content-Range', f'bytes */{total}')
+        resp.accept_ranges = 'bytes'
+        return resp
+
+    def read_range(f, start, stop):
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+
+        def generate():
+            with open_blob() as f:
+                yield from read_range(f, start, stop)
+
+        resp = current_app.response_class(generate(), status=206, mimetype=mime_type, direct_passthrough=True)
+        resp.headers.set('Content-Range', f'bytes {start}-{stop - 1}/{total}')
+        resp.content_length = stop - start
+        resp.accept_ranges = 'bytes'
+        return resp
+
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (
+            f'--{boundary}\r\nContent-Type: {mime_type}\r\n'
+            f'Content-Range: bytes {start}-{stop - 1}/{total}\r\n\r\n'
+        ).encode('ascii')
+        for start, stop in ranges
+    ]
+    closing = f'--{boundary}--\r\n'.encode('ascii')
+    content_length = sum(len(h) + (stop - start) + 2 for h, (start, stop) in zip(part_headers, ranges)) + len(closing)
+
+    def generate_multipart():
+        with open_blob() as f:
+            for header, (start, stop) in zip(part_headers, ranges):
+                yield header
+                yield from read_range(f, start, stop)
+                yield b'\r\n'
+        yield closing
+
+    resp = current_app.response_class(generate_multipart(), status=206, direct_passthrough=True)
+    resp.headers.set('Content-Type', f'multipart/byteranges; boundary={boundary}')
+    resp.content_length = content_length
+    resp.accept_ranges = 'bytes'
+    return resp
+
+
+def _job_accepted(job: dict, task_id: str):
+    """后台任务已提交（或已存在）的响应"""
+    return jsonify({
+        "success": True,
+        "job_id": job["id"],
+        "task_id": task_id,
+        "status": job["status"],
+        "events_url": f"/api/jobs/{job['id']}/events"
+    }), 202
+
+
+def _accepted_image_types() -> list:
+    """
+    客户端明确声明支持的新图片格式（按优先级）
+
+    只认 Accept 中显式列出的类型：*/* 或 image/* 不代表客户端能解码 AVIF/WebP。
+    """
+    explicit = {value.lower(): quality for value, quality in request.accept_mimetypes if quality > 0}
+    return [t for t in ('image/avif', 'image/webp') if t in explicit]
+
+
+def _is_current_version(version: str, image_hash: str) -> bool:
+    """URL 中的版本号（?v=）是否与当前图片内容哈希一致"""
+    if not version or not image_hash or len(version) < 8:
+        return False
+    return image_hash.startswith(version[:IMAGE_VERSION_LENGTH])
+
+
+def _image_cache_control(versioned: bool) -> str:
+    """
+    图片响应的 Cache-Control
+
+    带当前版本号的 URL 内容永远不变，允许浏览器长期缓存；
+    不带版本号的 URL 可能被重新生成覆盖，每次使用前都用 ETag 协商（命中时只返回 304）。
+    """
+    if versioned:
+        return 'private, max-age=31536000, immutable'
+    return 'private, no-cache'
+
+
 def _parse_base64_images(images_base64: list) -> list:
     """
     解析 base64 编码的图片列表
@@ -37,6 +37,8 @@ def create_outline_blueprint():
            - topic: 主题文本
            - images: base64 编码的图片数组（可选）
 
+        两种格式都可传 bypass_cache=true：不复用缓存的大纲，重新生成
+
         返回：
         - success: 是否成功
         - outline: 原始大纲文本
@@ -46,7 +48,7 @@ def create_outline_blueprint():
 
         try:
             # 解析请求数据
-            topic, images = _parse_outline_request()
+            topic, images, bypass_cache = _parse_outline_request()
 
             log_request('/outline', {'topic': topic, 'images': images})
 
@@ -62,7 +64,9 @@ def create_outline_blueprint():
             logger.info(f"🔄 开始生成大纲，主题: {topic[:50]}...")
             uid = int(get_jwt_identity())
             outline_service = get_outline_service(user_id=uid)
-            result = outline_service.generate_outline(topic, images if images else None)
+            result = outline_service.generate_outline(
+                topic, images if images else None, use_cache=not bypass_cache
+            )
 
             # 记录结果
             elapsed = time.time() - start_time
@@ -101,11 +105,12 @@ def _parse_outline_request():
     2. application/json - 用于 base64 图片
 
     返回：
-        tuple: (topic, images) - 主题和图片列表
+        tuple: (topic, images, bypass_cache) - 主题、图片列表和是否跳过缓存
     """
     # 检查是否是 multipart/form-data（带图片文件）
     if request.content_type and 'multipart/form-data' in request.content_type:
         topic = request.form.get('topic')
+        bypass_cache = request.form.get('bypass_cache', '').strip().lower() in ('1', 'true', 'yes', 'on')
         images = []
 
         # 获取上传的图片文件
@@ -116,11 +121,12 @@ def _parse_outline_request():
                     image_data = file.read()
                     images.append(image_data)
 
-        return topic, images
+        return topic, images, bypass_cache
 
     # JSON 请求（无图片或 base64 图片）
     data = request.get_json()
     topic = data.get('topic')
+    bypass_cache = bool(data.get('bypass_cache', False))
     images = []
 
     # 支持 base64 格式的图片
@@ -132,4 +138,4 @@ def _parse_outline_request():
                 img_b64 = img_b64.split(',')[1]
             images.append(base64.b64decode(img_b64))
 
-    return topic, images
+    return topic, images, bypass_cache
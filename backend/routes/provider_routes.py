@@ -1,7 +1,15 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from ..db import SessionLocal
-from ..models import ProviderConfig, UserProviderConfig, User, Image
+from ..models import ProviderConfig, UserProviderConfig, User, Image, PromptCacheEntry
+from ..services.image import reset_image_service
+from ..services.image_storage import collect_blob_hashes, release_blobs
+from ..services.prompt_cache import get_cache_stats
+from ..services.scheduling import get_user_weight, reset_user_weights
+from ..utils.http_session import get_http_pool_stats
+from ..utils.rate_limiter import get_limiter_stats
+from ..utils.circuit_breaker import get_breaker_stats
+from ..utils.hedging import get_latency_stats
 from werkzeug.security import generate_password_hash
 
 def create_provider_blueprint():
@@ -28,6 +36,7 @@ def create_provider_blueprint():
                 if k in data:
                     setattr(cfg, k, data[k])
             db.commit()
+            reset_image_service()
             return jsonify({"success": True}), 200
         finally:
             db.close()
@@ -51,6 +60,7 @@ def create_provider_blueprint():
                 if k in data:
                     setattr(cfg, k, data[k])
             db.commit()
+            reset_image_service()
             return jsonify({"success": True}), 200
         finally:
             db.close()
@@ -84,6 +94,7 @@ def create_provider_blueprint():
                 up.default_size = cfg.default_size
                 up.default_aspect_ratio = cfg.default_aspect_ratio
             db.commit()
+            reset_image_service()
             return jsonify({"success": True, "synced": len(users)}), 200
         finally:
             db.close()
@@ -117,6 +128,51 @@ def create_provider_blueprint():
         finally:
             db.close()
 
+    @bp.route('/admin/http-pools', methods=['GET'])
+    @jwt_required()
+    def get_http_pools():
+        """各服务商源站的 HTTP 连接复用统计"""
+        claims = get_jwt()
+        if claims.get('role') != 'admin':
+            return jsonify({"success": False, "error": "无权限"}), 403
+        return jsonify({"success": True, "pools": get_http_pool_stats()}), 200
+
+    @bp.route('/admin/rate-limits', methods=['GET'])
+    @jwt_required()
+    def get_rate_limits():
+        """各服务商/API Key 限流器的当前状态（并发数、排队数、限制参数）"""
+        claims = get_jwt()
+        if claims.get('role') != 'admin':
+            return jsonify({"success": False, "error": "无权限"}), 403
+        return jsonify({"success": True, "limiters": get_limiter_stats()}), 200
+
+    @bp.route('/admin/circuit-breakers', methods=['GET'])
+    @jwt_required()
+    def get_circuit_breakers():
+        """各服务商端点熔断器的状态（closed / open / half_open、连续失败次数等）"""
+        claims = get_jwt()
+        if claims.get('role') != 'admin':
+            return jsonify({"success": False, "error": "无权限"}), 403
+        return jsonify({"success": True, "breakers": get_breaker_stats()}), 200
+
+    @bp.route('/admin/image-latency', methods=['GET'])
+    @jwt_required()
+    def get_image_latency():
+        """各图片服务商最近的请求延迟分位数和对冲次数"""
+        claims = get_jwt()
+        if claims.get('role') != 'admin':
+            return jsonify({"success": False, "error": "无权限"}), 403
+        return jsonify({"success": True, "providers": get_latency_stats()}), 200
+
+    @bp.route('/admin/prompt-cache', methods=['GET'])
+    @jwt_required()
+    def get_prompt_cache_stats():
+        """图片生成缓存的条目数、总大小和命中次数"""
+        claims = get_jwt()
+        if claims.get('role') != 'admin':
+            return jsonify({"success": False, "error": "无权限"}), 403
+        return jsonify({"success": True, "cache": get_cache_stats()}), 200
+
     @bp.route('/admin/users', methods=['GET'])
     @jwt_required()
     def list_users():
@@ -134,6 +190,8 @@ def create_provider_blueprint():
                         "username": u.username,
                         "email": u.email,
                         "role": u.role,
+                        "schedule_weight": u.schedule_weight,
+                        "effective_weight": get_user_weight(u.id, db),
                         "created_at": u.created_at.isoformat() if u.created_at else None
                     } for u in users
                 ]
@@ -150,6 +208,11 @@ def create_provider_blueprint():
         data = request.get_json() or {}
         new_username = data.get('username')
         new_password = data.get('password')
+        # schedule_weight: 1-100 的整数，null 表示恢复按角色的默认权重
+        if 'schedule_weight' in data and data['schedule_weight'] is not None:
+            weight = data['schedule_weight']
+            if not isinstance(weight, int) or isinstance(weight, bool) or not 1 <= weight <= 100:
+                return jsonify({"success": False, "error": "schedule_weight 必须是 1-100 的整数"}), 400
         db = SessionLocal()
         try:
             user = db.query(User).get(user_id)
@@ -162,7 +225,10 @@ def create_provider_blueprint():
                 user.username = new_username
             if new_password:
                 user.password_hash = generate_password_hash(new_password)
+            if 'schedule_weight' in data:
+                user.schedule_weight = data['schedule_weight']
             db.commit()
+            reset_user_weights()
             return jsonify({"success": True}), 200
         finally:
             db.close()
@@ -186,10 +252,20 @@ def create_provider_blueprint():
             # 删除用户配置
             db.query(UserProviderConfig).filter(UserProviderConfig.user_id == user_id).delete()
             # 删除用户生成的图片
-            db.query(Image).filter(Image.user_id == user_id).delete()
+            images = db.query(Image).filter(Image.user_id == user_id).all()
+            removed_hashes = collect_blob_hashes(images)
+            for img in images:
+                db.delete(img)
+            # 删除用户写入的 prompt 结果缓存
+            cache_query = db.query(PromptCacheEntry).filter(PromptCacheEntry.user_id == user_id)
+            removed_hashes.update(row.image_hash for row in cache_query.with_entities(PromptCacheEntry.image_hash))
+            cache_query.delete(synchronize_session=False)
             # 删除用户
             db.delete(user)
             db.commit()
+            reset_image_service()
+            reset_user_weights()
+            release_blobs(removed_hashes)
             return jsonify({"success": True}), 200
         finally:
             db.close()
@@ -6,6 +6,7 @@ from typing import Dict, List, Optional, Any
 from sqlalchemy import desc
 from backend.db import SessionLocal
 from backend.models import History, Image
+from backend.services.image_storage import collect_blob_hashes, release_blobs
 
 logger = logging.getLogger(__name__)
 
@@ -155,11 +156,16 @@ class HistoryService:
             # 删除关联的图片 (Image Table)
             # 是否要物理删除？Image 表通常存 Blob。我们这里先只删记录。
             # 如果 task_id存在，且没有其他记录引用它（通常是一对一）。
+            removed_hashes = set()
             if record.task_id:
-                db.query(Image).filter(Image.task_id == record.task_id).delete()
+                images = db.query(Image).filter(Image.task_id == record.task_id).all()
+                removed_hashes = collect_blob_hashes(images)
+                for img in images:
+                    db.delete(img)
 
             db.delete(record)
             db.commit()
+            release_blobs(removed_hashes)
             return True
         except Exception as e:
             db.rollback()
@@ -239,7 +245,8 @@ class HistoryService:
             record = query.first()
             
             # 即使没有记录，也可以返回 Image 表的信息，但无法更新记录
-            images = db.query(Image).filter(Image.task_id == task_id).order_by(Image.index).all()
+            # 只查询文件名和索引，不加载整行 ORM 对象
+            images = db.query(Image.filename, Image.index).filter(Image.task_id == task_id).order_by(Image.index).all()
             image_files = [img.filename for img in images]
             
             if record:
@@ -1,17 +1,37 @@
 """图片生成服务"""
+import hashlib
+import json
 import logging
 import os
 import uuid
 import time
 import threading
+from collections import OrderedDict
+from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, Any, Generator, List, Optional, Tuple
 from backend.config import Config
 from backend.generators.factory import ImageGeneratorFactory
-from backend.utils.image_compressor import compress_image
+from backend.utils.image_compressor import compress_image, process_saved_image
+from backend.utils.image_pool import run_user_image_task
+from backend.utils.rate_limiter import RequestCancelled, get_provider_limiter
+from backend.utils.hedging import HedgeAttempt, get_latency_histogram, run_hedged
+from backend.services.scheduling import get_user_weight
+from backend.services import prompt_cache
+from backend.services.task_state import get_task_state_store
+from backend.services.image_storage import (
+    IMAGE_BLOB_COLUMNS, REFERENCE_IMAGE_KB, store_image_blobs, release_blobs, build_image_url,
+    collect_blob_hashes, cache_reference_image, get_reference_image, blob_reference_lock, image_blob_hashes
+)
 
 logger = logging.getLogger(__name__)
 
+# 缩略图压缩目标大小（KB）
+THUMBNAIL_KB = 50
+
+# 生效配置和生成器实例缓存的最大条目数
+SERVICE_CACHE_SIZE = 64
+
 
 class ImageService:
     """图片生成服务类"""
@@ -30,47 +50,23 @@ class ImageService:
         logger.debug("初始化 ImageService...")
         self.user_id = user_id  # 先设置 user_id，后面会用到
 
+        # 显式指定服务商时只使用该服务商，否则按 routing 配置在多个服务商之间路由
+        use_routing = provider_name is None
         if provider_name is None:
             provider_name = Config.get_active_image_provider()
 
         logger.info(f"使用图片服务商: {provider_name}")
-        provider_config = Config.get_image_provider_config_for_user(self.user_id or 0, provider_name)
-
-        # 创建生成器实例
-        provider_type = provider_config.get('type', provider_name)
-        logger.debug(f"创建生成器: type={provider_type}")
-        effective_config = provider_config.copy()
-        try:
-            from backend.db import SessionLocal
-            from backend.models import ProviderConfig, UserProviderConfig
-            db = SessionLocal()
-            try:
-                if user_id:
-                    up = db.query(UserProviderConfig).filter_by(user_id=user_id, provider_name=provider_name).first()
-                    if up:
-                        for k in ["api_key","base_url","model","quality","default_size","default_aspect_ratio"]:
-                            v = getattr(up, k)
-                            if v:
-                                effective_config[k] = v
-                gp = db.query(ProviderConfig).filter_by(provider_name=provider_name).first()
-                if gp:
-                    for k in ["api_key","base_url","model","quality","default_size","default_aspect_ratio","type"]:
-                        v = getattr(gp, k)
-                        if v:
-                            effective_config[k] = v
-            finally:
-                db.close()
-        except Exception:
-            pass
-        provider_type = effective_config.get('type', provider_type)
-        self.generator = ImageGeneratorFactory.create(provider_type, effective_config)
+        # 生效配置和生成器实例都有缓存，配置变更时由 reset_image_service 清除
+        effective_config = _get_effective_config(self.user_id, provider_name)
+        provider_type = effective_config.get('type', provider_name)
+        self.generator = _get_generator(provider_type, effective_config)
 
         # 保存配置信息
         self.provider_name = provider_name
         self.provider_config = effective_config
 
-        # 检查是否启用短 prompt 模式
-        self.use_short_prompt = provider_config.get('short_prompt', False)
+        # 参与路由的服务商（第一个为激活服务商，未配置 routing 时只有它）
+        self.routes = self._build_routes(use_routing)
 
         # 加载提示词模板
         self.prompt_template = self._load_prompt_template()
@@ -83,14 +79,233 @@ class ImageService:
         # 当前任务的输出目录（每个任务一个子文件夹）
         self.current_task_dir = None
 
-        # 存储任务状态（用于重试）
-        self._task_states: Dict[str, Dict] = {}
+        # 任务状态（用于重试），进程级共享，见 task_state 模块
+        self._task_states = get_task_state_store()
 
         logger.info(f"ImageService 初始化完成: provider={provider_name}, type={provider_type}")
 
+    def _build_routes(self, use_routing: bool) -> List["ProviderRoute"]:
+        """
+        按 routing 配置构建服务商路由
+
+        routing.weights 中的服务商按权重分配页面；routing.fallback 和未列入权重的
+        激活服务商只在出错时作为备用。配置不完整（如缺少 API Key）的服务商会被跳过。
+        """
+        routing = Config.get_image_routing() if use_routing else {"weights": {}, "fallback": []}
+        weights = routing["weights"]
+        primary = ProviderRoute(
+            self.provider_name, self.provider_config, self.generator,
+            weights.get(self.provider_name, 0.0 if weights else 1.0)
+        )
+        routes = [primary]
+        for name in list(weights) + routing["fallback"]:
+            if name == self.provider_name:
+                continue
+            try:
+                config = _get_effective_config(self.user_id, name)
+                generator = _get_generator(config.get('type', name), config)
+            except Exception as e:
+                if name not in _skipped_routes:
+                    _skipped_routes.add(name)
+                    logger.warning(f"路由服务商 {name} 不可用，已跳过: {str(e).splitlines()[0]}")
+                continue
+            routes.append(ProviderRoute(name, config, generator, weights.get(name, 0.0)))
+        if len(routes) > 1:
+            logger.debug(f"图片服务商路由: {[(r.name, r.weight) for r in routes]}")
+        return routes
+
+    def _route_order(self, preferred: Optional[str] = None, needs_reference: bool = False) -> List["ProviderRoute"]:
+        """
+        本次生成依次尝试的服务商
+
+        Args:
+            preferred: 优先使用的服务商（如重绘时沿用原图的服务商）
+            needs_reference: 是否带参考图，带参考图时优先使用支持参考图的服务商，保证风格一致
+        """
+        routes = self.routes
+        if len(routes) == 1:
+            return list(routes)
+        weighted = [r for r in routes if r.weight > 0] or routes[:1]
+        first = next((r for r in routes if r.name == preferred), None) or _pick_weighted_route(weighted)
+        rest = sorted((r for r in weighted if r is not first), key=lambda r: -r.weight)
+        order = [first] + rest + [r for r in routes if r.weight <= 0 and r is not first]
+        if needs_reference:
+            order.sort(key=lambda r: not r.supports_reference)
+        return order
+
+    def _build_prompt(
+        self,
+        route: "ProviderRoute",
+        page_type: str,
+        page_content: str,
+        full_outline: str = "",
+        user_topic: str = ""
+    ) -> str:
+        """按服务商的 short_prompt 配置生成 prompt"""
+        if route.config.get('short_prompt', False) and self.prompt_template_short:
+            logger.debug(f"  使用短 prompt 模式")
+            return self.prompt_template_short.format(page_content=page_content, page_type=page_type)
+        return self.prompt_template.format(
+            page_content=page_content,
+            page_type=page_type,
+            full_outline=full_outline,
+            user_topic=user_topic if user_topic else "未提供"
+        )
+
+    def _generate_with_failover(
+        self,
+        page: Dict,
+        reference_image: Optional[bytes] = None,
+        user_images: Optional[List[bytes]] = None,
+        full_outline: str = "",
+        user_topic: str = "",
+        preferred: Optional[str] = None,
+        attempt: Optional[HedgeAttempt] = None
+    ) -> Tuple[bytes, str]:
+        """
+        按路由生成一张图片，失败（包括超时）时依次切换到其他服务商
+
+        Args:
+            attempt: 对冲模式下的请求尝试（被取消时不再切换服务商）
+
+        Returns:
+            (图片数据, 实际生成图片的服务商)
+        """
+        order = self._route_order(preferred, needs_reference=bool(reference_image or user_images))
+        errors = []
+        for i, route in enumerate(order):
+            prompt = self._build_prompt(route, page["type"], page["content"], full_outline, user_topic)
+            try:
+                image_data = self._call_generator(prompt, reference_image, user_images, route, attempt)
+            except RequestCancelled:
+                raise
+            except Exception as e:
+                errors.append((route.name, e))
+                if i < len(order) - 1:
+                    logger.warning(
+                        f"⚠️ 服务商 {route.name} 生成图片 [{page['index']}] 失败，"
+                        f"切换到 {order[i + 1].name}: {str(e)[:100]}"
+                    )
+                continue
+            if errors:
+                logger.info(f"🔀 图片 [{page['index']}] 由备用服务商 {route.name} 生成")
+            return image_data, route.name
+
+        if len(errors) == 1:
+            raise errors[0][1]
+        tried = "、".join(name for name, _ in errors[1:])
+        raise Exception(f"{errors[0][1]}\n\n（已尝试备用服务商 {tried}，均失败）")
+
+    def _generate_page(
+        self,
+        page: Dict,
+        reference_image: Optional[bytes] = None,
+        user_images: Optional[List[bytes]] = None,
+        full_outline: str = "",
+        user_topic: str = "",
+        preferred: Optional[str] = None
+    ) -> Tuple[bytes, str]:
+        """
+        生成一页图片
+
+        开启对冲（IMAGE_HEDGING）且服务商延迟样本足够时，上游请求耗时超过该服务商
+        最近延迟的分位数阈值后，向下一个服务商（或同一服务商）发出重复请求，取先成功的结果。
+
+        Returns:
+            (图片数据, 实际生成图片的服务商)
+        """
+        if not Config.get_image_hedging():
+            return self._generate_with_failover(page, reference_image, user_images, full_outline, user_topic, preferred)
+
+        order = self._route_order(preferred, needs_reference=bool(reference_image or user_images))
+        primary = order[0]
+        histogram = get_latency_histogram(primary.name)
+        percentile = Config.get_image_hedge_percentile()
+        if histogram.count < Config.get_image_hedge_min_samples():
+            return self._generate_with_failover(
+                page, reference_image, user_images, full_outline, user_topic, primary.name
+            )
+        delay = histogram.percentile(percentile)
+        hedge_route = order[1] if len(order) > 1 and Config.get_image_hedge_target() == 'next' else primary
+
+        def generate(route_name: str):
+            return lambda attempt: self._generate_with_failover(
+                page, reference_image, user_images, full_outline, user_topic, route_name, attempt
+            )
+
+        def on_hedge():
+            histogram.record_hedge()
+            logger.info(
+                f"⏱️ 图片 [{page['index']}] 超过 {primary.name} 的 P{percentile} 延迟（{delay:.1f} 秒），"
+                f"向 {hedge_route.name} 发出对冲请求"
+            )
+
+        (image_data, provider), hedge_won = run_hedged(
+            generate(primary.name), generate(hedge_route.name), delay, on_hedge
+        )
+        if hedge_won:
+            histogram.record_hedge_win()
+            logger.info(f"🏁 图片 [{page['index']}] 由对冲请求先完成（provider={provider}）")
+        return image_data, provider
+
+    def _prompt_cache_keys(
+        self,
+        page: Dict,
+        reference_image: Optional[bytes] = None,
+        user_images: Optional[List[bytes]] = None,
+        full_outline: str = "",
+        user_topic: str = ""
+    ) -> Dict[str, str]:
+        """
+        各服务商生成该页图片的缓存键（未开启缓存时返回空字典）
+
+        缓存键包含渲染后的 prompt、服务商生成参数和参考图哈希；
+        服务商不支持参考图时参考图不会随请求发出，也不计入缓存键。
+        """
+        if not Config.get_prompt_cache_enabled():
+            return {}
+        keys = {}
+        for route in self.routes:
+            references = []
+            if route.supports_reference:
+                references = list(user_images or []) + ([reference_image] if reference_image else [])
+            prompt = self._build_prompt(route, page["type"], page["content"], full_outline, user_topic)
+            keys[route.name] = prompt_cache.build_cache_key(self.user_id, route.config, prompt, references)
+        return keys
+
+    def _lookup_prompt_cache(
+        self,
+        cache_keys: Dict[str, str],
+        preferred: Optional[str] = None
+    ) -> Optional[Tuple[bytes, str]]:
+        """查找缓存的图片（优先查找 preferred 服务商），返回 (图片数据, 服务商)"""
+        names = sorted(cache_keys, key=lambda name: name != preferred)
+        try:
+            cached = prompt_cache.lookup_image([cache_keys[name] for name in names])
+        except Exception as e:
+            logger.warning(f"读取图片生成缓存失败: {e}")
+            return None
+        if cached is None:
+            return None
+        key, image_data, provider = cached
+        return image_data, provider or next(name for name in names if cache_keys[name] == key)
+
+    def _store_prompt_cache(self, cache_keys: Dict[str, str], provider: str, image_data: bytes):
+        """把新生成的图片写入缓存（写入失败不影响生成结果）"""
+        key = cache_keys.get(provider)
+        if key is None:
+            return
+        try:
+            prompt_cache.store_image(key, self.user_id, provider, image_data)
+        except Exception as e:
+            logger.warning(f"写入图片生成缓存失败: {e}")
+
     def _load_prompt_template(self, short: bool = False) -> str:
-        """加载 Prompt 模板"""
+        """加载 Prompt 模板（读取一次后缓存）"""
         filename = "image_prompt_short.txt" if short else "image_prompt.txt"
+        template = _prompt_templates.get(filename)
+        if template is not None:
+            return template
         prompt_path = os.path.join(
             os.path.dirname(os.path.dirname(__file__)),
             "prompts",
@@ -98,11 +313,22 @@ class ImageService:
         )
         if not os.path.exists(prompt_path):
             # 如果短模板不存在，返回空字符串
-            return ""
-        with open(prompt_path, "r", encoding="utf-8") as f:
-            return f.read()
+            template = ""
+        else:
+            with open(prompt_path, "r", encoding="utf-8") as f:
+                template = f.read()
+        _prompt_templates[filename] = template
+        return template
 
-    def _save_image(self, image_data: bytes, filename: str, task_dir: str = None, index_override: Optional[int] = None) -> str:
+    def _save_image(
+        self,
+        image_data: bytes,
+        filename: str,
+        task_dir: str = None,
+        index_override: Optional[int] = None,
+        keep_reference: bool = False,
+        provider: Optional[str] = None
+    ) -> str:
         """
         保存图片到本地，同时生成缩略图
 
@@ -110,9 +336,10 @@ class ImageService:
             image_data: 图片二进制数据
             filename: 文件名
             task_dir: 任务目录（如果为None则使用当前任务目录）
+            keep_reference: 是否同时生成参考图并缓存（封面使用，后续页面直接复用）
 
         Returns:
-            保存的文件路径
+            图片内容哈希（用作图片 URL 的版本号）
         """
         if task_dir is None:
             task_dir = self.current_task_dir
@@ -122,28 +349,85 @@ class ImageService:
 
         from backend.db import SessionLocal
         from backend.models import Image
-        thumbnail_data = compress_image(image_data, max_size_kb=50)
+        # 缩略图、参考图（一次解码生成）和多尺寸版本，在图片处理池中执行
+        targets = [THUMBNAIL_KB, REFERENCE_IMAGE_KB] if keep_reference else [THUMBNAIL_KB]
+        compressed, renditions = run_user_image_task(
+            self.user_id, get_user_weight(self.user_id), process_saved_image, image_data, targets,
+            Config.get_image_rendition_widths(), Config.get_image_rendition_formats()
+        )
+        thumbnail_data = compressed[THUMBNAIL_KB]
+        old_hashes = set()
+        # 写入 blob 到提交 Image 记录期间锁定这些哈希，避免被并发的回收删除
+        with blob_reference_lock(image_blob_hashes(image_data, thumbnail_data, renditions)):
+            blob_fields = store_image_blobs(image_data, thumbnail_data, renditions)
+            db = SessionLocal()
+            try:
+                # 优先使用显式传入的索引，避免从文件名解析导致偏差
+                if index_override is not None:
+                    index = index_override
+                else:
+                    name_part = filename.split('.')[0]
+                    index_str = ''.join(filter(str.isdigit, name_part))
+                    index = int(index_str) if index_str else 0
+
+                img = db.query(Image).filter_by(user_id=self.user_id, task_id=os.path.basename(task_dir) if task_dir else "", filename=filename).first()
+                if not img:
+                    img = Image(user_id=self.user_id, task_id=os.path.basename(task_dir) if task_dir else "", index=index, filename=filename, provider=provider, **blob_fields)
+                    db.add(img)
+                else:
+                    old_hashes = collect_blob_hashes([img])
+                    for k, v in blob_fields.items():
+                        setattr(img, k, v)
+                    img.provider = provider
+                    img.updated_at = datetime.utcnow()
+                    old_hashes -= collect_blob_hashes([img])
+                db.commit()
+            finally:
+                db.close()
+        release_blobs(old_hashes)
+        if keep_reference:
+            cache_reference_image(blob_fields["image_hash"], compressed[REFERENCE_IMAGE_KB])
+        return blob_fields["image_hash"]
+
+    def _load_reference_image(self, task_id: str, index: int = 0) -> Optional[bytes]:
+        """
+        加载任务封面压缩后的参考图
+
+        优先命中按内容哈希索引的参考图缓存，未命中时才读取原图并压缩。
+        """
+        from backend.db import SessionLocal
         db = SessionLocal()
         try:
-            # 优先使用显式传入的索引，避免从文件名解析导致偏差
-            if index_override is not None:
-                index = index_override
-            else:
-                name_part = filename.split('.')[0]
-                index_str = ''.join(filter(str.isdigit, name_part))
-                index = int(index_str) if index_str else 0
-            
-            img = db.query(Image).filter_by(user_id=self.user_id, task_id=os.path.basename(task_dir) if task_dir else "", filename=filename).first()
-            if not img:
-                img = Image(user_id=self.user_id, task_id=os.path.basename(task_dir) if task_dir else "", index=index, filename=filename, image_data=image_data, thumbnail_data=thumbnail_data)
-                db.add(img)
-            else:
-                img.image_data = image_data
-                img.thumbnail_data = thumbnail_data
-            db.commit()
+            img_record = db.query(*IMAGE_BLOB_COLUMNS).filter_by(
+                user_id=self.user_id, task_id=task_id, index=index
+            ).first()
+        finally:
+            db.close()
+        return get_reference_image(img_record)
+
+    def _get_saved_provider(self, task_id: str, index: int) -> Optional[str]:
+        """已保存图片的生成服务商（没有记录时返回 None）"""
+        from backend.db import SessionLocal
+        from backend.models import Image
+        db = SessionLocal()
+        try:
+            row = db.query(Image.provider).filter_by(user_id=self.user_id, task_id=task_id, index=index).first()
+        finally:
+            db.close()
+        return row.provider if row else None
+
+    def _get_saved_image_urls(self, task_id: str) -> Dict[int, Tuple[str, str]]:
+        """获取任务已保存的图片：{index: (filename, image_url)}"""
+        from backend.db import SessionLocal
+        from backend.models import Image
+        db = SessionLocal()
+        try:
+            rows = db.query(Image.index, Image.filename, Image.image_hash).filter_by(
+                user_id=self.user_id, task_id=task_id
+            ).all()
         finally:
             db.close()
-        return filename
+        return {row.index: (row.filename, build_image_url(task_id, row.filename, row.image_hash)) for row in rows}
 
     def sync_images_with_pages(self, task_id: str, valid_indices: List[int]):
         """
@@ -158,22 +442,109 @@ class ImageService:
         
         # 获取所有图片
         db = SessionLocal()
+        removed_hashes = set()
         try:
-            images = db.query(Image).filter(Image.task_id == task_id).all()
-            for img in images:
-                if img.index not in valid_indices:
-                    # 删除数据库记录
-                    db.delete(img)
+            # 只查询元数据列，不加载整行 ORM 对象
+            rows = db.query(
+                Image.id, Image.index, Image.filename, Image.image_hash, Image.thumbnail_hash, Image.renditions
+            ).filter(Image.task_id == task_id).all()
+            stale_ids = []
+            for row in rows:
+                if row.index not in valid_indices:
+                    stale_ids.append(row.id)
+                    removed_hashes.update(collect_blob_hashes([row]))
                     # 删除文件
-                    file_path = os.path.join(task_dir, img.filename)
+                    file_path = os.path.join(task_dir, row.filename)
                     if os.path.exists(file_path):
                         try:
                             os.remove(file_path)
                         except OSError:
                             pass
+            if stale_ids:
+                # 删除数据库记录
+                db.query(Image).filter(Image.id.in_(stale_ids)).delete(synchronize_session=False)
             db.commit()
         finally:
             db.close()
+        release_blobs(removed_hashes)
+
+    def _call_generator(
+        self,
+        prompt: str,
+        reference_image: Optional[bytes] = None,
+        user_images: Optional[List[bytes]] = None,
+        route: Optional["ProviderRoute"] = None,
+        attempt: Optional[HedgeAttempt] = None
+    ) -> bytes:
+        """
+        调用生成器生成一张图片
+
+        调用前先向服务商/API Key 对应的全局限流器申请名额，
+        所有用户、所有任务共享同一上游配额，排队时按用户权重公平分配。
+        请求结果计入端点熔断器，熔断中直接抛出 CircuitOpenError；
+        成功请求的耗时计入服务商延迟直方图（对冲阈值）。
+
+        Args:
+            route: 使用的服务商，默认为激活服务商
+            attempt: 对冲模式下的请求尝试，拿到名额时已被取消则放弃请求
+        """
+        route = route or self.routes[0]
+        # 熔断中的服务商直接失败（可切换到其他服务商），不占用限流名额
+        breaker = route.generator.circuit_breaker
+        breaker.check()
+        limiter = get_provider_limiter(route.name, route.config)
+        with limiter.slot(user=self.user_id, weight=get_user_weight(self.user_id)):
+            if attempt is not None:
+                attempt.begin()
+            started = time.monotonic()
+            with breaker.guard():
+                image_data = self._invoke_generator(route, prompt, reference_image, user_images)
+            get_latency_histogram(route.name).record(time.monotonic() - started)
+            if attempt is not None:
+                attempt.complete()
+            return image_data
+
+    def _invoke_generator(
+        self,
+        route: "ProviderRoute",
+        prompt: str,
+        reference_image: Optional[bytes] = None,
+        user_images: Optional[List[bytes]] = None
+    ) -> bytes:
+        """按服务商类型传参调用生成器"""
+        config = route.config
+        if config.get('type') == 'google_genai':
+            logger.debug(f"  使用 Google GenAI 生成器 ({route.name})")
+            return route.generator.generate_image(
+                prompt=prompt,
+                aspect_ratio=config.get('default_aspect_ratio', '3:4'),
+                temperature=config.get('temperature', 1.0),
+                model=config.get('model', 'gemini-3-pro-image-preview'),
+                reference_image=reference_image,
+            )
+        elif config.get('type') == 'image_api':
+            logger.debug(f"  使用 Image API 生成器 ({route.name})")
+            reference_images = []
+            if user_images:
+                reference_images.extend(user_images)
+            if reference_image:
+                reference_images.append(reference_image)
+
+            return route.generator.generate_image(
+                prompt=prompt,
+                aspect_ratio=config.get('default_aspect_ratio', '3:4'),
+                temperature=config.get('temperature', 1.0),
+                model=config.get('model', 'nano-banana-2'),
+                reference_images=reference_images if reference_images else None,
+            )
+        else:
+            logger.debug(f"  使用 OpenAI 兼容生成器 ({route.name})")
+            return route.generator.generate_image(
+                prompt=prompt,
+                size=config.get('default_size', '1024x1024'),
+                model=config.get('model'),
+                quality=config.get('quality', 'standard'),
+            )
 
     def _generate_single_image(
         self,
@@ -184,11 +555,15 @@ class ImageService:
         full_outline: str = "",
         user_images: Optional[List[bytes]] = None,
         user_topic: str = "",
-        keyword: str = ""
-    ) -> Tuple[int, bool, Optional[str], Optional[str]]:
+        keyword: str = "",
+        use_cache: bool = True
+    ) -> Tuple[int, bool, Optional[str], Optional[str], Optional[str]]:
         """
         生成单张图片（不自动重试）
 
+        开启图片生成缓存时，相同 prompt、参数和参考图的页面直接复用缓存的图片，
+        新生成的图片写入缓存。
+
         Args:
             page: 页面数据
             task_id: 任务ID
@@ -197,75 +572,43 @@ class ImageService:
             full_outline: 完整的大纲文本
             user_images: 用户上传的参考图片列表
             user_topic: 用户原始输入
+            use_cache: 是否查找缓存（为 False 时仍会写入缓存）
 
         Returns:
-            (index, success, filename, error_message)
+            (index, success, filename, error_message, image_url)
         """
         index = page["index"]
         page_type = page["type"]
-        page_content = page["content"]
 
         try:
             logger.debug(f"生成图片 [{index}]: type={page_type}")
 
-            if self.use_short_prompt and self.prompt_template_short:
-                prompt = self.prompt_template_short.format(
-                    page_content=page_content,
-                    page_type=page_type
-                )
-                logger.debug(f"  使用短 prompt 模式 ({len(prompt)} 字符)")
-            else:
-                prompt = self.prompt_template.format(
-                    page_content=page_content,
-                    page_type=page_type,
-                    full_outline=full_outline,
-                    user_topic=user_topic if user_topic else "未提供"
-                )
-
-            if self.provider_config.get('type') == 'google_genai':
-                logger.debug(f"  使用 Google GenAI 生成器")
-                image_data = self.generator.generate_image(
-                    prompt=prompt,
-                    aspect_ratio=self.provider_config.get('default_aspect_ratio', '3:4'),
-                    temperature=self.provider_config.get('temperature', 1.0),
-                    model=self.provider_config.get('model', 'gemini-3-pro-image-preview'),
-                    reference_image=reference_image,
-                )
-            elif self.provider_config.get('type') == 'image_api':
-                logger.debug(f"  使用 Image API 生成器")
-                reference_images = []
-                if user_images:
-                    reference_images.extend(user_images)
-                if reference_image:
-                    reference_images.append(reference_image)
-
-                image_data = self.generator.generate_image(
-                    prompt=prompt,
-                    aspect_ratio=self.provider_config.get('default_aspect_ratio', '3:4'),
-                    temperature=self.provider_config.get('temperature', 1.0),
-                    model=self.provider_config.get('model', 'nano-banana-2'),
-                    reference_images=reference_images if reference_images else None,
-                )
+            cache_keys = self._prompt_cache_keys(page, reference_image, user_images, full_outline, user_topic)
+            cached = self._lookup_prompt_cache(cache_keys) if use_cache and cache_keys else None
+            if cached is not None:
+                image_data, provider = cached
+                logger.info(f"♻️ 图片 [{index}] 命中生成缓存 (provider={provider})")
             else:
-                logger.debug(f"  使用 OpenAI 兼容生成器")
-                image_data = self.generator.generate_image(
-                    prompt=prompt,
-                    size=self.provider_config.get('default_size', '1024x1024'),
-                    model=self.provider_config.get('model'),
-                    quality=self.provider_config.get('quality', 'standard'),
+                image_data, provider = self._generate_page(
+                    page, reference_image, user_images, full_outline, user_topic
                 )
+                self._store_prompt_cache(cache_keys, provider, image_data)
 
             # 文件命名从 1 开始，但数据库索引保持从 0 开始
             filename = f"{keyword}{index + 1}.png" if keyword else f"{index + 1}.png"
-            self._save_image(image_data, filename, self.current_task_dir, index_override=index)
-            logger.info(f"✅ 图片 [{index}] 生成成功: {filename} (keyword={keyword})")
+            image_hash = self._save_image(
+                image_data, filename, self.current_task_dir, index_override=index,
+                keep_reference=(page_type == "cover"), provider=provider
+            )
+            self._task_states.mark_provider(self._state_key(task_id), index, provider)
+            logger.info(f"✅ 图片 [{index}] 生成成功: {filename} (keyword={keyword}, provider={provider})")
 
-            return (index, True, filename, None)
+            return (index, True, filename, None, build_image_url(task_id, filename, image_hash))
 
         except Exception as e:
             error_msg = str(e)
             logger.error(f"❌ 图片 [{index}] 生成失败: {error_msg[:200]}")
-            return (index, False, None, error_msg)
+            return (index, False, None, error_msg, None)
 
     def generate_images(
         self,
@@ -274,7 +617,9 @@ class ImageService:
         full_outline: str = "",
         user_images: Optional[List[bytes]] = None,
         user_topic: str = "",
-        keyword: str = ""
+        keyword: str = "",
+        resume: bool = False,
+        use_cache: bool = True
     ) -> Generator[Dict[str, Any], None, None]:
         """
         生成图片（生成器，支持 SSE 流式返回）
@@ -286,6 +631,8 @@ class ImageService:
             full_outline: 完整的大纲文本（用于保持风格一致）
             user_images: 用户上传的参考图片列表（可选）
             user_topic: 用户原始输入（用于保持意图一致）
+            resume: 断点续跑（后台任务中断后重新执行时使用），已保存的页面直接视为完成
+            use_cache: 是否复用图片生成缓存（用户要求重新生成时为 False）
 
         Yields:
             进度事件字典
@@ -308,10 +655,16 @@ class ImageService:
         # 压缩用户上传的参考图到200KB以内（减少内存和传输开销）
         compressed_user_images = None
         if user_images:
-            compressed_user_images = [compress_image(img, max_size_kb=200) for img in user_images]
+            compressed_user_images = [
+                run_user_image_task(
+                    self.user_id, get_user_weight(self.user_id), compress_image, img, max_size_kb=REFERENCE_IMAGE_KB
+                )
+                for img in user_images
+            ]
 
         # 初始化任务状态
-        self._task_states[task_id] = {
+        state_key = self._state_key(task_id)
+        self._task_states.set(state_key, {
             "pages": pages,
             "generated": {},
             "failed": {},
@@ -320,7 +673,7 @@ class ImageService:
             "user_images": compressed_user_images,
             "user_topic": user_topic,
             "keyword": keyword
-        }
+        })
 
         # 同步图片数量（删除多余的图片）
         # 这一步是为了确保如果大纲删除了页面，对应的旧图片也会被删除
@@ -342,6 +695,33 @@ class ImageService:
             cover_page = pages[0]
             other_pages = pages[1:]
 
+        # 断点续跑：已保存的页面直接返回完成事件，不再重新生成
+        if resume:
+            existing = self._get_saved_image_urls(task_id)
+            for page in ([cover_page] if cover_page else []) + other_pages:
+                if page["index"] not in existing:
+                    continue
+                filename, image_url = existing[page["index"]]
+                generated_images.append(filename)
+                self._task_states.mark_generated(state_key, page["index"], filename)
+                yield {
+                    "event": "complete",
+                    "data": {
+                        "index": page["index"],
+                        "status": "done",
+                        "image_url": image_url,
+                        "phase": "cover" if page is cover_page else "content"
+                    }
+                }
+            other_pages = [p for p in other_pages if p["index"] not in existing]
+            if cover_page and cover_page["index"] in existing:
+                try:
+                    cover_image_data = self._load_reference_image(task_id, cover_page["index"])
+                    self._task_states.update(state_key, cover_image=cover_image_data)
+                except Exception as e:
+                    logger.warning(f"无法加载封面图片作为参考: {e}")
+                cover_page = None
+
         if cover_page:
             # 发送封面生成进度
             yield {
@@ -357,29 +737,20 @@ class ImageService:
             }
 
             # 生成封面（使用用户上传的图片作为参考）
-            index, success, filename, error = self._generate_single_image(
+            index, success, filename, error, image_url = self._generate_single_image(
                 cover_page, task_id, reference_image=None, full_outline=full_outline,
-                user_images=compressed_user_images, user_topic=user_topic, keyword=keyword
+                user_images=compressed_user_images, user_topic=user_topic, keyword=keyword,
+                use_cache=use_cache
             )
 
             if success:
                 generated_images.append(filename)
-                self._task_states[task_id]["generated"][index] = filename
+                self._task_states.mark_generated(state_key, index, filename)
 
-                # 从数据库读取封面图片数据来压缩作为参考图
+                # 封面压缩后的参考图（保存时已生成并缓存）
                 try:
-                    from backend.db import SessionLocal
-                    from backend.models import Image as ImageModel
-                    db = SessionLocal()
-                    try:
-                        img_record = db.query(ImageModel).filter_by(
-                            user_id=self.user_id, task_id=task_id, filename=filename
-                        ).first()
-                        if img_record and img_record.image_data:
-                            cover_image_data = compress_image(img_record.image_data, max_size_kb=200)
-                            self._task_states[task_id]["cover_image"] = cover_image_data
-                    finally:
-                        db.close()
+                    cover_image_data = self._load_reference_image(task_id, index)
+                    self._task_states.update(state_key, cover_image=cover_image_data)
                 except Exception as e:
                     logger.warning(f"无法加载封面图片作为参考: {e}")
 
@@ -388,13 +759,13 @@ class ImageService:
                     "data": {
                         "index": index,
                         "status": "done",
-                        "image_url": f"/api/images/{task_id}/{filename}",
+                        "image_url": image_url,
                         "phase": "cover"
                     }
                 }
             else:
                 failed_pages.append(cover_page)
-                self._task_states[task_id]["failed"][index] = error
+                self._task_states.mark_failed(state_key, index, error)
 
                 yield {
                     "event": "error",
@@ -409,11 +780,13 @@ class ImageService:
 
         # ==================== 第二阶段：生成其他页面 ====================
         if other_pages:
-            # 检查是否启用高并发模式
+            # 高并发模式或显式开启自适应并发时并行提交，实际并发数由服务商限流器控制；
+            # 否则按顺序生成（high_concurrency: false 且未配置 adaptive_concurrency 时）
             high_concurrency = self.provider_config.get('high_concurrency', False)
+            limiter = get_provider_limiter(self.provider_name, self.provider_config)
 
-            if high_concurrency:
-                # 高并发模式：并行生成
+            if high_concurrency or limiter.adaptive:
+                # 并行生成
                 yield {
                     "event": "progress",
                     "data": {
@@ -437,9 +810,9 @@ class ImageService:
                             0,  # retry_count
                             full_outline,  # 传入完整大纲
                             compressed_user_images,  # 用户上传的参考图片（已压缩）
-                            compressed_user_images,  # 用户上传的参考图片（已压缩）
                             user_topic,  # 用户原始输入
-                            keyword  # 关键词
+                            keyword,  # 关键词
+                            use_cache
                         ): page
                         for page in other_pages
                     }
@@ -461,24 +834,24 @@ class ImageService:
                     for future in as_completed(future_to_page):
                         page = future_to_page[future]
                         try:
-                            index, success, filename, error = future.result()
+                            index, success, filename, error, image_url = future.result()
 
                             if success:
                                 generated_images.append(filename)
-                                self._task_states[task_id]["generated"][index] = filename
+                                self._task_states.mark_generated(state_key, index, filename)
 
                                 yield {
                                     "event": "complete",
                                     "data": {
                                         "index": index,
                                         "status": "done",
-                                        "image_url": f"/api/images/{task_id}/{filename}",
+                                        "image_url": image_url,
                                         "phase": "content"
                                     }
                                 }
                             else:
                                 failed_pages.append(page)
-                                self._task_states[task_id]["failed"][index] = error
+                                self._task_states.mark_failed(state_key, index, error)
 
                                 yield {
                                     "event": "error",
@@ -494,7 +867,7 @@ class ImageService:
                         except Exception as e:
                             failed_pages.append(page)
                             error_msg = str(e)
-                            self._task_states[task_id]["failed"][page["index"]] = error_msg
+                            self._task_states.mark_failed(state_key, page["index"], error_msg)
 
                             yield {
                                 "event": "error",
@@ -533,35 +906,34 @@ class ImageService:
                     }
 
                     # 生成单张图片
-                    index, success, filename, error = self._generate_single_image(
+                    index, success, filename, error, image_url = self._generate_single_image(
                         page,
                         task_id,
                         cover_image_data,
                         0,
                         full_outline,
                         compressed_user_images,
-                        full_outline,
-                        compressed_user_images,
                         user_topic,
-                        keyword
+                        keyword,
+                        use_cache
                     )
 
                     if success:
                         generated_images.append(filename)
-                        self._task_states[task_id]["generated"][index] = filename
+                        self._task_states.mark_generated(state_key, index, filename)
 
                         yield {
                             "event": "complete",
                             "data": {
                                 "index": index,
                                 "status": "done",
-                                "image_url": f"/api/images/{task_id}/{filename}",
+                                "image_url": image_url,
                                 "phase": "content"
                             }
                         }
                     else:
                         failed_pages.append(page)
-                        self._task_states[task_id]["failed"][index] = error
+                        self._task_states.mark_failed(state_key, index, error)
 
                         yield {
                             "event": "error",
@@ -618,8 +990,9 @@ class ImageService:
         user_images = None
 
         # 首先尝试从任务状态中获取上下文
-        if task_id in self._task_states:
-            task_state = self._task_states[task_id]
+        state_key = self._state_key(task_id)
+        task_state = self._task_states.get(state_key)
+        if task_state:
             if use_reference:
                 reference_image = task_state.get("cover_image")
             # 如果没有传入上下文，则使用任务状态中的
@@ -631,16 +1004,14 @@ class ImageService:
             if not keyword:
                 keyword = task_state.get("keyword", "")
 
-        # 如果任务状态中没有封面图，尝试从文件系统加载
+        # 如果任务状态中没有封面图，从已保存的封面加载
         if use_reference and reference_image is None:
-            cover_path = os.path.join(self.current_task_dir, "0.png")
-            if os.path.exists(cover_path):
-                with open(cover_path, "rb") as f:
-                    cover_data = f.read()
-                # 压缩封面图到 200KB
-                reference_image = compress_image(cover_data, max_size_kb=200)
-
-        index, success, filename, error = self._generate_single_image(
+            try:
+                reference_image = self._load_reference_image(task_id)
+            except Exception as e:
+                logger.warning(f"无法加载封面图片作为参考: {e}")
+
+        index, success, filename, error, image_url = self._generate_single_image(
             page,
             task_id,
             reference_image,
@@ -652,15 +1023,12 @@ class ImageService:
         )
 
         if success:
-            if task_id in self._task_states:
-                self._task_states[task_id]["generated"][index] = filename
-                if index in self._task_states[task_id]["failed"]:
-                    del self._task_states[task_id]["failed"][index]
+            self._task_states.mark_generated(state_key, index, filename)
 
             return {
                 "success": True,
                 "index": index,
-                "image_url": f"/api/images/{task_id}/{filename}"
+                "image_url": image_url
             }
         else:
             return {
@@ -685,10 +1053,20 @@ class ImageService:
         Yields:
             进度事件
         """
+        self.current_task_dir = os.path.join(self.history_root_dir, task_id)
+        os.makedirs(self.current_task_dir, exist_ok=True)
+
         # 获取参考图
-        reference_image = None
-        if task_id in self._task_states:
-            reference_image = self._task_states[task_id].get("cover_image")
+        state_key = self._state_key(task_id)
+        task_state = self._task_states.get(state_key) or {}
+        reference_image = task_state.get("cover_image")
+
+        # 任务状态中没有封面图时（如在后台任务中执行），从已保存的封面加载
+        if reference_image is None:
+            try:
+                reference_image = self._load_reference_image(task_id)
+            except Exception as e:
+                logger.warning(f"无法加载封面图片作为参考: {e}")
 
         total = len(pages)
         success_count = 0
@@ -704,10 +1082,8 @@ class ImageService:
 
         # 并发重试
         # 从任务状态中获取完整大纲
-        full_outline = ""
-        if task_id in self._task_states:
-            full_outline = self._task_states[task_id].get("full_outline", "")
-            keyword = self._task_states[task_id].get("keyword", "")
+        full_outline = task_state.get("full_outline", "")
+        keyword = task_state.get("keyword", "")
 
         with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT) as executor:
             future_to_page = {
@@ -728,21 +1104,18 @@ class ImageService:
             for future in as_completed(future_to_page):
                 page = future_to_page[future]
                 try:
-                    index, success, filename, error = future.result()
+                    index, success, filename, error, image_url = future.result()
 
                     if success:
                         success_count += 1
-                        if task_id in self._task_states:
-                            self._task_states[task_id]["generated"][index] = filename
-                            if index in self._task_states[task_id]["failed"]:
-                                del self._task_states[task_id]["failed"][index]
+                        self._task_states.mark_generated(state_key, index, filename)
 
                         yield {
                             "event": "complete",
                             "data": {
                                 "index": index,
                                 "status": "done",
-                                "image_url": f"/api/images/{task_id}/{filename}"
+                                "image_url": image_url
                             }
                         }
                     else:
@@ -809,8 +1182,9 @@ class ImageService:
         # 取参考图与上下文
         reference_image = None
         user_images = None
-        if task_id in self._task_states:
-            task_state = self._task_states[task_id]
+        state_key = self._state_key(task_id)
+        task_state = self._task_states.get(state_key)
+        if task_state:
             if use_reference:
                 reference_image = task_state.get("cover_image")
             if not full_outline:
@@ -821,95 +1195,55 @@ class ImageService:
             if not keyword:
                 keyword = task_state.get("keyword", "")
 
-        # 如果任务状态中没有封面图，尝试从文件系统加载
+        # 如果任务状态中没有封面图，从已保存的封面加载
         if use_reference and reference_image is None:
             try:
-                from backend.db import SessionLocal
-                from backend.models import Image as ImageModel
-                db = SessionLocal()
-                try:
-                    img_record = db.query(ImageModel).filter_by(user_id=self.user_id, task_id=task_id, index=0).first()
-                    if img_record and img_record.image_data:
-                        reference_image = compress_image(img_record.image_data, max_size_kb=200)
-                finally:
-                    db.close()
+                reference_image = self._load_reference_image(task_id)
             except Exception:
                 pass
 
-        # 直接生成新图片数据（不持久化）
+        # 直接生成新图片数据（不持久化），优先沿用原图的服务商保持风格一致
+        # 用户明确要求重新生成，不读取缓存，新图片覆盖缓存中的旧结果
         index = page["index"]
         page_type = page["type"]
-        page_content = page["content"]
+        preferred = ((task_state or {}).get("providers") or {}).get(index) or self._get_saved_provider(task_id, index)
         try:
-            if self.use_short_prompt and self.prompt_template_short:
-                prompt = self.prompt_template_short.format(page_content=page_content, page_type=page_type)
-            else:
-                prompt = self.prompt_template.format(
-                    page_content=page_content,
-                    page_type=page_type,
-                    full_outline=full_outline,
-                    user_topic=user_topic if user_topic else "未提供"
-                )
-
-            if self.provider_config.get('type') == 'google_genai':
-                image_data = self.generator.generate_image(
-                    prompt=prompt,
-                    aspect_ratio=self.provider_config.get('default_aspect_ratio', '3:4'),
-                    temperature=self.provider_config.get('temperature', 1.0),
-                    model=self.provider_config.get('model', 'gemini-3-pro-image-preview'),
-                    reference_image=reference_image,
-                )
-            elif self.provider_config.get('type') == 'image_api':
-                reference_images = []
-                if user_images:
-                    reference_images.extend(user_images)
-                if reference_image:
-                    reference_images.append(reference_image)
-                image_data = self.generator.generate_image(
-                    prompt=prompt,
-                    aspect_ratio=self.provider_config.get('default_aspect_ratio', '3:4'),
-                    temperature=self.provider_config.get('temperature', 1.0),
-                    model=self.provider_config.get('model', 'nano-banana-2'),
-                    reference_images=reference_images if reference_images else None,
-                )
-            else:
-                image_data = self.generator.generate_image(
-                    prompt=prompt,
-                    size=self.provider_config.get('default_size', '1024x1024'),
-                    model=self.provider_config.get('model'),
-                    quality=self.provider_config.get('quality', 'standard'),
-                )
+            image_data, provider = self._generate_page(
+                page, reference_image, user_images, full_outline, user_topic, preferred=preferred
+            )
         except Exception as e:
             return {"success": False, "index": index, "error": str(e), "retryable": True}
+        self._store_prompt_cache(
+            self._prompt_cache_keys(page, reference_image, user_images, full_outline, user_topic),
+            provider, image_data
+        )
 
-        # 成功生成后，查找旧记录并覆盖（继承原文件名）
+        # 成功生成后，查找旧记录的文件名：_save_image 按文件名覆盖该记录，
+        # 保存成功后才回收旧图片的 blob（保存失败时旧记录和图片保持不变）
         from backend.db import SessionLocal
         from backend.models import Image as ImageModel
         db = SessionLocal()
-        old_filename = None
         try:
-            old = db.query(ImageModel).filter_by(user_id=self.user_id, task_id=task_id, index=index).first()
-            if old:
-                old_filename = old.filename
-                db.delete(old)
-                db.commit()
+            old = db.query(ImageModel.filename).filter_by(user_id=self.user_id, task_id=task_id, index=index).first()
         finally:
             db.close()
 
         # 若找不到旧文件名，则使用约定命名（1 开始）
-        filename = old_filename if old_filename else (f"{keyword}{index + 1}.png" if keyword else f"{index + 1}.png")
-        self._save_image(image_data, filename, self.current_task_dir, index_override=index)
+        filename = old.filename if old else (f"{keyword}{index + 1}.png" if keyword else f"{index + 1}.png")
+        image_hash = self._save_image(
+            image_data, filename, self.current_task_dir, index_override=index,
+            keep_reference=(page_type == "cover"), provider=provider
+        )
 
         # 更新任务状态
-        if task_id in self._task_states:
-            self._task_states[task_id]["generated"][index] = filename
-            if index in self._task_states[task_id]["failed"]:
-                del self._task_states[task_id]["failed"][index]
+        self._task_states.mark_generated(state_key, index, filename)
+        self._task_states.mark_provider(state_key, index, provider)
 
         return {
             "success": True,
             "index": index,
-            "image_url": f"/api/images/{task_id}/{filename}"
+            "image_url": build_image_url(task_id, filename, image_hash),
+            "provider": provider
         }
 
     def get_image_path(self, task_id: str, filename: str) -> str:
@@ -926,24 +1260,145 @@ class ImageService:
         task_dir = os.path.join(self.history_root_dir, task_id)
         return os.path.join(task_dir, filename)
 
+    def _state_key(self, task_id: str) -> str:
+        """任务状态存储的键（按用户隔离）"""
+        return f"{self.user_id}:{task_id}"
+
     def get_task_state(self, task_id: str) -> Optional[Dict]:
         """获取任务状态"""
-        return self._task_states.get(task_id)
+        return self._task_states.get(self._state_key(task_id))
 
     def cleanup_task(self, task_id: str):
         """清理任务状态（释放内存）"""
-        if task_id in self._task_states:
-            del self._task_states[task_id]
-
+        self._task_states.delete(self._state_key(task_id))
+
+
+# ==================== 实例缓存 ====================
+#
+# ImageService 本身保存当前任务目录等单次调用的状态，每个请求仍新建实例；
+# 构造实例时代价较高的部分在这里缓存：
+# - 生效配置（配置文件 + 全局/用户数据库配置合并），按 (user_id, 服务商) 缓存，避免每个请求查询数据库
+# - 生成器实例，按 (类型, 生效配置哈希) 缓存，复用已建立的 HTTP 客户端（如 genai.Client）
+# - 提示词模板
+# 配置文件或数据库中的服务商配置变更后，需调用 reset_image_service 清除
+
+class ProviderRoute:
+    """路由中的一个图片服务商"""
+
+    def __init__(self, name: str, config: Dict[str, Any], generator: Any, weight: float):
+        self.name = name
+        self.config = config
+        self.generator = generator
+        self.weight = weight
+
+    @property
+    def supports_reference(self) -> bool:
+        """是否支持参考图（OpenAI 兼容接口会忽略参考图）"""
+        return self.config.get('type') in ('google_genai', 'image_api')
+
+
+# 平滑加权轮询的状态：{服务商组合: {服务商: 当前值}}，所有请求共享，页面按权重比例分配
+_route_wrr: Dict[Tuple[str, ...], Dict[str, float]] = {}
+_route_wrr_lock = threading.Lock()
+# 已提示过配置不完整的路由服务商（避免每个请求都打印警告）
+_skipped_routes: set = set()
+
+
+def _pick_weighted_route(routes: List[ProviderRoute]) -> ProviderRoute:
+    """平滑加权轮询选择服务商（权重 3:1 时按 A A B A 的顺序分配）"""
+    if len(routes) == 1:
+        return routes[0]
+    key = tuple(sorted(r.name for r in routes))
+    total = sum(r.weight for r in routes)
+    with _route_wrr_lock:
+        current = _route_wrr.setdefault(key, {})
+        for r in routes:
+            current[r.name] = current.get(r.name, 0.0) + r.weight
+        best = max(routes, key=lambda r: current[r.name])
+        current[best.name] -= total
+    return best
+
+
+_effective_configs: "OrderedDict[Tuple[int, str], Dict[str, Any]]" = OrderedDict()
+_generators: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+_prompt_templates: Dict[str, str] = {}
+_cache_lock = threading.Lock()
+
+
+def _resolve_effective_config(user_id: Optional[int], provider_name: str) -> Dict[str, Any]:
+    """合并配置文件与数据库中的服务商配置（未配置或缺少 API Key 时抛出 ValueError）"""
+    effective_config = Config.get_image_provider_config_for_user(user_id or 0, provider_name).copy()
+    try:
+        from backend.db import SessionLocal
+        from backend.models import ProviderConfig, UserProviderConfig
+        db = SessionLocal()
+        try:
+            if user_id:
+                up = db.query(UserProviderConfig).filter_by(user_id=user_id, provider_name=provider_name).first()
+                if up:
+                    for k in ["api_key","base_url","model","quality","default_size","default_aspect_ratio"]:
+                        v = getattr(up, k)
+                        if v:
+                            effective_config[k] = v
+            gp = db.query(ProviderConfig).filter_by(provider_name=provider_name).first()
+            if gp:
+                for k in ["api_key","base_url","model","quality","default_size","default_aspect_ratio","type"]:
+                    v = getattr(gp, k)
+                    if v:
+                        effective_config[k] = v
+        finally:
+            db.close()
+    except Exception:
+        pass
+    return effective_config
+
+
+def _get_effective_config(user_id: Optional[int], provider_name: str) -> Dict[str, Any]:
+    key = (user_id or 0, provider_name)
+    with _cache_lock:
+        cached = _effective_configs.get(key)
+        if cached is not None:
+            _effective_configs.move_to_end(key)
+            return cached.copy()
+
+    config = _resolve_effective_config(user_id, provider_name)
+    with _cache_lock:
+        _effective_configs[key] = config
+        while len(_effective_configs) > SERVICE_CACHE_SIZE:
+            _effective_configs.popitem(last=False)
+    return config.copy()
+
+
+def _get_generator(provider_type: str, config: Dict[str, Any]):
+    """获取生成器实例，生效配置相同（如多个用户共用全局配置）时共享同一实例"""
+    config_hash = hashlib.sha256(
+        json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    key = (provider_type, config_hash)
+    with _cache_lock:
+        generator = _generators.get(key)
+        if generator is not None:
+            _generators.move_to_end(key)
+            return generator
+
+    logger.debug(f"创建生成器: type={provider_type}")
+    generator = ImageGeneratorFactory.create(provider_type, config)
+    with _cache_lock:
+        # 并发创建时保留先放入缓存的实例
+        generator = _generators.setdefault(key, generator)
+        _generators.move_to_end(key)
+        while len(_generators) > SERVICE_CACHE_SIZE:
+            _generators.popitem(last=False)
+    return generator
 
-# 全局服务实例
-_service_instance = None
 
 def get_image_service(user_id: int = None) -> ImageService:
-    global _service_instance
     return ImageService(user_id=user_id)
 
 def reset_image_service():
-    """重置全局服务实例（配置更新后调用）"""
-    global _service_instance
-    _service_instance = None
+    """清除服务实例缓存（配置文件或服务商配置更新后调用）"""
+    with _cache_lock:
+        _skipped_routes.clear()
+        _effective_configs.clear()
+        _generators.clear()
+        _prompt_templates.clear()
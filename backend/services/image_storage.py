@@ -0,0 +1,364 @@
+"""图片存储服务
+
+负责 Image 记录与 blob 存储之间的读写：
+- 保存图片/缩略图/多尺寸版本到 blob 存储，返回需要写入 Image 行的元数据
+- 读取图片数据
+- 缓存压缩后的封面参考图（按内容哈希），避免每页生成都重新解码压缩
+- 删除记录后回收不再被引用的 blob（与写入引用按哈希加锁互斥）
+- 一次性迁移：把旧版数据库中的 image_data / thumbnail_data BLOB 列搬到 blob 存储
+"""
+import io
+import json
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Iterable, Optional, Tuple
+from PIL import Image as PILImage
+from sqlalchemy import inspect, text, or_
+from backend.db import SessionLocal, engine, add_missing_columns
+from backend.models import Image, PromptCacheEntry
+from backend.utils.blob_store import BlobStore, get_blob_store, sniff_mime_type
+from backend.utils.image_compressor import compress_image
+from backend.utils.image_pool import run_image_task
+
+logger = logging.getLogger(__name__)
+
+LEGACY_BLOB_COLUMNS = ("image_data", "thumbnail_data")
+
+# 图片 URL 中版本号（内容哈希前缀）的长度
+IMAGE_VERSION_LENGTH = 16
+
+# 参考图（封面）压缩目标大小（KB）
+REFERENCE_IMAGE_KB = 200
+# 参考图缓存的最大条目数
+REFERENCE_CACHE_SIZE = 32
+
+# release_blobs 按子串匹配多尺寸版本时每批查询的哈希数
+RELEASE_BATCH_SIZE = 100
+
+# blob 引用锁的分段数（按哈希分段，不同哈希的写入和回收互不阻塞）
+BLOB_LOCK_STRIPES = 64
+
+# 读取图片数据所需的最少列，用于 db.query(*IMAGE_BLOB_COLUMNS) 投影查询
+IMAGE_BLOB_COLUMNS = (Image.task_id, Image.filename, Image.image_hash, Image.thumbnail_hash)
+
+
+_blob_locks = [threading.RLock() for _ in range(BLOB_LOCK_STRIPES)]
+
+
+@contextmanager
+def blob_reference_lock(hashes: Iterable[str]):
+    """
+    锁定一组 blob 哈希，期间 release_blobs 不会删除这些 blob
+
+    内容寻址存储中 store() 遇到已存在的 blob 直接返回，如果新记录提交前另一个线程
+    恰好回收了同一个 blob，新记录就会指向不存在的文件。写入方在 store() 到提交引用
+    记录之间、回收方在检查引用到删除文件之间都持有对应哈希的锁。
+    """
+    stripes = sorted({int(h[:8], 16) % BLOB_LOCK_STRIPES for h in hashes if h})
+    for i in stripes:
+        _blob_locks[i].acquire()
+    try:
+        yield
+    finally:
+        for i in reversed(stripes):
+            _blob_locks[i].release()
+
+
+def image_blob_hashes(
+    image_data: bytes,
+    thumbnail_data: bytes,
+    renditions: Optional[Dict[Tuple[int, str], bytes]] = None
+) -> set:
+    """store_image_blobs 将要写入的全部 blob 哈希（写入前加锁使用）"""
+    blobs = [image_data, thumbnail_data] + list((renditions or {}).values())
+    return {BlobStore.compute_hash(data) for data in blobs}
+
+
+def store_image_blobs(
+    image_data: bytes,
+    thumbnail_data: bytes,
+    renditions: Optional[Dict[Tuple[int, str], bytes]] = None
+) -> Dict[str, Any]:
+    """
+    保存原图、缩略图和多尺寸版本到 blob 存储
+
+    Args:
+        image_data: 原图数据
+        thumbnail_data: 缩略图数据
+        renditions: {(宽度, 格式): 图片数据}，见 generate_renditions
+
+    Returns:
+        可直接赋值给 Image 行的字段字典
+    """
+    store = get_blob_store()
+    rendition_meta = {}
+    for (width, fmt), data in (renditions or {}).items():
+        with PILImage.open(io.BytesIO(data)) as im:
+            w, h = im.size
+        key = str(width) if fmt == "jpeg" else f"{width}.{fmt}"
+        rendition_meta[key] = {
+            "hash": store.store(data),
+            "size": len(data),
+            "mime_type": sniff_mime_type(data),
+            "width": w,
+            "height": h,
+        }
+    return {
+        "image_hash": store.store(image_data),
+        "image_size": len(image_data),
+        "mime_type": sniff_mime_type(image_data),
+        "thumbnail_hash": store.store(thumbnail_data),
+        "thumbnail_size": len(thumbnail_data),
+        "thumbnail_mime_type": sniff_mime_type(thumbnail_data),
+        "renditions": json.dumps(rendition_meta) if rendition_meta else None,
+    }
+
+
+def parse_renditions(value: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """解析 Image.renditions 字段，格式错误或为空时返回空字典"""
+    if not value:
+        return {}
+    try:
+        data = json.loads(value)
+    except (TypeError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def select_rendition(
+    img,
+    width: int,
+    accepted_types: Iterable[str] = ()
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    按请求宽度和客户端支持的格式选择图片版本
+
+    返回宽度不小于请求宽度的最小版本，同一宽度下按 accepted_types 的顺序选择格式，
+    JPEG 总是可接受；没有合适的版本时返回原图。
+
+    Args:
+        img: 包含 image_hash / mime_type / renditions 列的 Image 对象或投影查询结果
+        width: 请求的显示宽度（像素）
+        accepted_types: 按优先级排列的可接受 MIME 类型，如 ["image/avif", "image/webp"]
+
+    Returns:
+        (blob 哈希, MIME 类型)
+    """
+    acceptable = [t for t in accepted_types if t != "image/jpeg"] + ["image/jpeg"]
+    candidates = []
+    for meta in parse_renditions(img.renditions).values():
+        if meta.get("hash") and meta.get("width", 0) >= width and meta.get("mime_type") in acceptable:
+            candidates.append(meta)
+    if candidates:
+        best = min(candidates, key=lambda m: (m["width"], acceptable.index(m["mime_type"])))
+        return best["hash"], best["mime_type"]
+    return img.image_hash, img.mime_type
+
+
+def read_image_data(img, thumbnail: bool = False) -> Optional[bytes]:
+    """
+    读取 Image 记录对应的图片数据，不存在时返回 None
+
+    Args:
+        img: Image 对象，或包含 IMAGE_BLOB_COLUMNS 的投影查询结果
+        thumbnail: 是否读取缩略图
+    """
+    blob_hash = img.thumbnail_hash if thumbnail else img.image_hash
+    if not blob_hash:
+        return None
+    try:
+        return get_blob_store().read(blob_hash)
+    except FileNotFoundError:
+        logger.warning(f"图片数据缺失: task={img.task_id}, file={img.filename}, hash={blob_hash}")
+        return None
+
+
+_reference_cache: "OrderedDict[str, bytes]" = OrderedDict()
+_reference_lock = threading.Lock()
+
+
+def cache_reference_image(image_hash: str, data: bytes):
+    """缓存某张图片压缩后的参考图（LRU）"""
+    if not image_hash or not data:
+        return
+    with _reference_lock:
+        _reference_cache[image_hash] = data
+        _reference_cache.move_to_end(image_hash)
+        while len(_reference_cache) > REFERENCE_CACHE_SIZE:
+            _reference_cache.popitem(last=False)
+
+
+def get_reference_image(img) -> Optional[bytes]:
+    """
+    获取图片压缩后的参考图（不超过 REFERENCE_IMAGE_KB）
+
+    缓存按原图内容哈希索引：同一任务的每一页都复用同一份压缩结果，
+    封面重新生成后哈希变化，自然不会命中旧缓存。
+
+    Args:
+        img: Image 对象，或包含 IMAGE_BLOB_COLUMNS 的投影查询结果
+
+    Returns:
+        压缩后的图片数据，图片数据不存在时返回 None
+    """
+    if img is None or not img.image_hash:
+        return None
+    with _reference_lock:
+        cached = _reference_cache.get(img.image_hash)
+        if cached is not None:
+            _reference_cache.move_to_end(img.image_hash)
+            return cached
+
+    raw = read_image_data(img)
+    if raw is None:
+        return None
+    data = run_image_task(compress_image, raw, max_size_kb=REFERENCE_IMAGE_KB)
+    cache_reference_image(img.image_hash, data)
+    return data
+
+
+def build_image_url(task_id: str, filename: str, image_hash: Optional[str] = None) -> str:
+    """
+    构建图片访问 URL
+
+    带上内容哈希前缀作为版本号（?v=...），同一 URL 的内容永远不变，
+    浏览器可以长期缓存；重新生成后哈希变化，URL 随之变化。
+    """
+    url = f"/api/images/{task_id}/{filename}"
+    if image_hash:
+        url += f"?v={image_hash[:IMAGE_VERSION_LENGTH]}"
+    return url
+
+
+def collect_blob_hashes(images: Iterable[Image]) -> set:
+    """收集 Image 记录引用的全部 blob 哈希（包括多尺寸版本）"""
+    hashes = set()
+    for img in images:
+        if img.image_hash:
+            hashes.add(img.image_hash)
+        if img.thumbnail_hash:
+            hashes.add(img.thumbnail_hash)
+        for meta in parse_renditions(img.renditions).values():
+            if meta.get("hash"):
+                hashes.add(meta["hash"])
+    return hashes
+
+
+def release_blobs(hashes: Iterable[str]) -> int:
+    """
+    删除不再被任何 Image 记录或图片生成缓存引用的 blob
+
+    需要在删除 Image 记录并提交之后调用（内容寻址，同一 blob 可能被多条记录共享）。
+    检查引用和删除文件期间持有 blob_reference_lock，不会删除正在写入引用的 blob。
+
+    Returns:
+        实际删除的 blob 数量
+    """
+    hashes = {h for h in hashes if h}
+    if not hashes:
+        return 0
+
+    with blob_reference_lock(hashes):
+        return _release_unreferenced(hashes)
+
+
+def _release_unreferenced(hashes: set) -> int:
+    """删除 hashes 中不再被引用的 blob（调用方已持有 blob_reference_lock）"""
+    db = SessionLocal()
+    still_used = set()
+    try:
+        rows = db.query(Image.image_hash, Image.thumbnail_hash).filter(
+            or_(Image.image_hash.in_(hashes), Image.thumbnail_hash.in_(hashes))
+        ).all()
+        for image_hash, thumbnail_hash in rows:
+            still_used.add(image_hash)
+            still_used.add(thumbnail_hash)
+        # 图片生成缓存也引用生成结果
+        still_used.update(h for (h,) in db.query(PromptCacheEntry.image_hash).filter(
+            PromptCacheEntry.image_hash.in_(hashes)
+        ).all())
+
+        # 多尺寸版本的哈希存放在 JSON 字段中，按子串匹配
+        candidates = list(hashes - still_used)
+        for i in range(0, len(candidates), RELEASE_BATCH_SIZE):
+            batch = candidates[i:i + RELEASE_BATCH_SIZE]
+            rows = db.query(Image.renditions).filter(
+                or_(*[Image.renditions.contains(h) for h in batch])
+            ).all()
+            for (renditions,) in rows:
+                still_used.update(h for h in batch if h in renditions)
+    finally:
+        db.close()
+
+    store = get_blob_store()
+    deleted = 0
+    for blob_hash in hashes - still_used:
+        try:
+            if store.delete(blob_hash):
+                deleted += 1
+        except Exception as e:
+            logger.warning(f"删除 blob 失败: {blob_hash}, {e}")
+    return deleted
+
+
+def migrate_legacy_blobs(batch_size: int = 50) -> int:
+    """
+    一次性迁移：把 images 表中的 BLOB 列搬到 blob 存储并删除这些列
+
+    旧库中不存在 BLOB 列时直接返回，可重复调用。
+
+    Returns:
+        迁移的记录数
+    """
+    columns = {c["name"] for c in inspect(engine).get_columns(Image.__tablename__)}
+    legacy = [c for c in LEGACY_BLOB_COLUMNS if c in columns]
+    if not legacy:
+        return 0
+
+    logger.info(f"📦 检测到旧版图片 BLOB 列 {legacy}，开始迁移到 blob 存储...")
+    table = Image.__tablename__
+
+    # 旧表缺少元数据列时补上（create_all 不会修改已存在的表）
+    add_missing_columns()
+
+    store = get_blob_store()
+    migrated = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                f'SELECT id, image_data, thumbnail_data FROM {table} '
+                f'WHERE image_hash IS NULL LIMIT :limit'
+            ), {"limit": batch_size}).fetchall()
+            if not rows:
+                break
+            for row_id, image_data, thumbnail_data in rows:
+                image_data = bytes(image_data or b"")
+                thumbnail_data = bytes(thumbnail_data or b"") or image_data
+                conn.execute(text(
+                    f'UPDATE {table} SET image_hash=:image_hash, image_size=:image_size, mime_type=:mime_type, '
+                    f'thumbnail_hash=:thumbnail_hash, thumbnail_size=:thumbnail_size, '
+                    f'thumbnail_mime_type=:thumbnail_mime_type WHERE id=:id'
+                ), {
+                    "id": row_id,
+                    "image_hash": store.store(image_data),
+                    "image_size": len(image_data),
+                    "mime_type": sniff_mime_type(image_data),
+                    "thumbnail_hash": store.store(thumbnail_data),
+                    "thumbnail_size": len(thumbnail_data),
+                    "thumbnail_mime_type": sniff_mime_type(thumbnail_data),
+                })
+                migrated += 1
+        logger.info(f"  已迁移 {migrated} 张图片")
+
+    with engine.begin() as conn:
+        for column in legacy:
+            conn.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+    if engine.dialect.name == "sqlite":
+        # 回收数据库文件中 BLOB 占用的空间
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+
+    logger.info(f"✅ 图片 BLOB 迁移完成: 共 {migrated} 张")
+    return migrated
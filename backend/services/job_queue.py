@@ -0,0 +1,575 @@
+"""图片生成后台任务队列
+
+POST /api/generate 只负责把生成任务写入 generation_jobs 表并立即返回，
+由后台工作线程领取并执行 ImageService.generate_images。客户端通过
+GET /api/jobs/<job_id>/events 订阅进度，可以随时断开、重新连接，
+浏览器断开连接或 Web 请求结束都不会中断生成。
+
+- 领取任务使用条件更新（status='queued' → 'running'），多进程部署时同一任务只会被一个工作线程执行
+- 运行中的任务定期写入心跳；进程重启或崩溃后，心跳超时的任务会重新入队并断点续跑
+- 进度事件按任务内递增序号写入 job_events 表，序号即 SSE 的 id 字段；
+  客户端重连时携带 Last-Event-ID，只回放之后的事件再继续实时推送
+- 领取任务时按用户公平调度：优先领取 运行中任务数/权重 最小的用户的最早任务，
+  一个用户排队的大量任务不会占满所有工作线程
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Generator, List, Optional
+
+from sqlalchemy import func
+
+from backend.db import SessionLocal
+from backend.models import GenerationJob, JobEvent
+from backend.services.scheduling import get_user_weight
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_DONE, JOB_FAILED)
+
+# 任务类型及其结束事件名
+JOB_KIND_GENERATE = "generate"
+JOB_KIND_RETRY = "retry"
+FINISH_EVENTS = {JOB_KIND_GENERATE: "finish", JOB_KIND_RETRY: "retry_finish"}
+
+# 本进程内保留事件记录的任务数
+EVENT_LOG_CAPACITY = 200
+
+
+class JobEventLog:
+    """
+    单个任务本次执行的事件记录（进程内）
+
+    事件先写入 job_events 表再追加到这里，本进程的订阅者据此实时推送，
+    无需轮询数据库；更早的事件（包括之前几次执行的）从数据库读取。
+    """
+
+    def __init__(self, last_seq: int = 0):
+        self.events: List[Dict[str, Any]] = []
+        self.last_seq = last_seq
+        self.finished = False
+        self._cond = threading.Condition()
+
+    def append(self, event: Dict[str, Any]):
+        with self._cond:
+            self.events.append(event)
+            self.last_seq = event["id"]
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+
+    def wait(self, after_id: int, timeout: float) -> List[Dict[str, Any]]:
+        """等待序号大于 after_id 的事件，超时返回空列表"""
+        with self._cond:
+            if self.last_seq <= after_id and not self.finished:
+                self._cond.wait(timeout)
+            return [e for e in self.events if e["id"] > after_id]
+
+
+class JobQueueService:
+    """图片生成任务队列（数据库持久化 + 后台工作线程池）"""
+
+    def __init__(self, num_workers: int, stale_seconds: int, max_attempts: int):
+        self.num_workers = num_workers
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running_jobs: Dict[str, str] = {}
+        self._running_lock = threading.Lock()
+        self._logs: "OrderedDict[str, JobEventLog]" = OrderedDict()
+        self._logs_lock = threading.Lock()
+
+    # ==================== 生命周期 ====================
+
+    def ensure_started(self):
+        """启动工作线程（只启动一次）"""
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            for i in range(self.num_workers):
+                threading.Thread(
+                    target=self._worker_loop, args=(f"{self.worker_prefix}:{i}",),
+                    name=f"job-worker-{i}", daemon=True
+                ).start()
+            threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True).start()
+            self._started = True
+            logger.info(f"🧵 图片生成任务队列已启动: workers={self.num_workers}")
+
+    # ==================== 提交与查询 ====================
+
+    def enqueue(
+        self,
+        user_id: int,
+        task_id: str,
+        pages: list,
+        kind: str = JOB_KIND_GENERATE,
+        full_outline: str = "",
+        user_topic: str = "",
+        keyword: str = "",
+        user_images: Optional[List[bytes]] = None,
+        bypass_cache: bool = False
+    ) -> Dict[str, Any]:
+        """
+        提交生成任务
+
+        用户参考图存入 blob 存储，任务表只记录哈希。
+
+        Args:
+            kind: JOB_KIND_GENERATE（批量生成）或 JOB_KIND_RETRY（批量重试失败的图片）
+            bypass_cache: 不复用图片生成缓存（用户要求重新生成）
+
+        Returns:
+            任务信息字典
+        """
+        from backend.services.image_storage import blob_reference_lock
+        from backend.utils.blob_store import BlobStore, get_blob_store
+
+        store = get_blob_store()
+        image_hashes = [BlobStore.compute_hash(img) for img in (user_images or [])]
+        payload = {
+            "kind": kind,
+            "pages": pages,
+            "full_outline": full_outline,
+            "user_topic": user_topic,
+            "keyword": keyword,
+            "user_image_hashes": image_hashes,
+            "bypass_cache": bypass_cache,
+        }
+        job = GenerationJob(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            task_id=task_id,
+            status=JOB_QUEUED,
+            payload=json.dumps(payload, ensure_ascii=False),
+            attempts=0,
+        )
+        # 写入参考图到提交任务期间锁定这些哈希，避免被其他任务结束时回收
+        with blob_reference_lock(image_hashes):
+            for img in user_images or []:
+                store.store(img)
+            db = SessionLocal()
+            try:
+                db.add(job)
+                db.commit()
+                info = self._to_dict(job)
+            finally:
+                db.close()
+
+        self.ensure_started()
+        self._wakeup.set()
+        logger.info(f"📥 图片生成任务已入队: job={info['id']}, task={task_id}, pages={len(pages)}")
+        return info
+
+    def get_job(self, job_id: str, user_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """查询任务（指定 user_id 时只返回该用户的任务）"""
+        db = SessionLocal()
+        try:
+            query = db.query(GenerationJob).filter(GenerationJob.id == job_id)
+            if user_id is not None:
+                query = query.filter(GenerationJob.user_id == user_id)
+            job = query.first()
+            return self._to_dict(job) if job else None
+        finally:
+            db.close()
+
+    def get_active_job_for_task(self, user_id: int, task_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务 ID 对应的未完成生成任务"""
+        db = SessionLocal()
+        try:
+            job = db.query(GenerationJob).filter(
+                GenerationJob.user_id == user_id,
+                GenerationJob.task_id == task_id,
+                GenerationJob.status.in_((JOB_QUEUED, JOB_RUNNING)),
+            ).order_by(GenerationJob.created_at.desc()).first()
+            return self._to_dict(job) if job else None
+        finally:
+            db.close()
+
+    def stream_events(
+        self,
+        job_id: str,
+        last_event_id: int = 0,
+        poll_interval: float = 1.0,
+        keepalive: float = 15.0
+    ) -> Generator[Optional[Dict[str, Any]], None, None]:
+        """
+        订阅任务进度事件
+
+        先从数据库回放序号大于 last_event_id 的事件；任务在本进程执行时随后
+        从进程内事件记录实时读取，否则轮询数据库，直到任务结束。
+
+        Args:
+            last_event_id: 客户端已收到的最后一个事件序号（SSE Last-Event-ID），0 表示从头开始
+
+        Yields:
+            事件字典（包含 id / event / data）；长时间无事件时 yield None（调用方可发送心跳保持连接）
+        """
+        after = last_event_id
+        idle = 0.0
+        while True:
+            # 先读状态再读事件：状态已结束时，结束事件一定已经写入
+            job = self.get_job(job_id)
+            if job is None:
+                return
+            for event in self._load_events(job_id, after):
+                after = event["id"]
+                idle = 0.0
+                yield event
+            if job["status"] in FINISHED_STATUSES:
+                return
+
+            log = self._get_log(job_id)
+            if log is not None and not log.finished:
+                after = yield from self._stream_from_log(log, after, keepalive)
+                continue
+
+            # 排队中，或由其他进程执行：轮询数据库
+            time.sleep(poll_interval)
+            idle += poll_interval
+            if idle >= keepalive:
+                idle = 0.0
+                yield None
+
+    def _stream_from_log(self, log: JobEventLog, after: int, keepalive: float):
+        """从进程内事件记录推送，直到本次执行结束；返回最后推送的事件序号"""
+        while True:
+            events = log.wait(after, keepalive)
+            if not events:
+                if log.finished:
+                    return after
+                yield None
+                continue
+            for event in events:
+                yield event
+            after = events[-1]["id"]
+
+    def _load_events(self, job_id: str, after: int) -> List[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            rows = db.query(JobEvent.seq, JobEvent.event, JobEvent.data).filter(
+                JobEvent.job_id == job_id, JobEvent.seq > after
+            ).order_by(JobEvent.seq).all()
+        finally:
+            db.close()
+        return [
+            {"id": seq, "event": event, "data": json.loads(data) if data else {}}
+            for seq, event, data in rows
+        ]
+
+    def _append_event(self, job_id: str, log: JobEventLog, event: Dict[str, Any]):
+        """写入一条事件：先持久化到 job_events 表，再通知本进程的订阅者"""
+        event = {"id": log.last_seq + 1, "event": event["event"], "data": event["data"]}
+        db = SessionLocal()
+        try:
+            db.add(JobEvent(
+                job_id=job_id,
+                seq=event["id"],
+                event=event["event"],
+                data=json.dumps(event["data"], ensure_ascii=False),
+            ))
+            db.commit()
+        finally:
+            db.close()
+        log.append(event)
+
+    # ==================== 工作线程 ====================
+
+    def _worker_loop(self, worker_id: str):
+        last_recover = 0.0
+        while True:
+            try:
+                if time.time() - last_recover > self.stale_seconds / 2:
+                    self._recover_stale_jobs()
+                    self._purge_finished_jobs()
+                    last_recover = time.time()
+
+                job_id = self._claim_next(worker_id)
+                if job_id is None:
+                    self._wakeup.wait(timeout=5)
+                    self._wakeup.clear()
+                    continue
+                self._run_job(job_id, worker_id)
+            except Exception as e:
+                logger.error(f"❌ 任务工作线程异常: {e}")
+                time.sleep(1)
+
+    def _claim_next(self, worker_id: str) -> Optional[str]:
+        """按用户公平领取下一个任务，返回任务 ID（没有可领取的任务时返回 None）"""
+        db = SessionLocal()
+        try:
+            candidates = self._fair_candidates(db)
+            now = datetime.utcnow()
+            for job_id in candidates:
+                # 条件更新保证同一任务只会被一个工作线程领取
+                claimed = db.query(GenerationJob).filter(
+                    GenerationJob.id == job_id, GenerationJob.status == JOB_QUEUED
+                ).update({
+                    GenerationJob.status: JOB_RUNNING,
+                    GenerationJob.worker_id: worker_id,
+                    GenerationJob.started_at: now,
+                    GenerationJob.heartbeat_at: now,
+                    GenerationJob.attempts: GenerationJob.attempts + 1,
+                }, synchronize_session=False)
+                if claimed:
+                    # 提交前建立本次执行的事件记录，本进程的订阅者看到 running 状态时即可直接读取；
+                    # 重新执行的任务接着之前的事件序号继续编号
+                    last_seq = db.query(func.max(JobEvent.seq)).filter(JobEvent.job_id == job_id).scalar() or 0
+                    self._new_log(job_id, last_seq)
+                    db.commit()
+                    return job_id
+                db.rollback()
+            return None
+        finally:
+            db.close()
+
+    def _fair_candidates(self, db, limit: int = 5) -> List[str]:
+        """
+        按公平顺序列出待领取的任务：每个用户只取其最早入队的任务，
+        用户按 运行中任务数/权重 升序排列，相同时先入队的优先
+        """
+        queued = db.query(
+            GenerationJob.user_id, func.min(GenerationJob.created_at)
+        ).filter(GenerationJob.status == JOB_QUEUED).group_by(GenerationJob.user_id).all()
+        if not queued:
+            return []
+        running = dict(db.query(
+            GenerationJob.user_id, func.count(GenerationJob.id)
+        ).filter(GenerationJob.status == JOB_RUNNING).group_by(GenerationJob.user_id).all())
+        queued.sort(key=lambda row: (running.get(row[0], 0) / get_user_weight(row[0], db), row[1]))
+
+        candidates = []
+        for user_id, _ in queued[:limit]:
+            row = db.query(GenerationJob.id).filter(
+                GenerationJob.user_id == user_id, GenerationJob.status == JOB_QUEUED
+            ).order_by(GenerationJob.created_at).first()
+            if row:
+                candidates.append(row[0])
+        return candidates
+
+    def _run_job(self, job_id: str, worker_id: str):
+        from backend.services.image import get_image_service
+        from backend.utils.blob_store import get_blob_store
+
+        db = SessionLocal()
+        try:
+            job = db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+            user_id, task_id, attempts = job.user_id, job.task_id, job.attempts
+            payload = json.loads(job.payload)
+        finally:
+            db.close()
+
+        with self._running_lock:
+            self._running_jobs[job_id] = worker_id
+        log = self._get_log(job_id) or self._new_log(job_id, 0)
+        kind = payload.get("kind", JOB_KIND_GENERATE)
+        finish_event = FINISH_EVENTS.get(kind, "finish")
+        logger.info(f"▶️ 开始执行图片生成任务: job={job_id}, task={task_id}, attempt={attempts}")
+
+        finish_data = None
+        error = None
+        try:
+            store = get_blob_store()
+            user_images = []
+            for blob_hash in payload.get("user_image_hashes", []):
+                try:
+                    user_images.append(store.read(blob_hash))
+                except FileNotFoundError:
+                    logger.warning(f"任务参考图缺失: job={job_id}, hash={blob_hash}")
+
+            image_service = get_image_service(user_id)
+            if kind == JOB_KIND_RETRY:
+                events = image_service.retry_failed_images(task_id, payload["pages"])
+            else:
+                events = image_service.generate_images(
+                    payload["pages"], task_id, payload.get("full_outline", ""),
+                    user_images=user_images or None,
+                    user_topic=payload.get("user_topic", ""),
+                    keyword=payload.get("keyword", ""),
+                    resume=attempts > 1,
+                    use_cache=not payload.get("bypass_cache", False)
+                )
+            for event in events:
+                self._append_event(job_id, log, event)
+                if event["event"] == finish_event:
+                    finish_data = event["data"]
+        except Exception as e:
+            error = str(e)
+            logger.error(f"❌ 图片生成任务失败: job={job_id}, {error}")
+            finish_data = {"success": False, "task_id": task_id, "error": error}
+            try:
+                self._append_event(job_id, log, {"event": finish_event, "data": finish_data})
+            except Exception as append_error:
+                logger.warning(f"任务结束事件写入失败: job={job_id}, {append_error}")
+        finally:
+            with self._running_lock:
+                self._running_jobs.pop(job_id, None)
+
+        db = SessionLocal()
+        try:
+            db.query(GenerationJob).filter(GenerationJob.id == job_id).update({
+                GenerationJob.status: JOB_FAILED if error else JOB_DONE,
+                GenerationJob.error: error,
+                GenerationJob.result: json.dumps(finish_data, ensure_ascii=False) if finish_data else None,
+                GenerationJob.finished_at: datetime.utcnow(),
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        log.finish()
+        self._release_job_blobs(job_id, payload.get("user_image_hashes", []))
+        logger.info(f"⏹️ 图片生成任务结束: job={job_id}, status={'failed' if error else 'done'}")
+
+    def _heartbeat_loop(self):
+        interval = max(1, self.stale_seconds // 4)
+        while True:
+            time.sleep(interval)
+            with self._running_lock:
+                job_ids = list(self._running_jobs)
+            if not job_ids:
+                continue
+            db = SessionLocal()
+            try:
+                db.query(GenerationJob).filter(GenerationJob.id.in_(job_ids)).update(
+                    {GenerationJob.heartbeat_at: datetime.utcnow()}, synchronize_session=False
+                )
+                db.commit()
+            except Exception as e:
+                logger.warning(f"任务心跳写入失败: {e}")
+                db.rollback()
+            finally:
+                db.close()
+
+    def _recover_stale_jobs(self):
+        """心跳超时的运行中任务（进程重启或崩溃）重新入队，超过最大尝试次数则标记失败"""
+        deadline = datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+        db = SessionLocal()
+        try:
+            stale = db.query(GenerationJob).filter(
+                GenerationJob.status == JOB_RUNNING,
+                GenerationJob.heartbeat_at < deadline,
+            ).all()
+            for job in stale:
+                if job.attempts >= self.max_attempts:
+                    job.status = JOB_FAILED
+                    job.error = "任务执行中断次数过多"
+                    job.finished_at = datetime.utcnow()
+                    logger.warning(f"⚠️ 图片生成任务多次中断，标记失败: job={job.id}")
+                else:
+                    job.status = JOB_QUEUED
+                    job.worker_id = None
+                    logger.warning(f"♻️ 图片生成任务中断，重新入队: job={job.id}, attempts={job.attempts}")
+            if stale:
+                db.commit()
+                self._wakeup.set()
+        finally:
+            db.close()
+
+    def _purge_finished_jobs(self):
+        """删除结束超过保留时长的任务及其进度事件"""
+        from backend.config import Config
+
+        deadline = datetime.utcnow() - timedelta(hours=Config.get_job_event_retention_hours())
+        db = SessionLocal()
+        try:
+            expired_ids = [row.id for row in db.query(GenerationJob.id).filter(
+                GenerationJob.status.in_(FINISHED_STATUSES),
+                GenerationJob.finished_at < deadline,
+            ).all()]
+            events = 0
+            for i in range(0, len(expired_ids), 500):
+                batch = expired_ids[i:i + 500]
+                events += db.query(JobEvent).filter(JobEvent.job_id.in_(batch)).delete(synchronize_session=False)
+                db.query(GenerationJob).filter(GenerationJob.id.in_(batch)).delete(synchronize_session=False)
+            db.commit()
+            if expired_ids:
+                logger.info(f"🧹 已清理过期任务: {len(expired_ids)} 个，进度事件 {events} 条")
+        finally:
+            db.close()
+
+    def _release_job_blobs(self, job_id: str, hashes: List[str]):
+        """任务结束后回收不再被未完成任务引用的参考图"""
+        from backend.services.image_storage import blob_reference_lock, release_blobs
+
+        if not hashes:
+            return
+        # 检查未完成任务的引用到删除文件期间持有锁，与 enqueue 写入参考图互斥
+        with blob_reference_lock(hashes):
+            db = SessionLocal()
+            try:
+                active_payloads = [row.payload for row in db.query(GenerationJob.payload).filter(
+                    GenerationJob.id != job_id,
+                    GenerationJob.status.in_((JOB_QUEUED, JOB_RUNNING)),
+                ).all()]
+            finally:
+                db.close()
+            release_blobs([h for h in hashes if not any(h in p for p in active_payloads)])
+
+    # ==================== 辅助方法 ====================
+
+    def _get_log(self, job_id: str) -> Optional[JobEventLog]:
+        with self._logs_lock:
+            return self._logs.get(job_id)
+
+    def _new_log(self, job_id: str, last_seq: int) -> JobEventLog:
+        """为任务的一次执行建立新的事件记录（替换之前的记录）"""
+        log = JobEventLog(last_seq)
+        with self._logs_lock:
+            self._logs.pop(job_id, None)
+            self._logs[job_id] = log
+            while len(self._logs) > EVENT_LOG_CAPACITY:
+                self._logs.popitem(last=False)
+        return log
+
+    @staticmethod
+    def _to_dict(job: GenerationJob) -> Dict[str, Any]:
+        return {
+            "id": job.id,
+            "user_id": job.user_id,
+            "task_id": job.task_id,
+            "status": job.status,
+            "attempts": job.attempts,
+            "error": job.error,
+            "result": json.loads(job.result) if job.result else None,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        }
+
+
+# 全局任务队列实例
+_queue_instance: Optional[JobQueueService] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueueService:
+    """获取全局任务队列实例"""
+    global _queue_instance
+    if _queue_instance is None:
+        with _queue_lock:
+            if _queue_instance is None:
+                from backend.config import Config
+                _queue_instance = JobQueueService(
+                    num_workers=Config.get_job_workers(),
+                    stale_seconds=Config.get_job_stale_seconds(),
+                    max_attempts=Config.get_job_max_attempts(),
+                )
+    return _queue_instance
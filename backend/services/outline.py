@@ -1,15 +1,39 @@
+import copy
+import hashlib
+import json
 import logging
 import os
 import re
 import base64
+import threading
+import time
 import yaml
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from backend.utils.text_client import get_text_chat_client
 from backend.config import Config
 
 logger = logging.getLogger(__name__)
 
+# 计入大纲缓存键的服务商配置项（会影响生成结果的参数）
+OUTLINE_CACHE_PARAM_KEYS = ("type", "base_url", "endpoint_type", "model", "temperature", "max_output_tokens")
+
+# 大纲生成结果缓存（进程内，缓存键 -> (写入时间, 结果)，按最近使用顺序淘汰）
+# 缓存键不含用户 ID：不同用户提交相同主题和图片时同样复用
+_outline_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+# 正在生成的大纲：相同请求同时到达时只调用一次上游，其余请求等待共享结果
+_inflight: Dict[str, "_InflightCall"] = {}
+_outline_lock = threading.Lock()
+
+
+class _InflightCall:
+    """一次进行中的大纲生成调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+
 
 class OutlineService:
     def __init__(self, user_id: int = None, provider_name: str = None):
@@ -84,11 +108,74 @@ class OutlineService:
 
         return pages
 
+    def _cache_key(self, topic: str, images: Optional[List[bytes]] = None) -> str:
+        """大纲缓存键：服务商、模型参数、prompt 模板哈希、主题和参考图哈希"""
+        material = {
+            "provider": self.provider_name,
+            "params": {k: self.provider_config.get(k) for k in OUTLINE_CACHE_PARAM_KEYS},
+            "template": hashlib.sha256(self.prompt_template.encode("utf-8")).hexdigest(),
+            "topic": topic,
+            "images": [hashlib.sha256(img).hexdigest() for img in (images or [])],
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
     def generate_outline(
+        self,
+        topic: str,
+        images: Optional[List[bytes]] = None,
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        生成大纲
+
+        有效期（OUTLINE_CACHE_TTL）内相同的请求直接返回缓存的结果；
+        相同请求同时到达时合并为一次上游调用。
+
+        Args:
+            use_cache: 为 False 时跳过缓存和请求合并，重新生成并覆盖缓存
+        """
+        key = self._cache_key(topic, images)
+        ttl = Config.get_outline_cache_ttl()
+        if not use_cache:
+            result = self._generate_outline(topic, images)
+            _store_outline(key, result, ttl)
+            return copy.deepcopy(result)
+
+        with _outline_lock:
+            cached = _outline_cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] < ttl:
+                _outline_cache.move_to_end(key)
+                logger.info(f"♻️ 大纲命中缓存: topic={topic[:50]}")
+                return copy.deepcopy(cached[1])
+            call = _inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _InflightCall()
+                _inflight[key] = call
+
+        if not leader:
+            logger.info(f"🔗 合并相同的大纲生成请求，等待进行中的调用: topic={topic[:50]}")
+            call.done.wait()
+            if call.result is None:
+                # 进行中的调用异常退出，自行生成
+                return self._generate_outline(topic, images)
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = self._generate_outline(topic, images)
+        finally:
+            with _outline_lock:
+                _inflight.pop(key, None)
+            _store_outline(key, call.result, ttl)
+            call.done.set()
+        return copy.deepcopy(call.result)
+
+    def _generate_outline(
         self,
         topic: str,
         images: Optional[List[bytes]] = None
     ) -> Dict[str, Any]:
+        """调用文本服务商生成并解析大纲"""
         try:
             logger.info(f"开始生成大纲: topic={topic[:50]}..., images={len(images) if images else 0}")
             prompt = self.prompt_template.format(topic=topic)
@@ -181,6 +268,18 @@ class OutlineService:
             }
 
 
+def _store_outline(key: str, result: Optional[Dict[str, Any]], ttl: int):
+    """缓存生成成功的大纲，超出 OUTLINE_CACHE_SIZE 时淘汰最久未使用的条目"""
+    if not ttl or not result or not result.get("success"):
+        return
+    max_size = Config.get_outline_cache_size()
+    with _outline_lock:
+        _outline_cache[key] = (time.monotonic(), result)
+        _outline_cache.move_to_end(key)
+        while len(_outline_cache) > max_size:
+            _outline_cache.popitem(last=False)
+
+
 def get_outline_service(user_id: int = None, provider_name: str = None) -> OutlineService:
     """
     获取大纲生成服务实例
@@ -0,0 +1,212 @@
+"""图片生成结果缓存
+
+用户经常对同一份大纲重复提交生成，每次都会重新调用服务商、重复付费。开启缓存
+（IMAGE_PROMPT_CACHE）后，按以下内容计算确定性的缓存键，命中时直接复用上次的图片：
+
+- 渲染后的完整 prompt（已包含页面内容、类型、完整大纲和用户主题）
+- 服务商类型、地址、模型及影响输出的生成参数（尺寸、比例、质量、温度等）
+- 参考图（封面、用户上传图片）的内容哈希（服务商不支持参考图时不计入）
+- 用户 ID（缓存不跨用户共享）
+
+图片本身存放在 blob 存储中（内容寻址，与 Image 记录共享同一份文件），
+prompt_cache 表只记录键和哈希。超过 IMAGE_PROMPT_CACHE_TTL_HOURS 的条目失效，
+总大小超过 IMAGE_PROMPT_CACHE_MAX_MB 时按最近使用时间淘汰。
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from backend.config import Config
+from backend.db import SessionLocal
+from backend.models import PromptCacheEntry
+from backend.utils.blob_store import BlobStore, get_blob_store
+
+logger = logging.getLogger(__name__)
+
+# 计入缓存键的服务商配置项（会影响生成结果的参数）
+CACHE_PARAM_KEYS = (
+    "type", "base_url", "endpoint_type", "model", "default_aspect_ratio", "default_size",
+    "quality", "temperature", "image_size",
+)
+
+# 写入缓存后自动淘汰的最小间隔（秒）
+EVICT_INTERVAL = 300
+
+_last_evict = 0.0
+_evict_lock = threading.Lock()
+
+
+def build_cache_key(
+    user_id: Optional[int],
+    provider_config: Dict[str, Any],
+    prompt: str,
+    reference_images: Iterable[bytes] = ()
+) -> str:
+    """计算一次图片生成的缓存键"""
+    material = {
+        "user_id": user_id,
+        "params": {k: provider_config.get(k) for k in CACHE_PARAM_KEYS},
+        "prompt": prompt,
+        "references": [hashlib.sha256(img).hexdigest() for img in reference_images if img],
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def lookup_image(keys: List[str]) -> Optional[Tuple[str, bytes, Optional[str]]]:
+    """
+    按顺序查找第一个命中且未过期的缓存
+
+    Returns:
+        (缓存键, 图片数据, 生成图片的服务商)，未命中时返回 None
+    """
+    if not keys:
+        return None
+    expire_before = datetime.utcnow() - timedelta(hours=Config.get_prompt_cache_ttl_hours())
+    db = SessionLocal()
+    try:
+        rows = db.query(
+            PromptCacheEntry.key, PromptCacheEntry.image_hash, PromptCacheEntry.provider
+        ).filter(
+            PromptCacheEntry.key.in_(keys), PromptCacheEntry.created_at > expire_before
+        ).all()
+        entries = {row.key: row for row in rows}
+        blob_store = get_blob_store()
+        for key in keys:
+            entry = entries.get(key)
+            if entry is None:
+                continue
+            try:
+                image_data = blob_store.read(entry.image_hash)
+            except FileNotFoundError:
+                # 图片文件已被回收，条目作废
+                db.query(PromptCacheEntry).filter(PromptCacheEntry.key == key).delete(synchronize_session=False)
+                db.commit()
+                continue
+            db.query(PromptCacheEntry).filter(PromptCacheEntry.key == key).update({
+                PromptCacheEntry.hits: PromptCacheEntry.hits + 1,
+                PromptCacheEntry.last_used_at: datetime.utcnow(),
+            }, synchronize_session=False)
+            db.commit()
+            return key, image_data, entry.provider
+        return None
+    finally:
+        db.close()
+
+
+def store_image(key: str, user_id: Optional[int], provider: Optional[str], image_data: bytes):
+    """写入（或覆盖）一条缓存"""
+    from backend.services.image_storage import blob_reference_lock, release_blobs
+
+    image_hash = BlobStore.compute_hash(image_data)
+    now = datetime.utcnow()
+    with blob_reference_lock([image_hash]):
+        get_blob_store().store(image_data)
+        db = SessionLocal()
+        try:
+            entry = db.query(PromptCacheEntry).filter(PromptCacheEntry.key == key).first()
+            if entry is None:
+                entry = PromptCacheEntry(key=key, user_id=user_id, hits=0)
+                db.add(entry)
+            old_hash = entry.image_hash
+            entry.provider = provider
+            entry.image_hash = image_hash
+            entry.image_size = len(image_data)
+            entry.created_at = now
+            entry.last_used_at = now
+            db.commit()
+        finally:
+            db.close()
+    if old_hash and old_hash != image_hash:
+        release_blobs([old_hash])
+    _maybe_evict()
+
+
+def _maybe_evict():
+    """距离上次淘汰超过 EVICT_INTERVAL 秒时执行一次淘汰"""
+    global _last_evict
+    with _evict_lock:
+        if time.monotonic() - _last_evict < EVICT_INTERVAL:
+            return
+        _last_evict = time.monotonic()
+    try:
+        evict()
+    except Exception as e:
+        logger.warning(f"图片生成缓存淘汰失败: {e}")
+
+
+def evict() -> int:
+    """
+    删除过期条目，并在总大小超过上限时按最近使用时间淘汰
+
+    Returns:
+        删除的条目数
+    """
+    from backend.services.image_storage import release_blobs
+
+    expire_before = datetime.utcnow() - timedelta(hours=Config.get_prompt_cache_ttl_hours())
+    max_bytes = Config.get_prompt_cache_max_mb() * 1024 * 1024
+    removed_keys = []
+    removed_hashes = set()
+    db = SessionLocal()
+    try:
+        for row in db.query(PromptCacheEntry.key, PromptCacheEntry.image_hash).filter(
+            PromptCacheEntry.created_at <= expire_before
+        ).all():
+            removed_keys.append(row.key)
+            removed_hashes.add(row.image_hash)
+
+        total = db.query(func.coalesce(func.sum(PromptCacheEntry.image_size), 0)).filter(
+            PromptCacheEntry.created_at > expire_before
+        ).scalar() or 0
+        if total > max_bytes:
+            rows = db.query(
+                PromptCacheEntry.key, PromptCacheEntry.image_hash, PromptCacheEntry.image_size
+            ).filter(
+                PromptCacheEntry.created_at > expire_before
+            ).order_by(PromptCacheEntry.last_used_at.asc()).all()
+            for row in rows:
+                if total <= max_bytes:
+                    break
+                removed_keys.append(row.key)
+                removed_hashes.add(row.image_hash)
+                total -= row.image_size or 0
+
+        for i in range(0, len(removed_keys), 500):
+            db.query(PromptCacheEntry).filter(
+                PromptCacheEntry.key.in_(removed_keys[i:i + 500])
+            ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+    if removed_keys:
+        release_blobs(removed_hashes)
+        logger.info(f"🧹 图片生成缓存淘汰 {len(removed_keys)} 条")
+    return len(removed_keys)
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """缓存条目数、总大小和累计命中次数"""
+    db = SessionLocal()
+    try:
+        count, size, hits = db.query(
+            func.count(PromptCacheEntry.key),
+            func.coalesce(func.sum(PromptCacheEntry.image_size), 0),
+            func.coalesce(func.sum(PromptCacheEntry.hits), 0),
+        ).one()
+    finally:
+        db.close()
+    return {
+        "enabled": Config.get_prompt_cache_enabled(),
+        "entries": count,
+        "size_bytes": int(size),
+        "hits": int(hits),
+        "ttl_hours": Config.get_prompt_cache_ttl_hours(),
+        "max_mb": Config.get_prompt_cache_max_mb(),
+    }
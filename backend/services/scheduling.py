@@ -0,0 +1,66 @@
+"""图片生成公平调度的用户权重
+
+多个用户共享同一个上游配额时，服务商限流器（utils/rate_limiter.py）按用户加权公平排队，
+后台任务队列领取任务时也优先选择正在运行任务少（相对权重）的用户。
+
+用户权重：
+- users.schedule_weight 不为空时使用该值（管理员在用户管理中设置）
+- 否则管理员使用 SCHEDULE_ADMIN_WEIGHT（默认 4），普通用户使用 SCHEDULE_DEFAULT_WEIGHT（默认 1）
+
+权重在进程内缓存，修改用户后调用 reset_user_weights()。
+"""
+import logging
+import threading
+from typing import Dict, Optional
+
+from backend.config import Config
+from backend.db import SessionLocal
+from backend.models import User
+
+logger = logging.getLogger(__name__)
+
+_weights: Dict[int, int] = {}
+_weights_lock = threading.Lock()
+
+
+def _resolve_user_weight(user_id: int, db=None) -> int:
+    if db is not None:
+        user = db.query(User).filter(User.id == user_id).first()
+    else:
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.id == user_id).first()
+        finally:
+            db.close()
+    if user is None:
+        return Config.get_schedule_default_weight()
+    if user.schedule_weight:
+        return max(1, int(user.schedule_weight))
+    if user.role == 'admin':
+        return Config.get_schedule_admin_weight()
+    return Config.get_schedule_default_weight()
+
+
+def get_user_weight(user_id: Optional[int], db=None) -> int:
+    """
+    获取用户的调度权重（未登录/未知用户使用默认权重）
+
+    Args:
+        user_id: 用户 ID
+        db: 调用方已打开的会话。SessionLocal 是线程级 scoped_session，
+            在已打开会话的代码中调用时需传入，避免关闭调用方的会话
+    """
+    if not user_id:
+        return Config.get_schedule_default_weight()
+    weight = _weights.get(user_id)
+    if weight is None:
+        weight = _resolve_user_weight(user_id, db)
+        with _weights_lock:
+            _weights[user_id] = weight
+    return weight
+
+
+def reset_user_weights():
+    """清除权重缓存（修改用户权重或角色后调用）"""
+    with _weights_lock:
+        _weights.clear()
@@ -0,0 +1,243 @@
+"""任务状态存储
+
+保存图片生成任务的上下文（封面参考图、完整大纲、用户参考图、已生成/失败页面），
+供 /retry、/retry-failed、/regenerate、/task/<id> 使用。
+
+ImageService 每个请求都会新建实例，状态不能放在实例上，这里提供进程级共享的存储：
+- MemoryTaskStateStore: 进程内 LRU，条目数有上限，超过 TTL 未访问的任务自动淘汰（默认）
+- SQLiteTaskStateStore: 存放在 SQLite 文件中，多个 worker 进程共享（TASK_STATE_BACKEND=sqlite）
+
+键由调用方生成（ImageService 使用 "<user_id>:<task_id>"），值为普通字典。
+"""
+import copy
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TaskStateStore(ABC):
+    """任务状态存储抽象基类"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态（副本），不存在或已过期时返回 None"""
+        pass
+
+    @abstractmethod
+    def set(self, key: str, state: Dict[str, Any]):
+        """写入（覆盖）任务状态"""
+        pass
+
+    def update(self, key: str, **fields):
+        """更新任务状态的字段，任务不存在时忽略"""
+        self._modify(key, lambda state: state.update(fields))
+
+    def mark_generated(self, key: str, index: int, filename: str):
+        """记录页面生成成功（同时从失败列表中移除）"""
+        def apply(state):
+            state.setdefault("generated", {})[index] = filename
+            state.setdefault("failed", {}).pop(index, None)
+        self._modify(key, apply)
+
+    def mark_provider(self, key: str, index: int, provider: str):
+        """记录页面由哪个服务商生成"""
+        self._modify(key, lambda state: state.setdefault("providers", {}).__setitem__(index, provider))
+
+    def mark_failed(self, key: str, index: int, error: str):
+        """记录页面生成失败"""
+        self._modify(key, lambda state: state.setdefault("failed", {}).__setitem__(index, error))
+
+    @abstractmethod
+    def delete(self, key: str):
+        """删除任务状态"""
+        pass
+
+    @abstractmethod
+    def _modify(self, key: str, apply):
+        """原子地读取-修改-写回任务状态"""
+        pass
+
+
+class MemoryTaskStateStore(TaskStateStore):
+    """进程内任务状态存储（LRU + TTL）"""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._states: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            state = self._touch(key)
+            return copy.deepcopy(state) if state is not None else None
+
+    def set(self, key, state):
+        with self._lock:
+            self._states[key] = (copy.deepcopy(state), time.time() + self.ttl_seconds)
+            self._states.move_to_end(key)
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            self._states.pop(key, None)
+
+    def _modify(self, key, apply):
+        with self._lock:
+            state = self._touch(key)
+            if state is not None:
+                apply(state)
+
+    def _touch(self, key) -> Optional[Dict[str, Any]]:
+        """取出未过期的状态并刷新过期时间（需持有锁）"""
+        entry = self._states.get(key)
+        if entry is None:
+            return None
+        state, expires_at = entry
+        now = time.time()
+        if expires_at <= now:
+            del self._states[key]
+            return None
+        self._states[key] = (state, now + self.ttl_seconds)
+        self._states.move_to_end(key)
+        return state
+
+    def _evict(self):
+        """淘汰过期条目及超出上限的最久未访问条目（需持有锁）"""
+        now = time.time()
+        for key in [k for k, (_, expires_at) in self._states.items() if expires_at <= now]:
+            del self._states[key]
+        while len(self._states) > self.max_entries:
+            self._states.popitem(last=False)
+
+
+class SQLiteTaskStateStore(TaskStateStore):
+    """
+    SQLite 任务状态存储
+
+    状态用 pickle 序列化（包含参考图 bytes 和整数键字典），文件只由本服务读写。
+    每个线程使用独立连接，读-改-写在 IMMEDIATE 事务中完成，多进程并发更新不会互相覆盖。
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS task_states ("
+                "key TEXT PRIMARY KEY, state BLOB NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_task_states_accessed ON task_states (accessed_at)")
+
+    def _transaction(self) -> "_Transaction":
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return _Transaction(conn)
+
+    def get(self, key):
+        with self._transaction() as conn:
+            return self._touch(conn, key)
+
+    def set(self, key, state):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO task_states (key, state, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), now + self.ttl_seconds, now)
+            )
+            self._evict(conn, now)
+
+    def delete(self, key):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM task_states WHERE key = ?", (key,))
+
+    def _modify(self, key, apply):
+        with self._transaction() as conn:
+            state = self._touch(conn, key)
+            if state is not None:
+                apply(state)
+                conn.execute(
+                    "UPDATE task_states SET state = ? WHERE key = ?",
+                    (pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), key)
+                )
+
+    def _touch(self, conn, key) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        row = conn.execute(
+            "SELECT state FROM task_states WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE task_states SET expires_at = ?, accessed_at = ? WHERE key = ?",
+            (now + self.ttl_seconds, now, key)
+        )
+        return pickle.loads(row[0])
+
+    def _evict(self, conn, now: float):
+        conn.execute("DELETE FROM task_states WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM task_states WHERE key NOT IN "
+            "(SELECT key FROM task_states ORDER BY accessed_at DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+
+
+class _Transaction:
+    """在 with 块中执行 IMMEDIATE 事务（异常时回滚）"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+# 全局任务状态存储实例
+_store_instance: Optional[TaskStateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_task_state_store() -> TaskStateStore:
+    """获取全局任务状态存储（首次调用时按配置创建）"""
+    global _store_instance
+    if _store_instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                from backend.config import Config
+                max_entries = Config.get_task_state_max_entries()
+                ttl_seconds = Config.get_task_state_ttl_seconds()
+                if Config.get_task_state_backend() == 'sqlite':
+                    path = Config.get_task_state_sqlite_path()
+                    logger.info(f"🗂️ 任务状态存储: SQLite ({path})")
+                    _store_instance = SQLiteTaskStateStore(path, max_entries, ttl_seconds)
+                else:
+                    _store_instance = MemoryTaskStateStore(max_entries, ttl_seconds)
+    return _store_instance
+
+
+def reset_task_state_store():
+    """清除全局任务状态存储实例（配置变更或测试时使用）"""
+    global _store_instance
+    with _store_lock:
+        _store_instance = None
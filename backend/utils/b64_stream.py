@@ -0,0 +1,150 @@
+"""Images API 响应中 b64_json 图片的流式解码
+
+/v1/images/generations 以 b64_json 返回图片时，4K 图片的 base64 字符串可达十几 MB。
+原来的做法是 response.json() 后整体 base64.b64decode：同一张图片同时以原始响应字节、
+JSON 解析出的字符串、解码后的字节三份存在于内存中，并发生成多张图片时内存峰值很高。
+
+B64JsonImageReader 边接收边处理：
+- 在响应中定位第一个 b64_json 字段，其字符串值按 4 字符对齐分段解码，直接写入输出缓冲区
+- 其余 JSON 内容（去掉了 base64 值）保留下来，结束后解析为 result，
+  调用方可继续按原逻辑处理 url 格式、错误信息等
+- 支持带 data:image/...;base64, 前缀的值和 JSON 转义（如 \\/）
+"""
+import base64
+import binascii
+import io
+import json
+import re
+from typing import Any, Dict, Optional
+
+from .chat_stream import READ_CHUNK_SIZE, PREVIEW_BYTES
+
+_B64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+# 解码前删除的非 base64 字符（与 b64decode 默认忽略非法字符的行为一致）
+_NON_B64 = bytes(b for b in range(256) if b not in _B64_ALPHABET)
+# JSON 转义序列最长 6 字节（\uXXXX）
+_MAX_ESCAPE = 6
+
+
+class B64JsonImageReader:
+    """
+    增量读取 Images API 的 JSON 响应，流式解码其中的 b64_json 图片
+
+    读取结束后 image 为第一个 b64_json 字段解码后的图片（没有时为 None），
+    result 为去掉 base64 值后的 JSON 结构
+    """
+
+    def __init__(self, field: str = "b64_json"):
+        self.image: Optional[bytes] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.preview = bytearray()
+        self.bytes_read = 0
+
+        self._pattern = re.compile(rb'"' + re.escape(field.encode()) + rb'"\s*:\s*"')
+        self._scan_back = len(field) + 16
+        # 去掉 base64 值之后的 JSON 内容
+        self._skeleton = bytearray()
+        self._in_value = False
+        self._found = False
+        self._out: Optional[io.BytesIO] = None
+        self._b64 = bytearray()
+        self._escape_tail = b""
+        self._head: Optional[bytearray] = None
+
+    @property
+    def preview_text(self) -> str:
+        return self.preview.decode('utf-8', errors='ignore')
+
+    def feed(self, chunk: bytes):
+        """处理一块响应数据"""
+        if not chunk:
+            return
+        self.bytes_read += len(chunk)
+        if len(self.preview) < PREVIEW_BYTES:
+            self.preview += chunk[:PREVIEW_BYTES - len(self.preview)]
+
+        while chunk:
+            if self._in_value:
+                end = chunk.find(b'"')
+                if end < 0:
+                    self._decode(chunk)
+                    return
+                self._decode(chunk[:end], final=True)
+                self._in_value = False
+                # 结束引号及之后的内容回到 JSON 中
+                chunk = chunk[end:]
+                continue
+
+            scan_from = max(0, len(self._skeleton) - self._scan_back)
+            self._skeleton += chunk
+            if self._found:
+                return
+            match = self._pattern.search(self._skeleton, scan_from)
+            if not match:
+                return
+            chunk = bytes(self._skeleton[match.end():])
+            del self._skeleton[match.end():]
+            self._found = True
+            self._in_value = True
+            self._out = io.BytesIO()
+            self._head = bytearray()
+
+    def read_response(self, response) -> "B64JsonImageReader":
+        """读取以 stream=True 发出的请求的响应并结束解析（异常同 finish）"""
+        try:
+            for chunk in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+                self.feed(chunk)
+        finally:
+            response.close()
+        return self.finish()
+
+    def finish(self) -> "B64JsonImageReader":
+        """
+        结束读取：解析 JSON 结构并返回自身
+
+        Raises:
+            json.JSONDecodeError: 响应不是有效的 JSON
+            binascii.Error: base64 数据无效
+        """
+        # 响应在 base64 值中间截断时 JSON 不完整，同样抛出 JSONDecodeError
+        self.result = json.loads(self._skeleton.decode('utf-8', errors='ignore'))
+        if self._out is not None:
+            self.image = self._out.getvalue()
+            self._out = None
+        return self
+
+    def _decode(self, piece: bytes, final: bool = False):
+        """解码 base64 值的一段（final 表示值已结束）"""
+        if self._escape_tail or b'\\' in piece:
+            piece = self._escape_tail + piece
+            self._escape_tail = b""
+            if not final:
+                # 末尾可能是不完整的转义序列，留到下一段处理
+                idx = piece.rfind(b'\\')
+                if idx >= 0 and len(piece) - idx < _MAX_ESCAPE:
+                    piece, self._escape_tail = piece[:idx], piece[idx:]
+            if piece:
+                piece = json.loads(b'"' + piece + b'"').encode('ascii', errors='ignore')
+
+        if self._head is not None:
+            # 值开头可能是 data:image/...;base64, 前缀
+            self._head += piece
+            head = self._head
+            if not final and (len(head) < 5 or (head.startswith(b'data:') and b',' not in head)):
+                return
+            if head.startswith(b'data:') and b',' in head:
+                head = head[head.index(b',') + 1:]
+            piece = bytes(head)
+            self._head = None
+
+        self._b64 += piece.translate(None, _NON_B64)
+        if final:
+            if self._b64:
+                self._out.write(base64.b64decode(bytes(self._b64)))
+            self._b64 = bytearray()
+            return
+        aligned = len(self._b64) - len(self._b64) % 4
+        if aligned:
+            self._out.write(binascii.a2b_base64(bytes(self._b64[:aligned])))
+            del self._b64[:aligned]
+
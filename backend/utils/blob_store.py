@@ -0,0 +1,144 @@
+"""图片二进制存储（内容寻址）
+
+图片与缩略图不再写入数据库 BLOB 列，而是按 SHA-256 存放在磁盘上，
+数据库只保留哈希、大小和 MIME 类型。相同内容只会存储一份。
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def sniff_mime_type(data: bytes) -> str:
+    """根据文件头判断图片 MIME 类型"""
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:12] in (b'ftypavif', b'ftypavis'):
+        return 'image/avif'
+    if data.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    return 'application/octet-stream'
+
+
+class BlobStore(ABC):
+    """二进制存储抽象基类"""
+
+    @staticmethod
+    def compute_hash(data: bytes) -> str:
+        """计算内容哈希（SHA-256 十六进制）"""
+        return hashlib.sha256(data).hexdigest()
+
+    @abstractmethod
+    def store(self, data: bytes) -> str:
+        """
+        保存数据
+
+        Args:
+            data: 二进制数据
+
+        Returns:
+            内容哈希
+        """
+        pass
+
+    @abstractmethod
+    def read(self, blob_hash: str) -> bytes:
+        """
+        读取数据
+
+        Raises:
+            FileNotFoundError: 数据不存在
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, blob_hash: str) -> bool:
+        """删除数据，返回是否确实删除"""
+        pass
+
+    @abstractmethod
+    def exists(self, blob_hash: str) -> bool:
+        """数据是否存在"""
+        pass
+
+    def path(self, blob_hash: str) -> Optional[str]:
+        """返回本地文件路径（不支持本地路径的实现返回 None）"""
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    """本地文件系统存储，按哈希前缀分两级目录：ab/cd/abcd..."""
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def _blob_path(self, blob_hash: str) -> str:
+        if not blob_hash or len(blob_hash) < 4 or not all(c in '0123456789abcdef' for c in blob_hash):
+            raise ValueError(f"无效的 blob 哈希: {blob_hash!r}")
+        return os.path.join(self.root_dir, blob_hash[:2], blob_hash[2:4], blob_hash)
+
+    def store(self, data: bytes) -> str:
+        blob_hash = self.compute_hash(data)
+        target = self._blob_path(blob_hash)
+        if os.path.exists(target):
+            return blob_hash
+
+        target_dir = os.path.dirname(target)
+        os.makedirs(target_dir, exist_ok=True)
+        # 先写临时文件再原子替换，避免并发写入时读到半个文件
+        fd, tmp_path = tempfile.mkstemp(dir=target_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, target)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return blob_hash
+
+    def read(self, blob_hash: str) -> bytes:
+        with open(self._blob_path(blob_hash), 'rb') as f:
+            return f.read()
+
+    def delete(self, blob_hash: str) -> bool:
+        try:
+            os.remove(self._blob_path(blob_hash))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def exists(self, blob_hash: str) -> bool:
+        return os.path.exists(self._blob_path(blob_hash))
+
+    def path(self, blob_hash: str) -> Optional[str]:
+        return self._blob_path(blob_hash)
+
+
+# 全局存储实例
+_store_instance: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    global _store_instance
+    if _store_instance is None:
+        from backend.config import Config
+        _store_instance = LocalBlobStore(Config.get_blob_dir())
+    return _store_instance
+
+
+def set_blob_store(store: Optional[BlobStore]):
+    """替换全局存储实例（用于自定义存储后端或测试）"""
+    global _store_instance
+    _store_instance = store
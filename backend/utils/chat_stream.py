@@ -0,0 +1,193 @@
+"""Chat Completions 响应的增量解析
+
+图片模型经常把整张图片以 base64 放在 content 里分多段流式返回（数 MB）。原来的做法是
+raw_content += chunk 累积完整响应（每次都复制已有内容，总复制量随响应大小平方增长），
+整体解码成字符串后再按行拆分、逐段拼接 delta。
+
+ChatStreamParser 边接收边解析：
+- SSE 响应按行处理，delta 追加到列表中，最后一次性 join
+- 非流式 JSON 响应追加到 bytearray，结束后整体解析
+- 可选检测 content 中已出现完整的图片（data URL / Markdown 图片链接），
+  调用方据此提前停止读取后续数据
+"""
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+# 每次从响应中读取的块大小
+READ_CHUNK_SIZE = 64 * 1024
+# 保留响应开头用于错误信息和格式提示检测
+PREVIEW_BYTES = 4096
+
+# 图片引用的起始标记 -> (链接开始标记, 结束字符)：
+# Markdown 图片 ![alt](url) 的替代文本中可能含右括号，先找到 "](" 再以右括号结束；
+# 裸 data URL 以右括号、引号或空白结束（base64 字符集中不含这些字符）
+_IMAGE_MARKERS = {
+    "![": ("](", (")",)),
+    "data:image/": ("", (")", '"', "'", " ", "\n")),
+}
+_MARKER_TAIL = max(len(m) for m in _IMAGE_MARKERS) - 1
+
+
+class ChatStreamParser:
+    """
+    增量解析 Chat Completions 响应（SSE 流式或普通 JSON）
+
+    用法：
+        parser = ChatStreamParser(response.headers.get('Content-Type', ''), detect_image=True)
+        for chunk in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+            if parser.feed(chunk):
+                break
+        parser.finish()
+    """
+
+    def __init__(self, content_type: str = "", detect_image: bool = False):
+        self.detect_image = detect_image
+        self.streaming: Optional[bool] = True if 'text/event-stream' in (content_type or '') else None
+        self.preview = bytearray()
+        self.result: Optional[Dict[str, Any]] = None
+        self.tool_calls: List[Any] = []
+        self.image_complete = False
+        self.done = False
+        self.bytes_read = 0
+
+        self._parts: List[str] = []
+        self._buffer = bytearray()
+        self._scan_from = 0
+        # 图片检测：最近内容的尾部（跨 delta 匹配标记）、待查找的链接开始标记和结束字符
+        self._tail = ""
+        self._link_marker = ""
+        self._terminators: Optional[tuple] = None
+
+    @property
+    def content(self) -> str:
+        """已解析的完整文本内容"""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    @property
+    def preview_text(self) -> str:
+        return self.preview.decode('utf-8', errors='ignore')
+
+    def feed(self, chunk: bytes) -> bool:
+        """
+        处理一块响应数据
+
+        Returns:
+            是否可以停止读取（收到 [DONE] 或已检测到完整图片）
+        """
+        if not chunk or self.done:
+            return self.done
+        self.bytes_read += len(chunk)
+        if len(self.preview) < PREVIEW_BYTES:
+            self.preview += chunk[:PREVIEW_BYTES - len(self.preview)]
+        self._buffer += chunk
+        if self.streaming is None:
+            # 未声明 event-stream 时按开头内容判断（开头不足 5 字节时等待更多数据）
+            head = bytes(self.preview).lstrip()
+            if len(head) < 5 and len(self.preview) < PREVIEW_BYTES:
+                return False
+            self.streaming = head.startswith(b'data:')
+        if self.streaming:
+            self._consume_lines()
+        return self.done
+
+    def feed_all(self, chunks: Iterable[bytes]) -> "ChatStreamParser":
+        """处理全部数据（遇到可停止的位置时提前结束）"""
+        for chunk in chunks:
+            if self.feed(chunk):
+                break
+        return self.finish()
+
+    def finish(self) -> "ChatStreamParser":
+        """结束解析：处理 SSE 的最后一行，或解析完整的 JSON 响应"""
+        if self.streaming is None:
+            self.streaming = bytes(self._buffer).lstrip().startswith(b'data:')
+            if self.streaming:
+                self._consume_lines()
+        if self.streaming:
+            if not self.done and self._buffer:
+                self._handle_line(bytes(self._buffer))
+            self._buffer = bytearray()
+        elif self.result is None:
+            body = self._buffer
+            self._buffer = bytearray()
+            # 非流式响应需要完整解析，JSON 格式错误时向上抛出 json.JSONDecodeError
+            self.result = json.loads(body.decode('utf-8', errors='ignore'))
+            choices = self.result.get("choices") if isinstance(self.result, dict) else None
+            if choices:
+                choice = choices[0]
+                if "message" in choice and "content" in choice["message"]:
+                    self._append(choice["message"]["content"] or "")
+                elif "delta" in choice and "content" in choice["delta"]:
+                    self._append(choice["delta"]["content"] or "")
+        return self
+
+    def _consume_lines(self):
+        buffer = self._buffer
+        start = 0
+        while not self.done:
+            end = buffer.find(b'\n', max(start, self._scan_from))
+            if end < 0:
+                break
+            self._handle_line(bytes(buffer[start:end]))
+            start = end + 1
+            self._scan_from = start
+        if start:
+            del buffer[:start]
+        # 下次只从未扫描过的位置查找换行，超长行不会被重复扫描
+        self._scan_from = len(buffer)
+
+    def _handle_line(self, raw_line: bytes):
+        line = raw_line.strip()
+        if not line.startswith(b'data:'):
+            return
+        data = line[5:].strip()
+        if data == b'[DONE]':
+            self.done = True
+            return
+        try:
+            chunk_data = json.loads(data)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return
+        choices = chunk_data.get('choices') if isinstance(chunk_data, dict) else None
+        if not choices:
+            return
+        delta = choices[0].get('delta') or {}
+        content_part = delta.get('content')
+        if content_part:
+            self._append(content_part)
+        tool_calls = delta.get('tool_calls')
+        if tool_calls:
+            self.tool_calls.extend(tool_calls)
+
+    def _append(self, text: str):
+        self._parts.append(text)
+        if self.detect_image and not self.image_complete:
+            self._detect_image(text)
+
+    def _detect_image(self, text: str):
+        """检测 content 中是否出现了完整的图片引用（只检查新追加的部分）"""
+        window = self._tail + text
+        self._tail = ""
+        if self._terminators is None:
+            found = [(window.find(m), m) for m in _IMAGE_MARKERS]
+            found = [(pos, m) for pos, m in found if pos >= 0]
+            if not found:
+                self._tail = window[-_MARKER_TAIL:]
+                return
+            pos, marker = min(found)
+            self._link_marker, self._terminators = _IMAGE_MARKERS[marker]
+            # 只在标记之后查找
+            window = window[pos + len(marker):]
+        if self._link_marker:
+            pos = window.find(self._link_marker)
+            if pos < 0:
+                self._tail = window[-(len(self._link_marker) - 1):]
+                return
+            window = window[pos + len(self._link_marker):]
+            self._link_marker = ""
+        if any(t in window for t in self._terminators):
+            self.image_complete = True
+            if self.streaming:
+                self.done = True
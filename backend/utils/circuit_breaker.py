@@ -0,0 +1,234 @@
+"""服务商端点熔断器
+
+上游服务宕机时，每次生成都要等满请求超时、再经过多次指数退避重试才失败，
+工作线程被占用数分钟。熔断器按端点（类型 + base_url + API Key）统计，
+同一地址下不同账号（如两个使用默认地址的 Gemini 服务商）互不影响：
+
+- closed: 正常放行；连续 CIRCUIT_FAILURE_THRESHOLD 次上游故障后打开
+- open: 直接抛出 CircuitOpenError（可重试错误），不再请求上游；
+  CIRCUIT_RESET_SECONDS 秒后进入 half_open
+- half_open: 只放行一个探测请求，成功则关闭，失败则重新打开
+
+只有连接失败、超时、5xx 视为上游故障；4xx、内容审核、429 等说明端点可达，按成功处理
+（429 由限流器的自适应并发处理）。
+"""
+import hashlib
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from google.genai import errors as genai_errors
+
+from .http_session import UpstreamHTTPError
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# 说明端点不可达的异常类型（requests / google-genai 底层的 httpx / 标准库 socket）
+_TRANSPORT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    httpx.TransportError,
+    ConnectionError,
+    TimeoutError,
+)
+# 异常链最多向上追溯的层数（生成器的重试装饰器会把原始异常包装成新的 Exception）
+_MAX_CHAIN_DEPTH = 8
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开时的快速失败（可重试）"""
+
+    retryable = True
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    """异常携带的 HTTP 状态码（UpstreamHTTPError、genai APIError、requests HTTPError）"""
+    if isinstance(error, UpstreamHTTPError):
+        return error.status_code
+    if isinstance(error, genai_errors.APIError):
+        return error.code
+    response = getattr(error, "response", None)
+    if isinstance(error, requests.exceptions.HTTPError) and response is not None:
+        return response.status_code
+    return None
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    判断异常是否说明上游端点故障（连接失败、超时、5xx）
+
+    只按异常类型和 HTTP 状态码判断，不匹配错误文案（安全过滤、空响应等提示中
+    也会出现"网络连接"之类的字样）。生成器会把底层异常包装成带友好提示的 Exception，
+    因此沿 __cause__ / __context__ 向上查找第一个能判断的异常。
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    current: Optional[BaseException] = error
+    for _ in range(_MAX_CHAIN_DEPTH):
+        if current is None:
+            break
+        if isinstance(current, genai_errors.ServerError) or isinstance(current, _TRANSPORT_ERRORS):
+            return True
+        status_code = _status_code(current)
+        if status_code is not None:
+            return status_code >= 500
+        current = current.__cause__ or current.__context__
+    return False
+
+
+class CircuitBreaker:
+    """单个端点的熔断器"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        """熔断打开（且未到探测时间）或探测进行中时抛出 CircuitOpenError，不改变状态"""
+        with self._lock:
+            if self.state == STATE_OPEN and time.monotonic() - self.opened_at < self.reset_timeout:
+                self._reject()
+            if self.state == STATE_HALF_OPEN and self._probe_in_flight:
+                self._reject()
+
+    def before_call(self):
+        """请求前调用：open 状态快速失败，到时间后转为 half_open 并放行一个探测请求"""
+        with self._lock:
+            if self.state == STATE_OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self._reject()
+                self.state = STATE_HALF_OPEN
+                self._probe_in_flight = False
+                logger.info(f"🔌 {self.name} 熔断进入半开状态，发送探测请求")
+            if self.state == STATE_HALF_OPEN:
+                if self._probe_in_flight:
+                    self._reject()
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != STATE_CLOSED:
+                logger.info(f"✅ {self.name} 探测成功，熔断关闭")
+            self.state = STATE_CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == STATE_HALF_OPEN or (
+                self.state == STATE_CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                logger.warning(
+                    f"⚡ {self.name} 连续 {self.consecutive_failures} 次请求失败，熔断 {self.reset_timeout:g} 秒"
+                )
+            self._probe_in_flight = False
+
+    @contextmanager
+    def guard(self):
+        """with breaker.guard(): 执行一次上游请求并记录结果"""
+        self.before_call()
+        try:
+            yield
+        except Exception as e:
+            if is_upstream_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        except BaseException:
+            # 线程被中断等情况不计入结果，只释放探测名额
+            with self._lock:
+                self._probe_in_flight = False
+            raise
+        else:
+            self.record_success()
+
+    def _reject(self):
+        """拒绝请求（需持有锁）"""
+        self.rejected += 1
+        remaining = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        raise CircuitOpenError(
+            f"⚡ 服务暂时不可用：{self.name} 连续请求失败，已暂停请求（熔断中）\n\n"
+            f"约 {remaining:.0f} 秒后会自动探测恢复，请稍后重试"
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            open_for = time.monotonic() - self.opened_at if self.state != STATE_CLOSED else 0.0
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "open_seconds": round(open_for, 1),
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def endpoint_name(kind: str, base_url: Optional[str], api_key: Optional[str]) -> str:
+    """熔断器名称：类型@地址#API Key 摘要"""
+    key_hash = hashlib.sha256(str(api_key or "").encode("utf-8")).hexdigest()[:8]
+    return f"{kind}@{base_url or 'default'}#{key_hash}"
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """获取端点的熔断器（首次调用时按配置创建）"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        from backend.config import Config
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    name, Config.get_circuit_failure_threshold(), Config.get_circuit_reset_seconds()
+                )
+                _breakers[name] = breaker
+    return breaker
+
+
+def circuit_guard(owner: Any):
+    """
+    重试装饰器中包裹单次尝试：owner（生成器/客户端实例）有 circuit_breaker 属性时
+    使用其熔断器，否则不做处理
+    """
+    breaker: Optional[CircuitBreaker] = getattr(owner, "circuit_breaker", None)
+    return breaker.guard() if breaker is not None else nullcontext()
+
+
+def get_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """各端点熔断器的当前状态"""
+    with _breakers_lock:
+        items = list(_breakers.items())
+    return {name: breaker.to_dict() for name, breaker in items}
+
+
+def reset_circuit_breakers():
+    """清除全部熔断器（配置变更或测试时使用）"""
+    with _breakers_lock:
+        _breakers.clear()
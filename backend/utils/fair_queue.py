@@ -0,0 +1,111 @@
+"""按用户加权公平排队
+
+多个用户共享同一份有限资源（上游并发名额、图片处理池）时，先到先得会让一次提交
+大量请求的用户占满资源，其他用户的小任务要排在它的全部请求之后。
+
+FairQueue 用虚拟时间实现加权轮转：每个用户的请求依次获得递增的虚拟完成时间
+tag = max(全局虚拟时间, 该用户上一个 tag) + 1/weight，按 tag 从小到大出队。
+新来的用户从当前虚拟时间开始排，不会排在别人已积压的请求之后；
+权重为 2 的用户在同样时间内获得的名额是权重为 1 的用户的两倍。
+
+FairGate 在 FairQueue 基础上提供固定名额数的公平信号量。
+"""
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+
+class FairWaiter:
+    """排队中的一次申请"""
+    __slots__ = ("user", "start", "tag", "cancelled")
+
+    def __init__(self, user: Any, start: float, tag: float):
+        self.user = user
+        self.start = start
+        self.tag = tag
+        self.cancelled = False
+
+
+class FairQueue:
+    """
+    加权公平队列（不加锁，由调用方持有锁后使用）
+
+    user 为 None 的请求视为同一个匿名用户。
+    """
+
+    def __init__(self):
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._user_tags: Dict[Any, float] = {}
+        self._vtime = 0.0
+
+    def push(self, user: Any, weight: float = 1.0) -> FairWaiter:
+        """按用户的虚拟时间入队"""
+        start = max(self._vtime, self._user_tags.get(user, 0.0))
+        tag = start + 1.0 / max(weight or 1.0, 0.01)
+        self._user_tags[user] = tag
+        if len(self._user_tags) > 1024:
+            # 虚拟时间已经追上的用户不再需要记录
+            self._user_tags = {u: t for u, t in self._user_tags.items() if t > self._vtime}
+        waiter = FairWaiter(user, start, tag)
+        heapq.heappush(self._heap, (tag, next(self._seq), waiter))
+        return waiter
+
+    def head(self) -> Optional[FairWaiter]:
+        """当前队首（跳过已取消的申请）"""
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+        return self._heap[0][2] if self._heap else None
+
+    def pop(self, waiter: FairWaiter):
+        """队首获得资源后出队，推进虚拟时间"""
+        if self.head() is waiter:
+            heapq.heappop(self._heap)
+        self._vtime = max(self._vtime, waiter.start)
+
+    def cancel(self, waiter: FairWaiter):
+        """取消排队（超时或异常），惰性地从堆中移除"""
+        waiter.cancelled = True
+
+    def waiting_by_user(self) -> Dict[str, int]:
+        """各用户排队中的申请数"""
+        counts: Dict[str, int] = {}
+        for _, _, waiter in self._heap:
+            if not waiter.cancelled:
+                user = str(waiter.user) if waiter.user is not None else "anonymous"
+                counts[user] = counts.get(user, 0) + 1
+        return counts
+
+
+class FairGate:
+    """名额数固定、按用户加权公平分配的信号量"""
+
+    def __init__(self, permits: int):
+        self.permits = max(1, permits)
+        self.in_use = 0
+        self._queue = FairQueue()
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self, user: Any = None, weight: float = 1.0):
+        """with gate.slot(user, weight): 占用一个名额执行"""
+        with self._cond:
+            waiter = self._queue.push(user, weight)
+            try:
+                while not (self._queue.head() is waiter and self.in_use < self.permits):
+                    self._cond.wait()
+                self._queue.pop(waiter)
+                self.in_use += 1
+                self._cond.notify_all()
+            except BaseException:
+                self._queue.cancel(waiter)
+                self._cond.notify_all()
+                raise
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_use -= 1
+                self._cond.notify_all()
@@ -4,6 +4,7 @@ import random
 from functools import wraps
 from google import genai
 from google.genai import types
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, circuit_guard, endpoint_name, get_circuit_breaker
 
 # 导入统一的错误解析函数
 from ..generators.google_genai import parse_genai_error
@@ -17,7 +18,11 @@ def retry_on_429(max_retries=3, base_delay=2):
             last_error = None
             for attempt in range(max_retries):
                 try:
-                    return func(*args, **kwargs)
+                    with circuit_guard(args[0]):
+                        return func(*args, **kwargs)
+                except CircuitOpenError:
+                    # 熔断中：快速失败，不再重试
+                    raise
                 except Exception as e:
                     last_error = e
                     error_str = str(e).lower()
@@ -72,6 +77,8 @@ class GenAIClient:
                 "解决方案：在系统设置页面编辑该服务商，填写 API Key"
             )
 
+        self.base_url = base_url
+
         # 构建客户端参数
         client_kwargs = {"api_key": self.api_key}
 
@@ -96,6 +103,11 @@ class GenAIClient:
             types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF"),
         ]
 
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        """所连接端点的熔断器"""
+        return get_circuit_breaker(endpoint_name("text:google_genai", self.base_url, self.api_key))
+
     @retry_on_429(max_retries=3, base_delay=2)
     def generate_text(
         self,
@@ -0,0 +1,221 @@
+"""图片生成的请求对冲（hedged requests）
+
+图片生成耗时长尾明显：一页图片卡住，整篇帖子的 finish 事件就要一直等它。
+开启对冲（IMAGE_HEDGING）后，一页图片的上游请求耗时超过该服务商最近延迟的
+P{IMAGE_HEDGE_PERCENTILE} 时，再发出一个重复请求（默认发给路由中的下一个服务商），
+取先成功的结果。主请求和对冲请求使用各自的线程池，对冲请求不会排在其他页面的主请求之后：
+- 落后的一方如果还在限流队列中排队，拿到名额后直接放弃，不占用上游配额
+- 已经发出的请求无法中断，完成后丢弃结果
+
+阈值来自按服务商统计的延迟直方图（最近 LATENCY_WINDOW 次成功请求），
+样本不足 IMAGE_HEDGE_MIN_SAMPLES 次时不对冲。
+"""
+import bisect
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .rate_limiter import RequestCancelled
+
+# 每个服务商保留的最近延迟样本数
+LATENCY_WINDOW = 200
+
+# 直方图桶边界（秒）：0.1 秒起按 1.2 倍递增，覆盖到一小时以上
+_BUCKET_BOUNDS: List[float] = [0.1 * 1.2 ** i for i in range(60)]
+
+# 等待主请求真正发出时的轮询间隔（秒）
+_START_POLL_INTERVAL = 0.1
+
+
+class LatencyHistogram:
+    """单个服务商最近请求延迟的直方图"""
+
+    def __init__(self, name: str, window: int = LATENCY_WINDOW):
+        self.name = name
+        self._counts = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self._recent: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @property
+    def count(self) -> int:
+        return len(self._recent)
+
+    def record(self, latency: float):
+        """记录一次成功请求的耗时，超出窗口的最早样本移出直方图"""
+        bucket = bisect.bisect_left(_BUCKET_BOUNDS, latency)
+        with self._lock:
+            if len(self._recent) == self._recent.maxlen:
+                self._counts[self._recent[0]] -= 1
+            self._recent.append(bucket)
+            self._counts[bucket] += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        """延迟的 p 分位数（取所在桶的上界，没有样本时返回 None）"""
+        with self._lock:
+            total = len(self._recent)
+            if total == 0:
+                return None
+            target = max(1, int(total * p / 100.0 + 0.999999))
+            seen = 0
+            for bucket, count in enumerate(self._counts):
+                seen += count
+                if seen >= target:
+                    break
+        return _BUCKET_BOUNDS[min(bucket, len(_BUCKET_BOUNDS) - 1)]
+
+    def record_hedge(self):
+        """记录发出了一次对冲请求"""
+        with self._lock:
+            self.hedges += 1
+
+    def record_hedge_win(self):
+        """记录一次对冲请求比主请求先完成"""
+        with self._lock:
+            self.hedge_wins += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        p50, p90, p95, p99 = (self.percentile(p) for p in (50, 90, 95, 99))
+        return {
+            "samples": self.count,
+            "p50": round(p50, 2) if p50 is not None else None,
+            "p90": round(p90, 2) if p90 is not None else None,
+            "p95": round(p95, 2) if p95 is not None else None,
+            "p99": round(p99, 2) if p99 is not None else None,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+class HedgeAttempt:
+    """
+    一次请求尝试（主请求或对冲请求），记录上游请求开始时间，可被取消
+
+    同一页的主请求和对冲请求共享 group：任一方上游请求成功后立即标记，
+    另一方此后拿到限流名额时直接放弃（不必等结果返回给调用方）
+    """
+
+    def __init__(self, group: Optional[threading.Event] = None):
+        self.started = threading.Event()
+        self.started_at: Optional[float] = None
+        self._cancelled = threading.Event()
+        self._group = group if group is not None else threading.Event()
+
+    def begin(self):
+        """获得限流名额、即将请求上游时调用：已取消则抛出 RequestCancelled"""
+        if self._cancelled.is_set() or self._group.is_set():
+            raise RequestCancelled("对冲请求的另一方已完成，放弃本次请求")
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+            self.started.set()
+
+    def complete(self):
+        """上游请求成功后调用"""
+        self._group.set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+
+_histograms: Dict[str, LatencyHistogram] = {}
+_histograms_lock = threading.Lock()
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executor_lock = threading.Lock()
+
+
+def get_latency_histogram(name: str) -> LatencyHistogram:
+    """获取服务商的延迟直方图（首次调用时创建）"""
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(name, LatencyHistogram(name))
+    return histogram
+
+
+def get_latency_stats() -> Dict[str, Dict[str, Any]]:
+    """各服务商的延迟分位数和对冲次数"""
+    with _histograms_lock:
+        items = list(_histograms.items())
+    return {name: histogram.to_dict() for name, histogram in items}
+
+
+def reset_latency_histograms():
+    """清除延迟统计（测试时使用）"""
+    with _histograms_lock:
+        _histograms.clear()
+
+
+def _get_executor(kind: str) -> ThreadPoolExecutor:
+    """
+    对冲使用的线程池：主请求（primary）和对冲请求（hedge）各用一个，
+    对冲请求不会排在其他页面的主请求之后
+    """
+    executor = _executors.get(kind)
+    if executor is None:
+        with _executor_lock:
+            executor = _executors.get(kind)
+            if executor is None:
+                from backend.services.image import ImageService
+                executor = ThreadPoolExecutor(
+                    max_workers=ImageService.MAX_CONCURRENT * 4, thread_name_prefix=f"image-{kind}"
+                )
+                _executors[kind] = executor
+    return executor
+
+
+def run_hedged(
+    primary: Callable[[HedgeAttempt], Any],
+    hedge: Callable[[HedgeAttempt], Any],
+    delay: float,
+    on_hedge: Optional[Callable[[], None]] = None
+) -> Tuple[Any, bool]:
+    """
+    执行主请求，上游请求耗时超过 delay 秒仍未完成时再执行对冲请求，返回先成功的结果
+
+    主请求和对冲请求分别提交到各自的线程池；先成功的一方立即返回，
+    落后的一方被取消（仍在排队时直接放弃，已发出的请求完成后丢弃结果）。
+
+    Args:
+        primary / hedge: 接收 HedgeAttempt 的请求函数，获得限流名额后调用 attempt.begin()，
+            上游请求成功后调用 attempt.complete()
+        delay: 对冲阈值（从主请求真正发出时开始计时，排队时间不计入）
+        on_hedge: 发出对冲请求时的回调
+
+    Returns:
+        (结果, 是否由对冲请求完成)；两者都失败时抛出主请求的异常
+    """
+    group = threading.Event()
+    first = HedgeAttempt(group)
+    primary_future = _get_executor("primary").submit(primary, first)
+
+    # 等待主请求真正发出（在限流队列中排队时不计时）
+    while not primary_future.done() and not first.started.wait(_START_POLL_INTERVAL):
+        pass
+    if not primary_future.done():
+        remaining = delay - (time.monotonic() - first.started_at)
+        wait([primary_future], timeout=max(0.0, remaining))
+    if primary_future.done():
+        return primary_future.result(), False
+
+    if on_hedge is not None:
+        on_hedge()
+    second = HedgeAttempt(group)
+    hedge_future = _get_executor("hedge").submit(hedge, second)
+    attempts = {primary_future: first, hedge_future: second}
+
+    pending = set(attempts)
+    errors: Dict[Any, BaseException] = {}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            error = future.exception()
+            if error is None:
+                # 取消落后的一方，其结果被丢弃
+                for other in pending:
+                    attempts[other].cancel()
+                return future.result(), future is hedge_future
+            errors[future] = error
+    raise errors[primary_future]
@@ -0,0 +1,181 @@
+"""共享 HTTP 会话
+
+各生成器和文本客户端原来直接调用 requests.post/get，每次请求都会新建
+TCP + TLS 连接。这里按源站（scheme://host:port）维护全局共享的 requests.Session：
+
+- 连接池大小与图片生成的最大并发数一致（HTTP_POOL_MAXSIZE 可覆盖），并发请求都能复用连接
+- 重试适配器：连接失败时重试（请求尚未发出，对 POST 也安全）；
+  GET 等幂等请求遇到 502/503/504 时按 Retry-After/指数退避重试
+- 统计每个源站的请求数和新建连接数，用于观察连接复用情况
+- 会话被所有用户、所有 API Key 共享，因此不保存 Cookie（避免一个租户的 Cookie 被带到
+  其他租户的请求中）；会话数按最近使用淘汰（图片下载地址的源站不可控）
+"""
+import logging
+import threading
+from collections import OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, Dict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# 幂等请求重试的状态码
+RETRY_STATUS_CODES = (502, 503, 504)
+# 重试退避系数（秒）
+RETRY_BACKOFF_FACTOR = 0.5
+# 保留的共享会话（源站）数上限
+SESSION_CACHE_SIZE = 64
+
+
+class PoolStats:
+    """单个源站的连接统计"""
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            requests_count, connections = self.requests, self.new_connections
+        reused = max(0, requests_count - connections)
+        return {
+            "requests": requests_count,
+            "new_connections": connections,
+            "reused_connections": reused,
+            "reuse_ratio": round(reused / requests_count, 3) if requests_count else 0.0,
+        }
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """记录请求数和新建连接数的 HTTPAdapter"""
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self.stats
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                stats.record_connection()
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                stats.record_connection()
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        self.stats.record_request()
+        return super().send(request, **kwargs)
+
+
+class RejectAllCookiePolicy(DefaultCookiePolicy):
+    """不接受也不发送任何 Cookie"""
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+class UpstreamHTTPError(Exception):
+    """上游返回了非成功状态码（保留状态码，供熔断器等按状态分类）"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+_sessions: "OrderedDict[str, requests.Session]" = OrderedDict()
+_stats: "OrderedDict[str, PoolStats]" = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _create_session(stats: PoolStats) -> requests.Session:
+    from backend.config import Config
+
+    pool_size = Config.get_http_pool_maxsize()
+    retry = Retry(
+        total=Config.get_http_max_retries(),
+        read=0,
+        status_forcelist=RETRY_STATUS_CODES,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = CountingHTTPAdapter(stats, pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.cookies.set_policy(RejectAllCookiePolicy())
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_http_session(url: str) -> requests.Session:
+    """
+    获取 url 所在源站的共享会话（首次调用时创建）
+
+    超过 SESSION_CACHE_SIZE 个源站时丢弃最久未使用的会话及其统计
+    （不主动关闭，进行中的请求不受影响，连接随会话回收）。
+
+    Args:
+        url: 请求地址或 base_url，只使用其中的 scheme/host/port
+    """
+    origin = _origin(url)
+    with _sessions_lock:
+        session = _sessions.get(origin)
+        if session is not None:
+            _sessions.move_to_end(origin)
+            return session
+        stats = _stats.setdefault(origin, PoolStats())
+        session = _create_session(stats)
+        _sessions[origin] = session
+        while len(_sessions) > SESSION_CACHE_SIZE:
+            evicted, _ = _sessions.popitem(last=False)
+            _stats.pop(evicted, None)
+        logger.debug(f"创建共享 HTTP 会话: {origin}")
+    return session
+
+
+def get_http_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """各源站的连接复用统计"""
+    with _sessions_lock:
+        items = list(_stats.items())
+    return {origin: stats.to_dict() for origin, stats in items}
+
+
+def reset_http_sessions():
+    """关闭并清除全部共享会话（配置变更或测试时使用），统计保留"""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
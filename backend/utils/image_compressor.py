@@ -1,94 +1,230 @@
 """图片压缩工具"""
 import io
-from PIL import Image
-from typing import Optional
+from PIL import Image, features
+from typing import Dict, Iterable, List, Optional, Tuple
 
+# 质量搜索的步长
+QUALITY_STEP = 5
+# 首次编码超出目标大小的倍数超过该值时，才用探测图估算是否需要缩小尺寸
+PROBE_THRESHOLD = 2
+# 估算压缩后大小时使用的探测图最长边
+PROBE_LONG_EDGE = 512
+# 按预测尺寸缩放时预留的余量，避免估算偏差导致再缩一次
+RESIZE_SAFETY_FACTOR = 0.95
+# 为满足大小要求缩小尺寸时的最长边下限
+MIN_LONG_EDGE = 512
 
-def compress_image(
+# 多尺寸版本各格式的编码参数（质量大致对齐：同等观感下 WebP/AVIF 体积约为 JPEG 的一半）
+# AVIF 使用较快的编码速度，保存时耗时与 WebP 同一量级
+RENDITION_SAVE_OPTIONS = {
+    'jpeg': {'quality': 82, 'optimize': True, 'progressive': True},
+    'webp': {'quality': 80, 'method': 4},
+    'avif': {'quality': 60, 'speed': 8},
+}
+
+
+def _to_rgb(img: Image.Image) -> Image.Image:
+    """转换为 RGB（透明背景填充白色），用于输出 JPEG"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    """编码为 JPEG"""
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def _resize_to_long_edge(img: Image.Image, long_edge: int) -> Image.Image:
+    """按最长边等比缩放"""
+    width, height = img.size
+    ratio = long_edge / max(width, height)
+    if ratio >= 1:
+        return img
+    return img.resize((max(1, int(width * ratio)), max(1, int(height * ratio))), Image.Resampling.LANCZOS)
+
+
+def _estimate_jpeg_size(img: Image.Image, quality: int) -> int:
+    """
+    用缩小的探测图估算整图按指定质量编码后的大小
+
+    JPEG 体积大致与像素数成正比；缩小后的图片细节更密集，单像素字节数偏高，
+    因此估算结果偏保守（偏大）。
+    """
+    width, height = img.size
+    if max(width, height) <= PROBE_LONG_EDGE:
+        return len(_encode_jpeg(img, quality))
+    probe = _resize_to_long_edge(img, PROBE_LONG_EDGE)
+    area_ratio = (width * height) / (probe.size[0] * probe.size[1])
+    return int(len(_encode_jpeg(probe, quality)) * area_ratio)
+
+
+def _compress_decoded(
+    img: Image.Image,
+    max_size_bytes: int,
+    quality_start: int,
+    quality_min: int
+) -> bytes:
+    """
+    把已解码（RGB、已限制最大边长）的图片压缩到指定大小以内
+
+    搜索策略：
+    1. 先按 quality_start 编码，满足要求直接返回
+    2. 超出较多时用缩小的探测图估算 quality_min 下的整图大小，超出目标时按面积比例一次缩放到预测尺寸
+    3. 在 [quality_min, quality_start) 区间（步长 5）二分查找满足大小要求的最高质量
+    4. 估算偏差导致仍然超出时，再按实际大小比例缩小（最长边不小于 512）
+    """
+    compressed_data = _encode_jpeg(img, quality_start)
+    if len(compressed_data) <= max_size_bytes:
+        return compressed_data
+
+    # 超出不多时降低质量即可满足；超出较多时用探测图预测最低质量下是否还需要缩小尺寸，
+    # 需要时一次缩放到预测尺寸
+    if len(compressed_data) > max_size_bytes * PROBE_THRESHOLD:
+        estimated = _estimate_jpeg_size(img, quality_min)
+        if estimated > max_size_bytes:
+            scale = (max_size_bytes / estimated) ** 0.5 * RESIZE_SAFETY_FACTOR
+            img = _resize_to_long_edge(img, max(MIN_LONG_EDGE, int(max(img.size) * scale)))
+
+    # 在候选质量（步长 QUALITY_STEP）中二分查找满足大小要求的最高质量
+    qualities = list(range(quality_min, quality_start, QUALITY_STEP))
+    best = None
+    low, high = 0, len(qualities) - 1
+    while low <= high:
+        mid = (low + high) // 2
+        data = _encode_jpeg(img, qualities[mid])
+        if len(data) <= max_size_bytes:
+            best = data
+            low = mid + 1
+        else:
+            compressed_data = data
+            high = mid - 1
+
+    # 估算偏小时按实际大小继续缩小
+    while best is None and max(img.size) > MIN_LONG_EDGE:
+        scale = (max_size_bytes / len(compressed_data)) ** 0.5 * RESIZE_SAFETY_FACTOR
+        img = _resize_to_long_edge(img, max(MIN_LONG_EDGE, int(max(img.size) * scale)))
+        compressed_data = _encode_jpeg(img, quality_min)
+        if len(compressed_data) <= max_size_bytes:
+            best = compressed_data
+
+    return best if best is not None else compressed_data
+
+
+def compress_image_targets(
     image_data: bytes,
-    max_size_kb: int = 200,  # 默认200KB
+    targets_kb: Iterable[int],
     quality_start: int = 85,
     quality_min: int = 20,
     max_dimension: int = 2048
-) -> bytes:
+) -> Dict[int, bytes]:
     """
-    压缩图片到指定大小以内
+    一次解码，压缩到多个大小目标
+
+    同一张图需要多种大小（如 50KB 缩略图和 200KB 参考图）时使用，
+    避免每个目标都重新解码、转换和缩放原图。
 
     Args:
         image_data: 原始图片数据
-        max_size_kb: 最大文件大小（KB）
+        targets_kb: 目标大小列表（KB）
         quality_start: 起始压缩质量（1-100）
         quality_min: 最低压缩质量（1-100）
         max_dimension: 最大边长（像素）
 
     Returns:
-        压缩后的图片数据
+        {目标大小KB: 压缩后的图片数据}；原图已小于目标或压缩失败时对应值为原图
     """
-    max_size_bytes = max_size_kb * 1024
-
-    # 如果原图已经小于目标大小，直接返回
-    if len(image_data) <= max_size_bytes:
-        return image_data
+    targets = sorted(set(targets_kb), reverse=True)
+    results = {kb: image_data for kb in targets if len(image_data) <= kb * 1024}
+    pending = [kb for kb in targets if kb not in results]
+    if not pending:
+        return results
 
     try:
-        # 打开图片
-        img = Image.open(io.BytesIO(image_data))
+        # 打开图片并转换为 RGB
+        img = _to_rgb(Image.open(io.BytesIO(image_data)))
+    except Exception as e:
+        print(f"[图片压缩] 压缩失败，返回原图: {e}")
+        img = None
+    results.update(_compress_decoded_targets(img, image_data, pending, quality_start, quality_min, max_dimension))
+    return results
 
-        # 转换为 RGB（处理 RGBA 等格式）
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
+
+def _compress_decoded_targets(
+    img: Optional[Image.Image],
+    image_data: bytes,
+    targets_kb: Iterable[int],
+    quality_start: int = 85,
+    quality_min: int = 20,
+    max_dimension: int = 2048
+) -> Dict[int, bytes]:
+    """
+    把已解码（RGB）的图片压缩到多个大小目标
+
+    Args:
+        img: 已解码并转换为 RGB 的原图，解码失败时为 None
+        image_data: 原始图片数据（用于日志和失败时的返回值）
+
+    Returns:
+        {目标大小KB: 压缩后的图片数据}；压缩失败时对应值为原图
+    """
+    results = {}
+    try:
+        if img is None:
+            raise ValueError("图片解码失败")
 
         # 如果图片尺寸过大，先缩小
-        width, height = img.size
-        if width > max_dimension or height > max_dimension:
-            ratio = min(max_dimension / width, max_dimension / height)
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-        # 逐步降低质量直到满足大小要求
-        quality = quality_start
-        compressed_data = None
-
-        while quality >= quality_min:
-            output = io.BytesIO()
-            img.save(output, format='JPEG', quality=quality, optimize=True)
-            compressed_data = output.getvalue()
-
-            if len(compressed_data) <= max_size_bytes:
-                break
-
-            quality -= 5
-
-        # 如果还是太大，进一步缩小尺寸
-        if len(compressed_data) > max_size_bytes:
-            width, height = img.size
-            while len(compressed_data) > max_size_bytes and max(width, height) > 512:
-                width = int(width * 0.9)
-                height = int(height * 0.9)
-                img_resized = img.resize((width, height), Image.Resampling.LANCZOS)
-
-                output = io.BytesIO()
-                img_resized.save(output, format='JPEG', quality=quality_min, optimize=True)
-                compressed_data = output.getvalue()
+        img = _resize_to_long_edge(img, max_dimension)
 
         original_size_kb = len(image_data) / 1024
-        compressed_size_kb = len(compressed_data) / 1024
-        compression_ratio = (1 - compressed_size_kb / original_size_kb) * 100
+        for kb in targets_kb:
+            compressed_data = _compress_decoded(img, kb * 1024, quality_start, quality_min)
+            results[kb] = compressed_data
 
-        print(f"[图片压缩] {original_size_kb:.1f}KB → {compressed_size_kb:.1f}KB (压缩 {compression_ratio:.1f}%)")
-
-        return compressed_data
+            compressed_size_kb = len(compressed_data) / 1024
+            compression_ratio = (1 - compressed_size_kb / original_size_kb) * 100
+            print(f"[图片压缩] {original_size_kb:.1f}KB → {compressed_size_kb:.1f}KB (压缩 {compression_ratio:.1f}%)")
 
     except Exception as e:
-        print(f"[图片压缩] 压缩失败，返回原图: {e}")
-        return image_data
+        if img is not None:
+            print(f"[图片压缩] 压缩失败，返回原图: {e}")
+        for kb in targets_kb:
+            results.setdefault(kb, image_data)
+
+    return results
+
+
+def compress_image(
+    image_data: bytes,
+    max_size_kb: int = 200,  # 默认200KB
+    quality_start: int = 85,
+    quality_min: int = 20,
+    max_dimension: int = 2048
+) -> bytes:
+    """
+    压缩图片到指定大小以内
+
+    Args:
+        image_data: 原始图片数据
+        max_size_kb: 最大文件大小（KB）
+        quality_start: 起始压缩质量（1-100）
+        quality_min: 最低压缩质量（1-100）
+        max_dimension: 最大边长（像素）
+
+    Returns:
+        压缩后的图片数据
+    """
+    return compress_image_targets(
+        image_data, [max_size_kb], quality_start, quality_min, max_dimension
+    )[max_size_kb]
 
 
 def compress_images(images: list[bytes], max_size_kb: int = 200) -> list[bytes]:
@@ -103,3 +239,134 @@ def compress_images(images: list[bytes], max_size_kb: int = 200) -> list[bytes]:
         压缩后的图片数据列表
     """
     return [compress_image(img, max_size_kb) for img in images]
+
+
+def supported_rendition_formats() -> list[str]:
+    """当前 Pillow 支持编码的多尺寸版本格式（jpeg 总是支持）"""
+    formats = ['jpeg']
+    for fmt in ('webp', 'avif'):
+        if features.check(fmt):
+            formats.append(fmt)
+    return formats
+
+
+def _encode_rendition(img: Image.Image, fmt: str) -> bytes:
+    """按格式编码单个尺寸版本"""
+    output = io.BytesIO()
+    if fmt == 'webp':
+        img.save(output, format='WEBP', **RENDITION_SAVE_OPTIONS['webp'])
+    elif fmt == 'avif':
+        img.save(output, format='AVIF', **RENDITION_SAVE_OPTIONS['avif'])
+    else:
+        img.save(output, format='JPEG', **RENDITION_SAVE_OPTIONS['jpeg'])
+    return output.getvalue()
+
+
+def generate_renditions(
+    image_data: bytes,
+    widths: Iterable[int],
+    formats: Iterable[str] = ('jpeg',)
+) -> Dict[Tuple[int, str], bytes]:
+    """
+    生成多尺寸版本（缩略图金字塔）
+
+    只解码一次原图，从大到小依次缩放，每一级都从上一级结果缩小，
+    避免每个尺寸都从原图重新解码和缩放。不会放大：宽度不小于原图的尺寸会被跳过。
+    每个尺寸按 formats 编码为多种格式，Pillow 不支持的格式会被跳过。
+
+    Args:
+        image_data: 原始图片数据
+        widths: 目标宽度列表（像素）
+        formats: 输出格式列表（jpeg / webp / avif）
+
+    Returns:
+        {(宽度, 格式): 图片数据}，失败时返回空字典
+    """
+    widths, formats = _rendition_plan(widths, formats)
+    if not widths or not formats:
+        return {}
+
+    try:
+        img = Image.open(io.BytesIO(image_data))
+        widths = [w for w in widths if w < img.size[0]]
+        if not widths:
+            return {}
+        return _generate_decoded_renditions(_to_rgb(img), widths, formats)
+
+    except Exception as e:
+        print(f"[图片压缩] 生成多尺寸版本失败: {e}")
+        return {}
+
+
+def _rendition_plan(widths: Iterable[int], formats: Iterable[str]) -> Tuple[list, list]:
+    """多尺寸版本的宽度（从大到小）和 Pillow 支持的输出格式"""
+    widths = sorted({w for w in widths if w > 0}, reverse=True)
+    supported = supported_rendition_formats()
+    formats = [f for f in dict.fromkeys(formats) if f in supported]
+    return widths, formats
+
+
+def _generate_decoded_renditions(
+    img: Image.Image,
+    widths: List[int],
+    formats: List[str]
+) -> Dict[Tuple[int, str], bytes]:
+    """
+    从已解码（RGB）的原图生成多尺寸版本
+
+    Args:
+        img: 已解码并转换为 RGB 的原图
+        widths: 从大到小排列、均小于原图宽度的目标宽度
+        formats: Pillow 支持的输出格式
+    """
+    try:
+        renditions = {}
+        for width in widths:
+            height = max(1, round(img.size[1] * width / img.size[0]))
+            img = img.resize((width, height), Image.Resampling.LANCZOS)
+            for fmt in formats:
+                renditions[(width, fmt)] = _encode_rendition(img, fmt)
+        return renditions
+
+    except Exception as e:
+        print(f"[图片压缩] 生成多尺寸版本失败: {e}")
+        return {}
+
+
+def process_saved_image(
+    image_data: bytes,
+    targets_kb: Iterable[int],
+    widths: Iterable[int],
+    formats: Iterable[str]
+) -> Tuple[Dict[int, bytes], Dict[Tuple[int, str], bytes]]:
+    """
+    保存图片时的全部 Pillow 处理：按大小目标压缩 + 生成多尺寸版本
+
+    原图只解码、转换一次，压缩和多尺寸版本共用解码结果。
+    模块级函数、参数与返回值均可 pickle，可提交到图片处理进程池执行。
+
+    Returns:
+        (compress_image_targets 结果, generate_renditions 结果)
+    """
+    targets = sorted(set(targets_kb), reverse=True)
+    compressed = {kb: image_data for kb in targets if len(image_data) <= kb * 1024}
+    pending = [kb for kb in targets if kb not in compressed]
+    widths, formats = _rendition_plan(widths, formats)
+    if not formats:
+        widths = []
+
+    img = None
+    try:
+        # Image.open 只读取文件头，确实需要处理时才解码像素
+        opened = Image.open(io.BytesIO(image_data))
+        widths = [w for w in widths if w < opened.size[0]]
+        if pending or widths:
+            img = _to_rgb(opened)
+    except Exception as e:
+        print(f"[图片压缩] 图片解码失败: {e}")
+        widths = []
+
+    if pending:
+        compressed.update(_compress_decoded_targets(img, image_data, pending))
+    renditions = _generate_decoded_renditions(img, widths, formats) if img is not None and widths else {}
+    return compressed, renditions
@@ -0,0 +1,103 @@
+"""图片处理进程池
+
+解码、缩放、编码等 Pillow 操作是 CPU 密集型的，放在生成图片的线程池里执行时
+会与 SSE 推送和 HTTP 请求争抢 GIL。这里提供一个全局共享、按需启动、大小有限的
+进程池，把这些工作转移到独立进程执行。
+
+运行方式（环境变量 IMAGE_POOL_MODE）：
+- process: 进程池（默认）
+- thread: 线程池（用于测试或不便创建子进程的环境）
+- inline: 在调用线程中直接执行
+
+多个用户同时生成时，run_user_image_task 按用户加权公平地把任务送入池中
+（池内最多排 workers 个任务），大任务的后处理不会让其他用户的小任务一直排队。
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from .fair_queue import FairGate
+
+logger = logging.getLogger(__name__)
+
+# inline 模式的占位值，避免每次调用都重新读取配置
+_INLINE = object()
+
+_pool = None
+_gate: Optional[FairGate] = None
+_pool_lock = threading.Lock()
+
+
+def _create_pool() -> Optional[Executor]:
+    from backend.config import Config
+
+    mode = Config.get_image_pool_mode()
+    workers = Config.get_image_pool_workers()
+    if mode == 'inline' or workers <= 0:
+        logger.info("🖼️ 图片处理在调用线程中执行（未启用进程池）")
+        return None
+    if mode == 'thread':
+        logger.info(f"🖼️ 启动图片处理线程池: workers={workers}")
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-pool')
+
+    # 使用 spawn：Web 服务进程中已有多个线程，fork 可能复制持有中的锁
+    logger.info(f"🖼️ 启动图片处理进程池: workers={workers}")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def get_image_pool() -> Optional[Executor]:
+    """获取全局图片处理池（首次调用时创建），inline 模式返回 None"""
+    global _pool, _gate
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from backend.config import Config
+                _gate = FairGate(Config.get_image_pool_workers())
+                _pool = _create_pool() or _INLINE
+    return None if _pool is _INLINE else _pool
+
+
+def run_image_task(fn: Callable, *args, **kwargs) -> Any:
+    """
+    在图片处理池中执行函数并等待结果
+
+    fn 及其参数需可被 pickle（模块级函数 + bytes/基本类型参数）。
+    进程池异常退出时重建池，并在当前线程中直接执行本次任务。
+    """
+    pool = get_image_pool()
+    if pool is None:
+        return fn(*args, **kwargs)
+    try:
+        return pool.submit(fn, *args, **kwargs).result()
+    except BrokenProcessPool as e:
+        logger.warning(f"图片处理进程池异常，已重建并在当前线程执行: {e}")
+        reset_image_pool()
+        return fn(*args, **kwargs)
+
+
+def run_user_image_task(user: Any, weight: float, fn: Callable, *args, **kwargs) -> Any:
+    """
+    按用户公平排队后在图片处理池中执行函数并等待结果
+
+    Args:
+        user: 公平排队的用户标识
+        weight: 用户权重
+    """
+    pool = get_image_pool()
+    gate = _gate
+    if pool is None or gate is None:
+        return fn(*args, **kwargs)
+    with gate.slot(user, weight):
+        return run_image_task(fn, *args, **kwargs)
+
+
+def reset_image_pool():
+    """关闭并清除全局图片处理池（配置变更或测试时使用，下次调用时重新创建）"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None and pool is not _INLINE:
+        pool.shutdown(wait=False, cancel_futures=True)
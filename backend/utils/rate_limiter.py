@@ -0,0 +1,336 @@
+"""服务商限流
+
+同一个上游 API Key 的配额由所有用户、所有生成任务共享。每次生成调用 generator 之前
+都要先向对应的限流器申请：
+
+- max_in_flight: 同时进行中的请求数上限
+- rpm: 每分钟请求数上限（令牌桶，允许 burst 个请求的突发）
+
+配置写在 image_providers.yaml 的服务商条目中：
+
+    providers:
+      gemini:
+        type: google_genai
+        api_key: ...
+        rpm: 60
+        max_in_flight: 8
+        burst: 4          # 可选，默认 min(rpm, max_in_flight)
+
+rpm 不配置或为 0 表示不限制请求速率；max_in_flight 默认为 DEFAULT_MAX_IN_FLIGHT。
+限流器按 (服务商, API Key) 区分，使用自己 API Key 的用户互不影响。
+
+自适应并发（AIMD，adaptive_concurrency）：实际并发上限 limit 在
+[min_in_flight, max_in_flight] 之间调整——请求延迟和错误率正常时每完成 limit 个请求加 1，
+遇到 429 / RESOURCE_EXHAUSTED 时减半。adaptive_concurrency 未配置时跟随 high_concurrency：
+high_concurrency: true 时开启并从上限开始；high_concurrency: false（如 GCP 试用账号）时
+不开启，页面仍按顺序生成，不会为了探测上限而触发 429。显式配置 adaptive_concurrency: true
+且未开启 high_concurrency 时从 min_in_flight 开始逐步提高。adaptive_concurrency: false 时
+固定使用 max_in_flight。
+
+公平调度：排队的请求按用户加权公平排队（utils/fair_queue.py），而不是谁先醒来谁拿到名额。
+一个用户一次提交 15 页也只会按权重轮流占用名额，其他用户的小任务不会排在它的全部页面之后。
+权重由调用方传入（见 services/scheduling.py）。
+"""
+import hashlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from .fair_queue import FairQueue
+
+logger = logging.getLogger(__name__)
+
+# 未配置 max_in_flight 时每个服务商/API Key 的并发上限
+DEFAULT_MAX_IN_FLIGHT = 15
+# 等待限流的最长时间（秒），超时视为本次生成失败
+ACQUIRE_TIMEOUT = 600
+
+# AIMD 参数
+AIMD_DECREASE_FACTOR = 0.5
+# 延迟不超过基线的多少倍视为正常
+AIMD_LATENCY_TOLERANCE = 2.0
+# 错误率（指数移动平均）低于该值才增加并发
+AIMD_MAX_ERROR_RATE = 0.1
+# 两次减半之间的最短间隔（秒），避免同一批并发请求的 429 把并发连续砍到底
+AIMD_DECREASE_COOLDOWN = 2.0
+# 延迟/错误率指数移动平均的权重
+EWMA_ALPHA = 0.2
+
+_RATE_LIMIT_MARKERS = ("429", "resource_exhausted", "too many requests", "rate limit", "频率超限", "速率限制")
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """判断异常是否为上游限流（429 / RESOURCE_EXHAUSTED）"""
+    text = str(error).lower()
+    return any(marker in text for marker in _RATE_LIMIT_MARKERS)
+
+
+class RateLimitTimeout(Exception):
+    """等待限流超时"""
+
+
+class RequestCancelled(Exception):
+    """获得名额后发现请求已不再需要（如对冲请求的另一方已完成），不计入请求结果"""
+
+
+class ProviderLimiter:
+    """单个服务商/API Key 的并发 + 速率限制"""
+
+    def __init__(
+        self,
+        name: str,
+        rpm: float = 0,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        burst: int = 0,
+        adaptive: bool = True,
+        min_in_flight: int = 1,
+        start_high: bool = False
+    ):
+        self.name = name
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self._tokens = 0.0
+        self.limit = 0.0
+        self.configure(rpm, max_in_flight, burst, adaptive, min_in_flight)
+        self.limit = float(self.max_in_flight if start_high or not adaptive else self.min_in_flight)
+        # 初始令牌桶是满的
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+
+        self.latency_ewma: Optional[float] = None
+        self.latency_baseline: Optional[float] = None
+        self.error_rate = 0.0
+        self._last_decrease = 0.0
+        self.rate_limited_count = 0
+
+        self._queue = FairQueue()
+
+    def configure(
+        self,
+        rpm: float,
+        max_in_flight: int,
+        burst: int = 0,
+        adaptive: bool = True,
+        min_in_flight: int = 1
+    ):
+        """更新限制参数（配置变更时调用，不影响进行中的请求）"""
+        with self._cond:
+            self.rpm = max(0.0, float(rpm or 0))
+            self.max_in_flight = max(1, int(max_in_flight or DEFAULT_MAX_IN_FLIGHT))
+            self.min_in_flight = min(self.max_in_flight, max(1, int(min_in_flight or 1)))
+            self.burst = max(1, int(burst or min(self.rpm or 1, self.max_in_flight)))
+            self.adaptive = bool(adaptive)
+            self._tokens = min(self._tokens, float(self.burst))
+            if self.adaptive:
+                self.limit = min(float(self.max_in_flight), max(float(self.min_in_flight), self.limit))
+            else:
+                self.limit = float(self.max_in_flight)
+            self._cond.notify_all()
+
+    @property
+    def current_limit(self) -> int:
+        """当前生效的并发上限"""
+        return max(1, int(self.limit))
+
+    def acquire(self, timeout: float = ACQUIRE_TIMEOUT, user: Any = None, weight: float = 1.0):
+        """
+        等待一个并发名额和一个速率令牌
+
+        Args:
+            timeout: 最长等待时间（秒）
+            user: 公平排队的用户标识（None 视为同一个匿名用户）
+            weight: 用户权重，权重越大分到的名额越多
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            waiter = self._queue.push(user, weight)
+            self.waiting += 1
+            try:
+                # 只有队首能占名额、取令牌：令牌在真正发出请求前才消耗
+                while True:
+                    if self._queue.head() is waiter and self.in_flight < self.current_limit:
+                        delay = self._take_token()
+                        if delay <= 0:
+                            break
+                        self._wait_until(deadline, delay)
+                    else:
+                        self._wait_until(deadline, None)
+                self._queue.pop(waiter)
+                self.in_flight += 1
+                # 队首变了，唤醒下一个
+                self._cond.notify_all()
+            except BaseException:
+                self._queue.cancel(waiter)
+                self._cond.notify_all()
+                raise
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, timeout: float = ACQUIRE_TIMEOUT, user: Any = None, weight: float = 1.0):
+        """
+        with limiter.slot(user=..., weight=...): 在限流范围内执行一次请求
+
+        记录请求耗时和结果，用于自适应调整并发上限
+        """
+        self.acquire(timeout, user, weight)
+        start = time.monotonic()
+        try:
+            yield
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self.on_rate_limited()
+            else:
+                self.on_error()
+            raise
+        else:
+            self.on_success(time.monotonic() - start)
+        finally:
+            self.release()
+
+    # ==================== 自适应并发（AIMD） ====================
+
+    def on_success(self, latency: float):
+        with self._cond:
+            self.error_rate *= (1 - EWMA_ALPHA)
+            if self.latency_ewma is None:
+                self.latency_ewma = latency
+            else:
+                self.latency_ewma += EWMA_ALPHA * (latency - self.latency_ewma)
+            # 基线取历史最低的平均延迟，并缓慢回升以适应上游整体变慢
+            if self.latency_baseline is None or self.latency_ewma < self.latency_baseline:
+                self.latency_baseline = self.latency_ewma
+            else:
+                self.latency_baseline += 0.01 * (self.latency_ewma - self.latency_baseline)
+
+            healthy = (
+                latency <= self.latency_baseline * AIMD_LATENCY_TOLERANCE
+                and self.error_rate < AIMD_MAX_ERROR_RATE
+            )
+            if self.adaptive and healthy and self.limit < self.max_in_flight:
+                old = self.current_limit
+                # 加性增长：每完成约 limit 个请求，上限加 1
+                self.limit = min(float(self.max_in_flight), self.limit + 1.0 / self.limit)
+                if self.current_limit != old:
+                    logger.info(f"📈 {self.name} 并发上限提高到 {self.current_limit}")
+                    self._cond.notify_all()
+
+    def on_error(self):
+        with self._cond:
+            self.error_rate += EWMA_ALPHA * (1 - self.error_rate)
+
+    def on_rate_limited(self):
+        with self._cond:
+            self.rate_limited_count += 1
+            self.error_rate += EWMA_ALPHA * (1 - self.error_rate)
+            now = time.monotonic()
+            if not self.adaptive or now - self._last_decrease < AIMD_DECREASE_COOLDOWN:
+                return
+            self._last_decrease = now
+            old = self.current_limit
+            # 乘性减小
+            self.limit = max(float(self.min_in_flight), self.limit * AIMD_DECREASE_FACTOR)
+            if self.current_limit != old:
+                logger.warning(f"📉 {self.name} 遇到限流，并发上限降低到 {self.current_limit}")
+
+    def _take_token(self) -> float:
+        """尝试取一个令牌，成功返回 0，否则返回需要等待的秒数（需持有锁）"""
+        if self.rpm <= 0:
+            return 0
+        now = time.monotonic()
+        rate = self.rpm / 60.0
+        self._tokens = min(float(self.burst), self._tokens + (now - self._last_refill) * rate)
+        self._last_refill = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / rate
+
+    def _wait_until(self, deadline: float, delay: Optional[float]):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RateLimitTimeout(
+                f"服务商 {self.name} 请求排队超时（并发上限 {self.current_limit}，每分钟 {self.rpm:g} 次）\n"
+                "建议：稍后重试，或在 image_providers.yaml 中调整 rpm / max_in_flight"
+            )
+        self._cond.wait(min(remaining, delay) if delay is not None else remaining)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "rpm": self.rpm,
+                "max_in_flight": self.max_in_flight,
+                "min_in_flight": self.min_in_flight,
+                "adaptive": self.adaptive,
+                "current_limit": self.current_limit,
+                "burst": self.burst,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "waiting_by_user": self._queue.waiting_by_user(),
+                "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+                "latency_baseline": round(self.latency_baseline, 3) if self.latency_baseline is not None else None,
+                "error_rate": round(self.error_rate, 3),
+                "rate_limited": self.rate_limited_count,
+            }
+
+
+_limiters: Dict[Tuple[str, str], ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_provider_limiter(provider_name: str, provider_config: Dict[str, Any]) -> ProviderLimiter:
+    """
+    获取服务商/API Key 对应的全局限流器（首次调用时创建，配置变化时更新参数）
+
+    Args:
+        provider_name: 服务商名称
+        provider_config: 生效配置，读取其中的 api_key / rpm / max_in_flight / burst /
+            adaptive_concurrency / min_in_flight / high_concurrency
+    """
+    key_hash = hashlib.sha256(str(provider_config.get("api_key") or "").encode("utf-8")).hexdigest()[:12]
+    key = (provider_name, key_hash)
+    rpm = provider_config.get("rpm") or 0
+    max_in_flight = provider_config.get("max_in_flight") or DEFAULT_MAX_IN_FLIGHT
+    burst = provider_config.get("burst") or 0
+    high_concurrency = bool(provider_config.get("high_concurrency", False))
+    # 未显式配置时只对 high_concurrency 服务商开启自适应并发
+    adaptive_setting = provider_config.get("adaptive_concurrency")
+    adaptive = high_concurrency if adaptive_setting is None else adaptive_setting is not False
+    min_in_flight = provider_config.get("min_in_flight") or 1
+
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = ProviderLimiter(
+                provider_name, rpm, max_in_flight, burst,
+                adaptive=adaptive, min_in_flight=min_in_flight,
+                start_high=high_concurrency
+            )
+            _limiters[key] = limiter
+            logger.info(
+                f"🚦 服务商限流: {provider_name} (key={key_hash}) rpm={rpm or '不限'}, "
+                f"max_in_flight={max_in_flight}, adaptive={adaptive}, 初始并发={limiter.current_limit}"
+            )
+            return limiter
+    if (limiter.rpm, limiter.max_in_flight, limiter.adaptive, limiter.min_in_flight) != \
+            (max(0.0, float(rpm)), int(max_in_flight), adaptive, int(min_in_flight)) or \
+            (burst and int(burst) != limiter.burst):
+        limiter.configure(rpm, max_in_flight, burst, adaptive, min_in_flight)
+    return limiter
+
+
+def get_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """各服务商/API Key 限流器的当前状态"""
+    with _limiters_lock:
+        items = list(_limiters.items())
+    return {f"{name}:{key_hash}": limiter.to_dict() for (name, key_hash), limiter in items}
@@ -2,7 +2,9 @@
 import time
 import random
 import base64
-import requests
+from .http_session import UpstreamHTTPError, get_http_session
+from .chat_stream import ChatStreamParser, READ_CHUNK_SIZE
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, circuit_guard, endpoint_name, get_circuit_breaker
 from functools import wraps
 from typing import List, Optional, Union
 from .image_compressor import compress_image
@@ -15,7 +17,11 @@ def retry_on_429(max_retries=3, base_delay=2):
         def wrapper(*args, **kwargs):
             for attempt in range(max_retries):
                 try:
-                    return func(*args, **kwargs)
+                    with circuit_guard(args[0]):
+                        return func(*args, **kwargs)
+                except CircuitOpenError:
+                    # 熔断中：快速失败，不再重试
+                    raise
                 except Exception as e:
                     error_str = str(e)
                     if "429" in error_str or "rate" in error_str.lower():
@@ -57,6 +63,11 @@ class TextChatClient:
             endpoint = '/' + endpoint
         self.chat_endpoint = f"{self.base_url}{endpoint}"
 
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        """所连接端点的熔断器"""
+        return get_circuit_breaker(endpoint_name("text", self.base_url, self.api_key))
+
     def _encode_image_to_base64(self, image_data: bytes) -> str:
         """将图片数据编码为 base64"""
         return base64.b64encode(image_data).decode('utf-8')
@@ -155,7 +166,7 @@ class TextChatClient:
         }
 
         # 使用 stream=True 以便能处理流式响应，但不在 payload 中强制要求
-        response = requests.post(
+        response = get_http_session(self.chat_endpoint).post(
             self.chat_endpoint,
             json=payload,
             headers=headers,
@@ -169,7 +180,8 @@ class TextChatClient:
 
             # 根据状态码给出更详细的错误信息
             if status_code == 401:
-                raise Exception(
+                raise UpstreamHTTPError(
+                    status_code,
                     "❌ API Key 认证失败\n\n"
                     "【可能原因】\n"
                     "1. API Key 无效或已过期\n"
@@ -181,7 +193,8 @@ class TextChatClient:
                     f"\n【请求地址】{self.chat_endpoint}"
                 )
             elif status_code == 403:
-                raise Exception(
+                raise UpstreamHTTPError(
+                    status_code,
                     "❌ 权限被拒绝\n\n"
                     "【可能原因】\n"
                     "1. API Key 没有访问该模型的权限\n"
@@ -193,7 +206,8 @@ class TextChatClient:
                     f"\n【原始错误】{error_detail[:200]}"
                 )
             elif status_code == 404:
-                raise Exception(
+                raise UpstreamHTTPError(
+                    status_code,
                     "❌ 模型不存在或 API 端点错误\n\n"
                     "【可能原因】\n"
                     f"1. 模型 '{model}' 不存在或已下线\n"
@@ -204,7 +218,8 @@ class TextChatClient:
                     f"\n【请求地址】{self.chat_endpoint}"
                 )
             elif status_code == 429:
-                raise Exception(
+                raise UpstreamHTTPError(
+                    status_code,
                     "⏳ API 配额或速率限制\n\n"
                     "【说明】\n"
                     "请求频率过高或配额已用尽。\n\n"
@@ -214,7 +229,8 @@ class TextChatClient:
                     "3. 考虑升级计划获取更多配额"
                 )
             elif status_code >= 500:
-                raise Exception(
+                raise UpstreamHTTPError(
+                    status_code,
                     f"⚠️ API 服务器错误 ({status_code})\n\n"
                     "【说明】\n"
                     "这是服务端的临时故障，与您的配置无关。\n\n"
@@ -223,7 +239,8 @@ class TextChatClient:
                     "2. 如果持续出现，检查服务商状态页"
                 )
             else:
-                raise Exception(
+                raise UpstreamHTTPError(
+                    status_code,
                     f"❌ API 请求失败 (状态码: {status_code})\n\n"
                     f"【原始错误】\n{error_detail}\n\n"
                     f"【请求地址】{self.chat_endpoint}\n"
@@ -257,61 +274,23 @@ class TextChatClient:
             解析得到的完整文本内容
         """
         import json
-        
-        content_type = response.headers.get('Content-Type', '')
-        
-        # 尝试读取原始内容
-        raw_content = b""
-        for chunk in response.iter_content(chunk_size=None):
-            if chunk:
-                raw_content += chunk
-        
-        raw_text = raw_content.decode('utf-8')
-        
-        # 判断是否是流式响应（SSE 格式）
-        is_streaming = 'text/event-stream' in content_type or raw_text.startswith('data:')
-        
-        if is_streaming:
-            # 流式响应解析
-            full_content = ""
-            for line in raw_text.split('\n'):
-                line = line.strip()
-                if not line or not line.startswith('data:'):
-                    continue
-                
-                data_str = line[5:].strip()
-                if data_str == '[DONE]':
-                    break
-                
-                try:
-                    chunk_data = json.loads(data_str)
-                    if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                        delta = chunk_data['choices'][0].get('delta', {})
-                        content_chunk = delta.get('content', '')
-                        if content_chunk:
-                            full_content += content_chunk
-                except json.JSONDecodeError:
-                    continue
-            
-            return full_content
-        else:
-            # 非流式响应解析（标准 JSON）
-            try:
-                result = json.loads(raw_text)
-                if "choices" in result and len(result["choices"]) > 0:
-                    choice = result["choices"][0]
-                    if "message" in choice and "content" in choice["message"]:
-                        return choice["message"]["content"]
-                    elif "delta" in choice and "content" in choice["delta"]:
-                        return choice["delta"]["content"]
-                
-                raise Exception(f"无法从响应中提取内容: {raw_text[:500]}")
-            except json.JSONDecodeError as e:
-                raise Exception(
-                    f"API 响应不是有效的 JSON 格式。\n"
-                    f"错误: {str(e)}\n"
-                    f"响应内容: {raw_text[:500]}"
-                )
+
+        parser = ChatStreamParser(response.headers.get('Content-Type', ''))
+        try:
+            parser.feed_all(response.iter_content(chunk_size=READ_CHUNK_SIZE))
+        except json.JSONDecodeError as e:
+            raise Exception(
+                f"API 响应不是有效的 JSON 格式。\n"
+                f"错误: {str(e)}\n"
+                f"响应内容: {parser.preview_text[:500]}"
+            )
+
+        if not parser.streaming:
+            # 非流式响应（标准 JSON）必须包含 choices 及 message/delta 中的 content
+            if not parser.content:
+                raise Exception(f"无法从响应中提取内容: {parser.preview_text[:500]}")
+
+        return parser.content
 
 
 def get_text_chat_client(provider_config: dict):
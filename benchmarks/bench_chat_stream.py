@@ -0,0 +1,180 @@
+"""
+chat-completions 响应解析基准：合成的 8 MB SSE 流
+
+在本地启动一个分块传输的 SSE 服务器（每个事件一个 HTTP chunk），对比：
+- 图片：约 6 MB base64 图片按 4 KB 分片的 delta，之后还有约 2 MB 文字。
+  当前实现为 ImageApiGenerator._generate_via_chat_api（读到完整图片即停止）
+- 文本：8 MB、每片约 16 个字符的 delta。当前实现为 TextChatClient._parse_chat_response
+
+对照为原来的解析方式（内嵌在脚本中）：用 += 拼接整个响应体，解码后按行切分，
+再用 += 拼接 delta，最后用正则提取图片。两者的输出会做一致性校验。
+
+用法（在仓库根目录运行）：
+    python benchmarks/bench_chat_stream.py [--runs 3]
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+
+from backend.generators.image_api import ImageApiGenerator  # noqa: E402
+from backend.utils.text_client import TextChatClient  # noqa: E402
+
+IMAGE_BYTES = 4_500_000  # base64 后约 6 MB
+TRAILING_TEXT_BYTES = 2_000_000
+TEXT_BYTES = 8_000_000
+DELTA_SIZE = 4096
+TEXT_PIECE = "流式文本abcdefg "
+
+
+def _sse(content: str) -> bytes:
+    return b"data: " + json.dumps({"choices": [{"delta": {"content": content}}]}).encode() + b"\n\n"
+
+
+def image_events(b64: str):
+    yield _sse("好的，这是生成的图片：![image](data:image/png;base64,")
+    for i in range(0, len(b64), DELTA_SIZE):
+        yield _sse(b64[i:i + DELTA_SIZE])
+    yield _sse(")")
+    # 图片之后模型继续输出的说明文字
+    for _ in range(TRAILING_TEXT_BYTES // DELTA_SIZE):
+        yield _sse("x" * DELTA_SIZE)
+    yield b"data: [DONE]\n\n"
+
+
+def text_events():
+    total = 0
+    while total < TEXT_BYTES:
+        event = _sse(TEXT_PIECE)
+        total += len(event)
+        yield event
+    yield b"data: [DONE]\n\n"
+
+
+def start_server(b64: str):
+    """启动本地 SSE 服务器：/img 返回图片流，/txt 返回文本流"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        sent = 0
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            events = image_events(b64) if self.path.startswith("/img") else text_events()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            sent = 0
+            try:
+                for event in events:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+                    sent += len(event)
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端读到图片后提前关闭连接
+                pass
+            Handler.sent = sent
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, Handler
+
+
+def legacy_read_content(response) -> str:
+    """原来的解析方式：拼接整个响应体，再逐行解析 SSE 并拼接 delta"""
+    raw_content = b""
+    for chunk in response.iter_content(chunk_size=None):
+        if chunk:
+            raw_content += chunk
+    raw_text = raw_content.decode("utf-8", errors="ignore")
+    full_content = ""
+    for line in raw_text.split("\n"):
+        line = line.strip()
+        if not line.startswith("data:"):
+            continue
+        data_str = line[5:].strip()
+        if data_str == "[DONE]":
+            continue
+        try:
+            chunk_data = json.loads(data_str)
+        except json.JSONDecodeError:
+            continue
+        if chunk_data.get("choices"):
+            content_part = chunk_data["choices"][0].get("delta", {}).get("content", "")
+            if content_part:
+                full_content += content_part
+    return full_content
+
+
+def legacy_read_image(response) -> bytes:
+    full_content = legacy_read_content(response)
+    match = re.search(r"data:image\/[^;]+;base64,([A-Za-z0-9+/=]+)", full_content)
+    return base64.b64decode(match.group(1))
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="每种解析方式的运行次数")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    image = bytes(rng.getrandbits(8) for _ in range(IMAGE_BYTES))
+    server, handler = start_server(base64.b64encode(image).decode())
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    generator = ImageApiGenerator({
+        "api_key": "k", "base_url": f"{base_url}/img", "endpoint_type": "chat", "model": "m",
+    })
+    client = TextChatClient(api_key="k", base_url=f"{base_url}/txt")
+
+    def post(path: str):
+        return requests.post(f"{base_url}{path}", json={}, stream=True)
+
+    print("图片（约 8 MB SSE，其中 base64 图片约 6 MB）：")
+    for label, read in (
+        ("legacy", lambda: legacy_read_image(post("/img/v1/chat/completions"))),
+        ("current", lambda: generator._generate_via_chat_api("p", "3:4", "m")),
+    ):
+        for _ in range(args.runs):
+            result, elapsed = timed(read)
+            assert result == image, "图片数据不一致"
+            time.sleep(0.2)  # 等服务器记录发送字节数
+            print(f"  {label:7} {elapsed:5.2f}s  服务器发送 {handler.sent / 1e6:.1f} MB")
+
+    print("文本（8 MB SSE，每片约 16 个字符）：")
+    expected = None
+    for label, read in (
+        ("legacy", lambda: legacy_read_content(post("/txt"))),
+        ("current", lambda: client._parse_chat_response(post("/txt"))),
+    ):
+        for _ in range(args.runs):
+            result, elapsed = timed(read)
+            expected = expected if expected is not None else result
+            assert result == expected, "文本内容不一致"
+            print(f"  {label:7} {elapsed:5.2f}s  {len(result):,} 字符")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
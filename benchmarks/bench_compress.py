@@ -0,0 +1,146 @@
+"""
+compress_image 基准：JPEG 编码次数与耗时
+
+对比当前实现（二分查找质量 + 按探测结果一次缩放）与原来逐级降低质量、
+再按 0.9 倍逐步缩小的实现。输入为 images/ 下的样例图片及其放大 2 倍的版本
+（模拟生成器的大图输出）。编码次数通过包装 PIL.Image.Image.save 统计，
+耗时包括解码和 max_dimension 预缩放。
+
+用法（在仓库根目录运行）：
+    python benchmarks/bench_compress.py [--targets 50,200] [--verbose]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image  # noqa: E402
+
+from backend.utils.image_compressor import _to_rgb, compress_image  # noqa: E402
+
+
+def legacy_compress_image(
+    image_data: bytes,
+    max_size_kb: int = 200,
+    quality_start: int = 85,
+    quality_min: int = 20,
+    max_dimension: int = 2048
+) -> bytes:
+    """原来的实现：质量从 85 每次降 5，仍超出则按 0.9 倍逐步缩小，每一步都重新编码"""
+    max_size_bytes = max_size_kb * 1024
+    if len(image_data) <= max_size_bytes:
+        return image_data
+
+    img = _to_rgb(Image.open(io.BytesIO(image_data)))
+    width, height = img.size
+    if width > max_dimension or height > max_dimension:
+        ratio = min(max_dimension / width, max_dimension / height)
+        img = img.resize((int(width * ratio), int(height * ratio)), Image.Resampling.LANCZOS)
+
+    quality = quality_start
+    compressed_data = None
+    while quality >= quality_min:
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+        compressed_data = output.getvalue()
+        if len(compressed_data) <= max_size_bytes:
+            break
+        quality -= 5
+
+    if len(compressed_data) > max_size_bytes:
+        width, height = img.size
+        while len(compressed_data) > max_size_bytes and max(width, height) > 512:
+            width = int(width * 0.9)
+            height = int(height * 0.9)
+            img_resized = img.resize((width, height), Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            img_resized.save(output, format='JPEG', quality=quality_min, optimize=True)
+            compressed_data = output.getvalue()
+
+    return compressed_data
+
+
+class JpegEncodeCounter:
+    """统计 JPEG 编码次数（包装 Image.save）"""
+
+    def __init__(self):
+        self.count = 0
+        self._original = Image.Image.save
+
+    def __enter__(self):
+        counter = self
+        original = self._original
+
+        def counting_save(image, fp, format=None, **params):
+            if (format or '').upper() == 'JPEG':
+                counter.count += 1
+            return original(image, fp, format, **params)
+
+        Image.Image.save = counting_save
+        return self
+
+    def __exit__(self, *exc):
+        Image.Image.save = self._original
+
+
+def load_inputs(directory: str) -> list:
+    """样例图片 + 放大 2 倍的 PNG 版本"""
+    inputs = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            data = f.read()
+        inputs.append((name, data))
+        img = _to_rgb(Image.open(io.BytesIO(data)))
+        output = io.BytesIO()
+        img.resize((img.size[0] * 2, img.size[1] * 2)).save(output, format="PNG")
+        inputs.append((f"{name}@2x", output.getvalue()))
+    return inputs
+
+
+def run(fn, data: bytes, max_size_kb: int):
+    with JpegEncodeCounter() as counter, contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        result = fn(data, max_size_kb=max_size_kb)
+        elapsed = time.perf_counter() - started
+    return counter.count, elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=os.path.join(ROOT, "images"), help="样例图片目录")
+    parser.add_argument("--targets", default="50,200", help="大小上限（KB），逗号分隔")
+    parser.add_argument("--verbose", action="store_true", help="输出每张图片的结果")
+    args = parser.parse_args()
+
+    inputs = load_inputs(args.images)
+    print(f"{len(inputs)} 张输入图片")
+    for max_size_kb in (int(v) for v in args.targets.split(",")):
+        totals = {"legacy": [0, 0.0], "current": [0, 0.0]}
+        over_budget = 0
+        for name, data in inputs:
+            row = []
+            for label, fn in (("legacy", legacy_compress_image), ("current", compress_image)):
+                encodes, elapsed, result = run(fn, data, max_size_kb)
+                totals[label][0] += encodes
+                totals[label][1] += elapsed
+                row.append(f"{label} {encodes:2d} 次 {elapsed * 1000:6.0f} ms {len(result) // 1024:4d} KB")
+                if label == "current" and len(result) > max_size_kb * 1024:
+                    over_budget += 1
+            if args.verbose:
+                print(f"  {max_size_kb}KB {name:24} " + " | ".join(row))
+        print(
+            f"max {max_size_kb}KB: 编码 {totals['legacy'][0]} -> {totals['current'][0]} 次，"
+            f"耗时 {totals['legacy'][1]:.2f}s -> {totals['current'][1]:.2f}s，"
+            f"超出上限 {over_budget} 张"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+图片处理池基准：多核吞吐量与对其他线程的延迟影响
+
+模拟多页图片同时保存：8 个提交线程把 process_saved_image（大小目标压缩 + 多尺寸版本）
+提交到图片处理池，同时一个每 10ms 唤醒一次的线程模拟 SSE 推送循环。
+依次测试 inline、thread、process 模式和不同的 IMAGE_POOL_WORKERS，输出：
+- 吞吐量（张/秒）及相对 inline 的加速比
+- 模拟线程的唤醒延迟（p50 / p99 / max），反映 GIL 争抢
+
+吞吐量随 worker 数的扩展取决于 CPU 核数，脚本开头会输出当前进程可用的核数。
+
+用法（在仓库根目录运行）：
+    python benchmarks/bench_image_pool.py [--workers 1,2,4] [--rounds 2]
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image  # noqa: E402
+
+from backend.utils import image_pool  # noqa: E402
+from backend.utils.image_compressor import process_saved_image  # noqa: E402
+
+SUBMIT_THREADS = 8
+TARGETS_KB = [50, 200]
+WIDTHS = [256, 720, 1440]
+FORMATS = ['jpeg', 'webp']
+TICK_INTERVAL = 0.01
+
+
+def load_inputs(directory: str) -> list:
+    """样例图片放大 2 倍（接近生成器输出的尺寸）"""
+    inputs = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
+            continue
+        img = Image.open(os.path.join(directory, name)).convert("RGB")
+        output = io.BytesIO()
+        img.resize((img.size[0] * 2, img.size[1] * 2)).save(output, format="PNG")
+        inputs.append(output.getvalue())
+    return inputs
+
+
+def quiet_process_saved_image(*args):
+    """
+    process_saved_image，在工作进程中丢弃压缩日志输出（模块级函数，可提交到进程池）
+
+    主进程中的输出由 measure 统一重定向（redirect_stdout 是全局的，不能在多个线程中各自切换）
+    """
+    if multiprocessing.parent_process() is None:
+        return process_saved_image(*args)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return process_saved_image(*args)
+
+
+def measure(mode: str, workers: int, inputs: list) -> dict:
+    os.environ['IMAGE_POOL_MODE'] = mode
+    os.environ['IMAGE_POOL_WORKERS'] = str(workers)
+    image_pool.reset_image_pool()
+    with contextlib.redirect_stdout(io.StringIO()):
+        return _measure(workers, inputs)
+
+
+def _measure(workers: int, inputs: list) -> dict:
+    # 预热：启动池（进程池需要 spawn 并导入模块），不计入耗时
+    with ThreadPoolExecutor(max(1, workers)) as warmup:
+        list(warmup.map(lambda data: image_pool.run_image_task(quiet_process_saved_image, data, [50], [], ['jpeg']),
+                        inputs[:max(1, workers)]))
+
+    delays = []
+    stop = threading.Event()
+
+    def ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            time.sleep(TICK_INTERVAL)
+            delays.append(time.perf_counter() - started - TICK_INTERVAL)
+
+    tick_thread = threading.Thread(target=ticker)
+    tick_thread.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(SUBMIT_THREADS) as submitters:
+        list(submitters.map(
+            lambda data: image_pool.run_image_task(quiet_process_saved_image, data, TARGETS_KB, WIDTHS, FORMATS),
+            inputs
+        ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    tick_thread.join()
+    # 等待池完全关闭，避免下一组配置与未退出的工作进程争抢 CPU
+    pool = image_pool.get_image_pool()
+    if pool is not None:
+        pool.shutdown(wait=True)
+    image_pool.reset_image_pool()
+
+    delays.sort()
+    return {
+        "elapsed": elapsed,
+        "throughput": len(inputs) / elapsed,
+        "p50": statistics.median(delays) * 1000,
+        "p99": delays[min(len(delays) - 1, int(len(delays) * 0.99))] * 1000,
+        "max": delays[-1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=os.path.join(ROOT, "images"), help="样例图片目录")
+    parser.add_argument("--workers", default="1,2,4", help="测试的 IMAGE_POOL_WORKERS，逗号分隔")
+    parser.add_argument("--rounds", type=int, default=2, help="输入图片重复的轮数")
+    args = parser.parse_args()
+
+    inputs = load_inputs(args.images) * args.rounds
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    print(f"可用 CPU 核数: {cpus}，{len(inputs)} 张图片，{SUBMIT_THREADS} 个提交线程")
+
+    configs = [("inline", 0)]
+    for workers in (int(v) for v in args.workers.split(",")):
+        configs += [("thread", workers), ("process", workers)]
+
+    baseline = None
+    for mode, workers in configs:
+        result = measure(mode, workers, inputs)
+        baseline = baseline or result["throughput"]
+        print(
+            f"  {mode:7} workers={workers}  {result['elapsed']:6.2f}s  {result['throughput']:5.2f} 张/秒 "
+            f"(x{result['throughput'] / baseline:.2f})  "
+            f"唤醒延迟 p50 {result['p50']:5.1f}ms p99 {result['p99']:6.1f}ms max {result['max']:6.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+多尺寸版本格式基准：JPEG / WebP / AVIF 的体积与保存耗时
+
+对 images/ 下的样例图片按 IMAGE_RENDITION_WIDTHS 的默认宽度生成多尺寸版本（不放大），
+统计：
+- 各格式全部版本的总字节数（即按 Accept 协商后客户端实际下载的体积）
+- 保存时只生成 JPEG、加 WebP、加 WebP + AVIF 三种配置下每张图片的平均耗时
+
+用法（在仓库根目录运行）：
+    python benchmarks/bench_renditions.py [--repeat 3] [--images DIR]
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend.utils.image_compressor import generate_renditions, supported_rendition_formats  # noqa: E402
+
+WIDTHS = (256, 720, 1440)
+# 保存时的格式配置（对应 IMAGE_RENDITION_FORMATS）
+FORMAT_SETS = (("jpeg",), ("jpeg", "webp"), ("jpeg", "webp", "avif"))
+
+
+def load_images(directory: str) -> list:
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
+            with open(os.path.join(directory, name), "rb") as f:
+                images.append((name, f.read()))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=os.path.join(ROOT, "images"), help="样例图片目录")
+    parser.add_argument("--repeat", type=int, default=3, help="计时重复次数（取最小值）")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    supported = supported_rendition_formats()
+    print(f"{len(images)} 张图片，宽度 {WIDTHS}，Pillow 支持的格式: {', '.join(supported)}")
+
+    # 各格式总体积（一次生成全部格式，保证各格式来自同一缩放结果）
+    totals = {fmt: 0 for fmt in supported}
+    for _, data in images:
+        for (_, fmt), encoded in generate_renditions(data, WIDTHS, supported).items():
+            totals[fmt] += len(encoded)
+    print("\n各格式总字节数：")
+    for fmt in supported:
+        change = (totals[fmt] / totals["jpeg"] - 1) * 100 if totals["jpeg"] else 0.0
+        print(f"  {fmt:5} {totals[fmt]:>10,}  ({change:+.1f}% vs jpeg)")
+
+    print("\n每张图片的平均保存耗时：")
+    for formats in FORMAT_SETS:
+        if not set(formats) <= set(supported):
+            print(f"  {' + '.join(formats):20} 跳过（Pillow 不支持）")
+            continue
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            for _, data in images:
+                generate_renditions(data, WIDTHS, formats)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"  {' + '.join(formats):20} {best / len(images) * 1000:7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
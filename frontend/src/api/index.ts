@@ -77,12 +77,13 @@ export async function generateOutline(
 
 // 获取图片 URL（新格式：task_id/filename）
 // thumbnail 参数：true=缩略图（默认），false=原图
-export function getImageUrl(taskId: string, filename: string, thumbnail: boolean = true): string {
-  const thumbParam = thumbnail ? '?thumbnail=true' : '?thumbnail=false'
+// width 参数：显示宽度（像素），返回合适尺寸的版本，优先于 thumbnail
+export function getImageUrl(taskId: string, filename: string, thumbnail: boolean = true, width?: number): string {
+  const thumbParam = width ? `?w=${width}` : (thumbnail ? '?thumbnail=true' : '?thumbnail=false')
   const token = getToken()
   const tokenParam = token ? `&token=${token}` : ''
-  const tsParam = `&t=${Date.now()}`
-  return `${API_BASE_URL}/images/${taskId}/${filename}${thumbParam}${tokenParam}${tsParam}`
+  // 不再追加时间戳：后端通过 ETag 协商缓存，图片未变化时只返回 304
+  return `${API_BASE_URL}/images/${taskId}/${filename}${thumbParam}${tokenParam}`
 }
 
 // 重新生成图片（即使成功的也可以重新生成）
@@ -109,7 +110,7 @@ export async function regenerateImage(
   return response.data
 }
 
-// 批量重试失败的图片（SSE）
+// 批量重试失败的图片（后台任务，通过 SSE 订阅进度）
 export async function retryFailedImages(
   taskId: string,
   pages: Page[],
@@ -136,54 +137,12 @@ export async function retryFailedImages(
       throw new Error(`HTTP error! status: ${response.status}`)
     }
 
-    const reader = response.body?.getReader()
-    if (!reader) {
-      throw new Error('无法读取响应流')
+    const job = await response.json()
+    if (!job.success || !job.job_id) {
+      throw new Error(job.error || '提交重试任务失败')
     }
 
-    const decoder = new TextDecoder()
-    let buffer = ''
-
-    while (true) {
-      const { done, value } = await reader.read()
-
-      if (done) break
-
-      buffer += decoder.decode(value, { stream: true })
-      const lines = buffer.split('\n\n')
-      buffer = lines.pop() || ''
-
-      for (const line of lines) {
-        if (!line.trim()) continue
-
-        const [eventLine, dataLine] = line.split('\n')
-        if (!eventLine || !dataLine) continue
-
-        const eventType = eventLine.replace('event: ', '').trim()
-        const eventData = dataLine.replace('data: ', '').trim()
-
-        try {
-          const data = JSON.parse(eventData)
-
-          switch (eventType) {
-            case 'retry_start':
-              onProgress({ index: -1, status: 'generating', message: data.message })
-              break
-            case 'complete':
-              onComplete(data)
-              break
-            case 'error':
-              onError(data)
-              break
-            case 'retry_finish':
-              onFinish(data)
-              break
-          }
-        } catch (e) {
-          console.error('解析 SSE 数据失败:', e)
-        }
-      }
-    }
+    await followJobEvents(job.job_id, { onProgress, onComplete, onError, onFinish })
   } catch (error) {
     onStreamError(error as Error)
   }
@@ -318,7 +277,117 @@ export async function getHistoryStats(): Promise<{
   return response.data
 }
 
-// 使用 POST 方式生成图片（更可靠）
+interface JobEventHandlers {
+  onProgress: (event: ProgressEvent) => void
+  onComplete: (event: ProgressEvent) => void
+  onError: (event: ProgressEvent) => void
+  onFinish: (event: any) => void
+}
+
+// 订阅后台任务的进度事件（SSE），从 lastEventId 之后开始接收
+// 返回是否已收到结束事件，以及最后收到的事件 ID（用于断线重连）
+export async function streamJobEvents(
+  jobId: string,
+  handlers: JobEventHandlers,
+  lastEventId: number = 0
+): Promise<{ finished: boolean; lastEventId: number }> {
+  const response = await fetch(`${API_BASE_URL}/jobs/${jobId}/events`, {
+    headers: {
+      ...(getToken() ? { Authorization: `Bearer ${getToken()}` } : {}),
+      ...(lastEventId > 0 ? { 'Last-Event-ID': String(lastEventId) } : {})
+    }
+  })
+
+  if (!response.ok) {
+    throw new Error(`HTTP error! status: ${response.status}`)
+  }
+
+  const reader = response.body?.getReader()
+  if (!reader) {
+    throw new Error('无法读取响应流')
+  }
+
+  const decoder = new TextDecoder()
+  let buffer = ''
+  let finished = false
+
+  while (true) {
+    const { done, value } = await reader.read()
+
+    if (done) break
+
+    buffer += decoder.decode(value, { stream: true })
+    const lines = buffer.split('\n\n')
+    buffer = lines.pop() || ''
+
+    for (const line of lines) {
+      if (!line.trim()) continue
+
+      const [eventLine, dataLine, idLine] = line.split('\n')
+      if (!eventLine || !dataLine) continue
+
+      const eventType = eventLine.replace('event: ', '').trim()
+      const eventData = dataLine.replace('data: ', '').trim()
+
+      try {
+        const data = JSON.parse(eventData)
+
+        switch (eventType) {
+          case 'progress':
+            handlers.onProgress(data)
+            break
+          case 'retry_start':
+            handlers.onProgress({ index: -1, status: 'generating', message: data.message })
+            break
+          case 'complete':
+            handlers.onComplete(data)
+            break
+          case 'error':
+            handlers.onError(data)
+            break
+          case 'finish':
+          case 'retry_finish':
+            finished = true
+            handlers.onFinish(data)
+            break
+        }
+      } catch (e) {
+        console.error('解析 SSE 数据失败:', e)
+      }
+
+      if (idLine && idLine.startsWith('id:')) {
+        lastEventId = Number(idLine.slice(3).trim()) || lastEventId
+      }
+    }
+  }
+
+  return { finished, lastEventId }
+}
+
+// 持续订阅后台任务直到结束；连接中断时带上最后的事件 ID 重连，只接收之后的事件
+async function followJobEvents(jobId: string, handlers: JobEventHandlers) {
+  let finished = false
+  let lastEventId = 0
+  let attempts = 0
+  while (!finished) {
+    try {
+      const result = await streamJobEvents(jobId, handlers, lastEventId)
+      finished = result.finished
+      if (result.lastEventId > lastEventId) {
+        // 有新进展时重置重试次数
+        attempts = 0
+        lastEventId = result.lastEventId
+      }
+      if (!finished) throw new Error('进度连接已断开')
+    } catch (e) {
+      attempts++
+      if (attempts > 5) throw e
+      await new Promise(resolve => setTimeout(resolve, 2000))
+    }
+  }
+}
+
+// 使用 POST 方式提交生成任务，并订阅进度（更可靠）
 export async function generateImagesPost(
   pages: Page[],
   taskId: string | null,
@@ -347,6 +416,7 @@ export async function generateImagesPost(
       )
     }
 
+    // 提交后台生成任务，立即返回任务 ID
     const response = await fetch(`${API_BASE_URL}/generate`, {
       method: 'POST',
       headers: {
@@ -366,54 +436,13 @@ export async function generateImagesPost(
       throw new Error(`HTTP error! status: ${response.status}`)
     }
 
-    const reader = response.body?.getReader()
-    if (!reader) {
-      throw new Error('无法读取响应流')
+    const job = await response.json()
+    if (!job.success || !job.job_id) {
+      throw new Error(job.error || '提交生成任务失败')
     }
 
-    const decoder = new TextDecoder()
-    let buffer = ''
-
-    while (true) {
-      const { done, value } = await reader.read()
-
-      if (done) break
-
-      buffer += decoder.decode(value, { stream: true })
-      const lines = buffer.split('\n\n')
-      buffer = lines.pop() || ''
-
-      for (const line of lines) {
-        if (!line.trim()) continue
-
-        const [eventLine, dataLine] = line.split('\n')
-        if (!eventLine || !dataLine) continue
-
-        const eventType = eventLine.replace('event: ', '').trim()
-        const eventData = dataLine.replace('data: ', '').trim()
-
-        try {
-          const data = JSON.parse(eventData)
-
-          switch (eventType) {
-            case 'progress':
-              onProgress(data)
-              break
-            case 'complete':
-              onComplete(data)
-              break
-            case 'error':
-              onError(data)
-              break
-            case 'finish':
-              onFinish(data)
-              break
-          }
-        } catch (e) {
-          console.error('解析 SSE 数据失败:', e)
-        }
-      }
-    }
+    // 订阅任务进度；连接中断时从断点继续（生成在后台进行，不受影响）
+    await followJobEvents(job.job_id, { onProgress, onComplete, onError, onFinish })
   } catch (error) {
     onStreamError(error as Error)
   }
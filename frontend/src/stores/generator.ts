@@ -203,11 +203,14 @@ export const useGeneratorStore = defineStore('generator', {
         const wasNotDone = image.status !== 'done'  // 记录之前是否不是 done
         image.status = status
         if (url) {
-          // 为图片 URL 添加认证 token 和时间戳（绕过缓存）
+          // 为图片 URL 添加认证 token；后端返回的 URL 带内容版本号（v=），
+          // 内容变化时 URL 随之变化，只有不带版本号时才追加时间戳绕过缓存
           const token = localStorage.getItem('access_token') || ''
           const tokenParam = token ? `&token=${token}` : ''
           const timestamp = Date.now()
-          image.url = url.includes('?') ? `${url}&t=${timestamp}${tokenParam}` : `${url}?thumbnail=true&t=${timestamp}${tokenParam}`
+          let fullUrl = url.includes('thumbnail=') ? url : `${url}${url.includes('?') ? '&' : '?'}thumbnail=true`
+          if (!/[?&]v=/.test(url)) fullUrl += `&t=${timestamp}`
+          image.url = `${fullUrl}${tokenParam}`
         }
         if (error) image.error = error
 
@@ -224,7 +227,7 @@ export const useGeneratorStore = defineStore('generator', {
         const timestamp = Date.now()
         const token = localStorage.getItem('access_token') || ''
         const tokenParam = token ? `&token=${token}` : ''
-        image.url = `${newUrl}?t=${timestamp}${tokenParam}`
+        image.url = `${newUrl}${newUrl.includes('?') ? '&' : '?'}t=${timestamp}${tokenParam}`
         image.status = 'done'
         delete image.error
       }
@@ -0,0 +1,63 @@
+"""
+Chat Completions 增量解析测试
+"""
+import json
+
+import pytest
+
+from backend.utils.chat_stream import ChatStreamParser
+from backend.utils.text_client import TextChatClient
+
+
+def _sse_event(content):
+    return b"data: " + json.dumps({"choices": [{"delta": {"content": content}}]}).encode() + b"\n\n"
+
+
+def _feed(parts):
+    """逐个 delta 喂给解析器，检测到完整图片时停止"""
+    parser = ChatStreamParser("text/event-stream", detect_image=True)
+    for part in parts:
+        if parser.feed(_sse_event(part)):
+            break
+    return parser
+
+
+def test_markdown_image_with_parenthesis_in_alt_text_is_read_to_the_end():
+    parser = _feed(["图片 ![示例 (1)", " 号]", "(data:image/png;base64,AAAA", "BBBB", ")", " 之后的说明"])
+
+    assert parser.image_complete
+    assert "![示例 (1) 号](data:image/png;base64,AAAABBBB)" in parser.content
+    assert "之后的说明" not in parser.content
+
+
+def test_markdown_image_not_complete_before_link_closes():
+    parser = _feed(["![a (1) b]", "(https://example.com/1.png"])
+
+    assert not parser.image_complete
+    assert not parser.done
+
+
+def test_markdown_markers_split_across_deltas():
+    parser = _feed(["x !", "[alt", "]", "(u", ")"])
+
+    assert parser.image_complete
+    assert parser.content == "x ![alt](u)"
+
+
+class _JsonResponse:
+    """非流式 JSON 响应"""
+
+    headers = {"Content-Type": "application/json"}
+
+    def __init__(self, body):
+        self._body = json.dumps(body).encode()
+
+    def iter_content(self, chunk_size=None):
+        yield self._body
+
+
+def test_text_client_rejects_non_stream_response_without_content():
+    client = TextChatClient(api_key="k")
+    with pytest.raises(Exception, match="无法从响应中提取内容"):
+        client._parse_chat_response(_JsonResponse({"choices": [{"message": {"role": "assistant"}}]}))
+    assert client._parse_chat_response(_JsonResponse({"choices": [{"message": {"content": "大纲"}}]})) == "大纲"
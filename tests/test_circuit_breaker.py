@@ -0,0 +1,89 @@
+"""
+熔断器故障分类测试
+
+只有连接失败、超时和 5xx 计入上游故障；错误文案中出现"网络连接"等字样的
+安全过滤、空响应、4xx、429 不应触发熔断。
+"""
+import pytest
+import requests
+from google.genai import errors as genai_errors
+
+from backend.generators.google_genai import parse_genai_error
+from backend.utils.circuit_breaker import (
+    STATE_CLOSED,
+    STATE_OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    is_upstream_failure,
+)
+from backend.utils.http_session import UpstreamHTTPError
+
+# google_genai 生成器在 API 返回空结果（多为安全过滤）时抛出的异常
+SAFETY_BLOCKED_ERROR = ValueError(
+    "❌ 图片生成失败：API 返回为空\n\n"
+    "【可能原因】\n"
+    "1. 提示词触发了安全过滤（最常见）\n"
+    "【解决方案】\n"
+    "3. 检查网络连接后重试"
+)
+
+
+def _wrapped(original):
+    """模拟重试装饰器：在 except 中把原始异常包装成友好提示"""
+    try:
+        raise original
+    except Exception as e:
+        try:
+            raise Exception(parse_genai_error(e))
+        except Exception as wrapped:
+            return wrapped
+
+
+def test_safety_blocked_error_is_not_upstream_failure():
+    assert not is_upstream_failure(SAFETY_BLOCKED_ERROR)
+    # parse_genai_error 的默认提示同样包含"检查网络连接是否正常"
+    wrapped = _wrapped(SAFETY_BLOCKED_ERROR)
+    assert "网络连接" in str(wrapped)
+    assert not is_upstream_failure(wrapped)
+
+
+def test_safety_blocked_errors_do_not_open_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    for error in (SAFETY_BLOCKED_ERROR, _wrapped(SAFETY_BLOCKED_ERROR)):
+        with pytest.raises(Exception):
+            with breaker.guard():
+                raise error
+    assert breaker.state == STATE_CLOSED
+    assert breaker.consecutive_failures == 0
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.ConnectionError("refused"),
+    requests.exceptions.Timeout("read timeout"),
+    UpstreamHTTPError(502, "Image API 请求失败 (状态码: 502)"),
+    genai_errors.ServerError(503, {"error": {"code": 503, "status": "UNAVAILABLE", "message": "overloaded"}}),
+])
+def test_transport_errors_and_5xx_are_upstream_failures(error):
+    assert is_upstream_failure(error)
+    assert is_upstream_failure(_wrapped(error))
+
+
+@pytest.mark.parametrize("error", [
+    UpstreamHTTPError(400, "❌ Chat API 请求失败 (状态码: 400)"),
+    UpstreamHTTPError(429, "⏳ API 配额或速率限制"),
+    genai_errors.ClientError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": "quota"}}),
+    CircuitOpenError("熔断中"),
+])
+def test_client_errors_are_not_upstream_failures(error):
+    assert not is_upstream_failure(error)
+
+
+def test_connection_errors_open_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            with breaker.guard():
+                raise requests.exceptions.ConnectionError("refused")
+    assert breaker.state == STATE_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
@@ -0,0 +1,78 @@
+"""
+请求对冲测试
+
+主请求变慢时，对冲请求先完成即返回，不等待主请求。
+"""
+import threading
+import time
+
+import pytest
+
+from backend.utils.hedging import run_hedged
+from backend.utils.rate_limiter import RequestCancelled
+
+
+def _request(duration, result, started=None, error=None):
+    """模拟一次上游请求：拿到名额后 begin()，耗时 duration 秒"""
+    def call(attempt):
+        if started is not None:
+            started.wait()
+        attempt.begin()
+        time.sleep(duration)
+        if error is not None:
+            raise error
+        attempt.complete()
+        return result
+    return call
+
+
+def test_fast_hedge_returns_without_waiting_for_slow_primary():
+    started = time.monotonic()
+    result, hedge_won = run_hedged(_request(3.0, "primary"), _request(0.1, "hedge"), delay=0.2)
+    elapsed = time.monotonic() - started
+
+    assert (result, hedge_won) == ("hedge", True)
+    # 约为 delay + 对冲请求耗时，远小于主请求的 3 秒
+    assert elapsed < 1.0
+
+
+def test_fast_primary_does_not_hedge():
+    hedged = []
+    result, hedge_won = run_hedged(
+        _request(0.05, "primary"), _request(0.05, "hedge"), delay=1.0, on_hedge=lambda: hedged.append(1)
+    )
+    assert (result, hedge_won) == ("primary", False)
+    assert hedged == []
+
+
+def test_queued_loser_is_cancelled():
+    release_hedge = threading.Event()
+    hedge_outcome = []
+
+    def hedge(attempt):
+        release_hedge.wait()
+        try:
+            attempt.begin()
+        except RequestCancelled:
+            hedge_outcome.append("cancelled")
+            raise
+        hedge_outcome.append("ran")
+        return "hedge"
+
+    result, hedge_won = run_hedged(_request(0.4, "primary"), hedge, delay=0.1)
+    release_hedge.set()
+    assert (result, hedge_won) == ("primary", False)
+    for _ in range(50):
+        if hedge_outcome:
+            break
+        time.sleep(0.02)
+    assert hedge_outcome == ["cancelled"]
+
+
+def test_primary_error_raised_when_both_fail():
+    with pytest.raises(RuntimeError, match="primary"):
+        run_hedged(
+            _request(0.3, None, error=RuntimeError("primary")),
+            _request(0.1, None, error=RuntimeError("hedge")),
+            delay=0.1,
+        )
@@ -0,0 +1,50 @@
+"""
+保存图片处理测试
+
+压缩和多尺寸版本共用一次解码结果。
+"""
+import io
+
+from PIL import Image
+
+from backend.utils import image_compressor
+from backend.utils.image_compressor import process_saved_image
+
+
+def _noise_png(width, height):
+    output = io.BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_process_saved_image_decodes_once(monkeypatch):
+    calls = []
+    to_rgb = image_compressor._to_rgb
+
+    def counting_to_rgb(img):
+        calls.append(img.size)
+        return to_rgb(img)
+
+    monkeypatch.setattr(image_compressor, "_to_rgb", counting_to_rgb)
+    data = _noise_png(800, 600)
+    compressed, renditions = process_saved_image(data, [20, 40], [256, 400, 1600], ["jpeg"])
+
+    assert calls == [(800, 600)]
+    assert set(compressed) == {20, 40}
+    assert all(len(compressed[kb]) < len(data) for kb in compressed)
+    assert set(renditions) == {(400, "jpeg"), (256, "jpeg")}
+    assert Image.open(io.BytesIO(renditions[(256, "jpeg")])).size == (256, 192)
+
+
+def test_process_saved_image_skips_decode_when_nothing_to_do(monkeypatch):
+    monkeypatch.setattr(image_compressor, "_to_rgb", lambda img: (_ for _ in ()).throw(AssertionError("decoded")))
+    data = _noise_png(200, 100)
+    compressed, renditions = process_saved_image(data, [10 ** 6], [400], ["jpeg"])
+    assert compressed == {10 ** 6: data}
+    assert renditions == {}
+
+
+def test_process_saved_image_keeps_original_on_bad_data():
+    compressed, renditions = process_saved_image(b"not an image", [1], [256], ["jpeg"])
+    assert compressed == {1: b"not an image"}
+    assert renditions == {}
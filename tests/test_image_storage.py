@@ -0,0 +1,217 @@
+"""
+图片元数据查询测试
+
+扫描、同步和重新生成时只需要文件名、索引和哈希等元数据，
+不应读取图片二进制（blob 存储文件或旧版 BLOB 列）。
+"""
+import json
+import os
+
+os.environ.setdefault("SQLITE_PATH", "sqlite://")
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+from backend.db import Base, SessionLocal, engine as default_engine
+from backend.models import History, Image, User
+from backend.services.history import HistoryService
+from backend.services.image import ImageService
+from backend.services.task_state import get_task_state_store
+from backend.utils import blob_store
+from backend.utils.blob_store import LocalBlobStore, set_blob_store
+
+TASK_ID = "task_blobtest"
+
+# 旧版 images 表中存放图片二进制的列
+LEGACY_BLOB_COLUMNS = ("image_data", "thumbnail_data")
+
+
+class SpyBlobStore(LocalBlobStore):
+    """记录 read 调用的 blob 存储"""
+
+    def __init__(self, root_dir):
+        super().__init__(root_dir)
+        self.reads = []
+
+    def read(self, blob_hash):
+        self.reads.append(blob_hash)
+        return super().read(blob_hash)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """临时 SQLite 数据库 + 临时 blob 存储，记录执行的 SQL"""
+    db_engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(db_engine)
+    with db_engine.begin() as conn:
+        # 模拟旧库中仍保留的 BLOB 列
+        for column in LEGACY_BLOB_COLUMNS:
+            conn.execute(text(f"ALTER TABLE images ADD COLUMN {column} BLOB"))
+
+    SessionLocal.remove()
+    SessionLocal.configure(bind=db_engine)
+    previous_store = blob_store._store_instance
+    store = SpyBlobStore(str(tmp_path / "blobs"))
+    set_blob_store(store)
+
+    db = SessionLocal()
+    try:
+        user = User(username="blobtest", password_hash="x")
+        db.add(user)
+        db.commit()
+        user_id = user.id
+        outline = json.dumps({"pages": [{"index": i} for i in range(3)]})
+        db.add(History(id="record-1", user_id=user_id, title="测试", outline=outline, task_id=TASK_ID))
+        for index in range(3):
+            image_hash = store.store(f"image-{index}".encode())
+            thumbnail_hash = store.store(f"thumb-{index}".encode())
+            db.add(Image(
+                user_id=user_id, task_id=TASK_ID, index=index, filename=f"{index + 1}.png",
+                image_hash=image_hash, image_size=7, mime_type="image/png",
+                thumbnail_hash=thumbnail_hash, thumbnail_size=7, thumbnail_mime_type="image/png",
+            ))
+        db.commit()
+        db.execute(text("UPDATE images SET image_data = :data, thumbnail_data = :data"), {"data": b"\x00" * 1024})
+        db.commit()
+    finally:
+        db.close()
+
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", record_statement)
+    store.reads.clear()
+    try:
+        yield {"user_id": user_id, "store": store, "statements": statements, "tmp_path": tmp_path}
+    finally:
+        event.remove(db_engine, "before_cursor_execute", record_statement)
+        SessionLocal.remove()
+        SessionLocal.configure(bind=default_engine)
+        set_blob_store(previous_store)
+        db_engine.dispose()
+
+
+def _make_image_service(user_id, history_dir):
+    """不加载服务商配置的 ImageService（只测试数据库读写）"""
+    service = ImageService.__new__(ImageService)
+    service.user_id = user_id
+    service.history_root_dir = str(history_dir)
+    service.current_task_dir = None
+    service._task_states = get_task_state_store()
+    return service
+
+
+def _assert_metadata_only(storage):
+    """没有读取 blob 文件，也没有查询 BLOB 列或整行 Image"""
+    assert storage["store"].reads == []
+    image_selects = [s for s in storage["statements"] if s.lstrip().upper().startswith("SELECT") and "FROM images" in s]
+    assert image_selects, "应至少查询一次 images 表"
+    for statement in storage["statements"]:
+        for column in LEGACY_BLOB_COLUMNS:
+            assert column not in statement, statement
+    for statement in image_selects:
+        # 整行加载 ORM 对象时会选中 created_at
+        assert "images.created_at" not in statement, statement
+
+
+def test_scan_and_sync_task_images_reads_no_blobs(storage):
+    result = HistoryService().scan_and_sync_task_images(TASK_ID, storage["user_id"])
+
+    assert result["success"]
+    assert sorted(result["images"]) == ["1.png", "2.png", "3.png"]
+    _assert_metadata_only(storage)
+
+
+def test_sync_images_with_pages_reads_no_blobs(storage):
+    history_dir = storage["tmp_path"] / "history"
+    (history_dir / TASK_ID).mkdir(parents=True)
+    service = _make_image_service(storage["user_id"], history_dir)
+
+    service.sync_images_with_pages(TASK_ID, [0, 1])
+
+    db = SessionLocal()
+    try:
+        remaining = sorted(row.index for row in db.query(Image.index).filter(Image.task_id == TASK_ID))
+    finally:
+        db.close()
+    assert remaining == [0, 1]
+    _assert_metadata_only(storage)
+
+
+def test_regenerate_image_lookup_reads_no_blobs(storage, monkeypatch):
+    service = _make_image_service(storage["user_id"], storage["tmp_path"] / "history")
+    monkeypatch.setattr(service, "_generate_page", lambda *args, **kwargs: (b"new-image", "fake"))
+    saved = {}
+
+    def fake_save(image_data, filename, task_dir=None, **kwargs):
+        saved["filename"] = filename
+        return "0" * 64
+
+    monkeypatch.setattr(service, "_save_image", fake_save)
+
+    result = service.regenerate_image(TASK_ID, {"index": 1, "type": "content", "content": "p1"}, use_reference=False)
+
+    assert result["success"]
+    # 继承旧记录的文件名
+    assert saved["filename"] == "2.png"
+    _assert_metadata_only(storage)
+
+
+def _image_row(index):
+    db = SessionLocal()
+    try:
+        return db.query(Image.filename, Image.image_hash, Image.thumbnail_hash).filter_by(
+            task_id=TASK_ID, index=index
+        ).first()
+    finally:
+        db.close()
+
+
+def test_regenerate_image_keeps_old_record_when_save_fails(storage, monkeypatch):
+    service = _make_image_service(storage["user_id"], storage["tmp_path"] / "history")
+    monkeypatch.setattr(service, "_generate_page", lambda *args, **kwargs: (b"new-image", "fake"))
+    before = _image_row(1)
+
+    def failing_save(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(service, "_save_image", failing_save)
+
+    with pytest.raises(OSError):
+        service.regenerate_image(TASK_ID, {"index": 1, "type": "content", "content": "p1"}, use_reference=False)
+
+    # 旧记录和它引用的 blob 都还在
+    assert _image_row(1) == before
+    assert storage["store"].exists(before.image_hash)
+    assert storage["store"].exists(before.thumbnail_hash)
+
+
+def test_regenerate_image_replaces_record_and_releases_old_blobs(storage, monkeypatch):
+    from io import BytesIO
+
+    from PIL import Image as PILImage
+
+    from backend.utils import image_pool
+
+    monkeypatch.setenv("IMAGE_POOL_MODE", "inline")
+    image_pool.reset_image_pool()
+    buffer = BytesIO()
+    PILImage.new("RGB", (64, 64), (200, 10, 10)).save(buffer, format="PNG")
+    service = _make_image_service(storage["user_id"], storage["tmp_path"] / "history")
+    monkeypatch.setattr(service, "_generate_page", lambda *args, **kwargs: (buffer.getvalue(), "fake"))
+    before = _image_row(1)
+
+    try:
+        result = service.regenerate_image(TASK_ID, {"index": 1, "type": "content", "content": "p1"}, use_reference=False)
+    finally:
+        image_pool.reset_image_pool()
+
+    assert result["success"]
+    after = _image_row(1)
+    assert after.filename == before.filename
+    assert after.image_hash != before.image_hash
+    assert storage["store"].exists(after.image_hash)
+    assert not storage["store"].exists(before.image_hash)
+    assert not storage["store"].exists(before.thumbnail_hash)